@@ -0,0 +1,17 @@
+from analysis.runs import Run, Series, load_run, load_runs, run_time, RUN_TIMEZONE
+from analysis.alignment import common_grid, resample, total, align
+from analysis.energy import POWER_METRICS, integrate, run_energy, energy_table
+from analysis.stats import SUMMARY_METRICS, run_summary, summary_table, bootstrap_means, compare
+from analysis.attribution import (
+    SERVICE_METRICS, invocations_from_snapshots, invocations_from_access_log, attach_access_log, split_by_overlap, attribute,
+    attribution_tables,
+)
+
+__all__ = [
+    "Run", "Series", "load_run", "load_runs", "run_time", "RUN_TIMEZONE",
+    "common_grid", "resample", "total", "align",
+    "POWER_METRICS", "integrate", "run_energy", "energy_table",
+    "SUMMARY_METRICS", "run_summary", "summary_table", "bootstrap_means", "compare",
+    "SERVICE_METRICS", "invocations_from_snapshots", "invocations_from_access_log", "attach_access_log",
+    "split_by_overlap", "attribute", "attribution_tables",
+]
@@ -0,0 +1,36 @@
+import argparse
+import os
+import time
+
+from analysis import load_runs, energy_table, summary_table, compare, SUMMARY_METRICS
+from run_catalog import RunCatalog, CATALOG_PATH, parse_filter
+
+CATALOG_FIELDS = ["variant", "platform", "n_rows"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Energy per run and reuse vs no-reuse effects over the treatment window")
+    parser.add_argument("filters", nargs="*", help="catalog filters, e.g. variant=reuse users=1000")
+    parser.add_argument("--root", default="data")
+    parser.add_argument("--catalog", default=CATALOG_PATH)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default="energy.csv")
+    parser.add_argument("--report", default=None, help="also write bootstrap effect sizes here")
+    parser.add_argument("--resamples", type=int, default=20000)
+    args = parser.parse_intermixed_args()
+
+    with RunCatalog(args.catalog) as catalog:
+        catalog.update(args.root)
+        selected = catalog.find(**dict(parse_filter(f) for f in args.filters))
+
+    start = time.perf_counter()
+    runs = load_runs([os.path.join(args.root, r["run_dir"]) for r in selected], SUMMARY_METRICS, args.workers)
+    table = energy_table(runs)
+    table.insert(1, "variant", [r["variant"] for r in selected])
+    table.to_csv(args.output, index=False)
+    print(f"✅ {len(runs)} runs in {time.perf_counter() - start:.2f}s, energy per run in {args.output}")
+
+    if args.report:
+        info = [{k: r[k] for k in CATALOG_FIELDS} for r in selected]
+        report = compare(summary_table(runs, info), n_resamples=args.resamples)
+        report.to_csv(args.report, index=False)
+        print(f"✅ {len(report)} comparisons in {time.perf_counter() - start:.2f}s, report in {args.report}")
@@ -0,0 +1,52 @@
+from typing import Optional
+
+import numpy as np
+
+from analysis.runs import Run, Series
+
+
+def common_grid(runs: list[Run], step: float = 5.0) -> np.ndarray:
+    """Seconds since treatment start, long enough for the longest treatment"""
+    longest = max((run.duration for run in runs), default=0.0)
+    return np.arange(0.0, longest + step / 2, step)
+
+
+def _bounds(series: Series) -> np.ndarray:
+    # samples are sorted by series code, so each series is one contiguous slice
+    return np.searchsorted(series.series, np.arange(series.n_series + 1))
+
+
+def resample(series: Series, grid: np.ndarray) -> np.ndarray:
+    """
+    Linear interpolation of every series onto grid, shape (n_series, len(grid)).
+    Grid points outside a series' first and last sample are NaN, not extrapolated.
+    """
+    bounds = _bounds(series)
+    out = np.full((series.n_series, len(grid)), np.nan)
+    for i in range(series.n_series):
+        t = series.t[bounds[i]:bounds[i + 1]]
+        if len(t):
+            out[i] = np.interp(grid, t, series.values[bounds[i]:bounds[i + 1]], left=np.nan, right=np.nan)
+    return out
+
+
+def total(series: Series, grid: np.ndarray) -> np.ndarray:
+    """Sum over all series at each grid point; NaN only where no series has data"""
+    matrix = resample(series, grid)
+    covered = ~np.isnan(matrix).all(axis=0)
+    return np.where(covered, np.nansum(matrix, axis=0), np.nan)
+
+
+def align(runs: list[Run], metric: str, step: float = 5.0, grid: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Per-run totals of one metric on a shared grid, shape (len(runs), len(grid)).
+    Rows are NaN past each run's treatment end and for runs without the metric.
+    """
+    if grid is None:
+        grid = common_grid(runs, step)
+    out = np.full((len(runs), len(grid)), np.nan)
+    for i, run in enumerate(runs):
+        if metric in run.metrics:
+            out[i] = total(run.metrics[metric], grid)
+            out[i, grid > run.duration] = np.nan
+    return grid, out
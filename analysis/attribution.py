@@ -0,0 +1,329 @@
+import json
+import os
+import re
+from logging import getLogger
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from analysis.runs import Run, Series, load_run, run_time
+from pipeline.dag_utils import called_service
+from pipeline.service_proxy import output_dir
+
+log = getLogger("experiment.attribution")
+
+# per-pod rate metrics and what their integral over time is
+SERVICE_METRICS = {
+    "kepler_container_power_watts": "joules",
+    "kepler_container_cpu_cycles": "cycles",
+    "kepler_container_cpu_instructions": "instructions",
+}
+ACCESS_LOG = "proxy-access.jsonl"  # service_proxy.py --access-log, inside a run directory
+AVOIDED_RESULTS = {"hit", "coalesced"}
+INVOCATION_COLUMNS = ["workflow", "pipeline", "stage", "artifact", "start", "end", "avoided", "source"]
+
+
+FUSED_CALL = re.compile(r"^\s*call (\S+) .*?https?://([a-z0-9-]+)[.:/]", re.MULTILINE)
+
+
+def _stage_of(template: dict, template_name: Optional[str], display_name: Optional[str]) -> Optional[str]:
+    # the service a curl template calls, else call-<stage>-service (parser_*),
+    # <stage> or <stage>-cached (auto-argo-generator)
+    service = called_service(template)
+    if service:
+        return service
+    name = template_name or display_name
+    if name and name.startswith("call-") and name.endswith("-service"):
+        return name[len("call-"):-len("-service")]
+    if name and name.endswith("-cached"):
+        return name[:-len("-cached")]
+    return name
+
+
+def _artifact(template: dict, node: dict) -> Optional[str]:
+    """Where a call writes: its cache_dir or, as the proxy logs it, the directory of its output fields"""
+    for p in (node.get("inputs") or {}).get("parameters") or []:
+        if p.get("name") == "cache_dir":
+            return p.get("value")
+    command = (template.get("container") or {}).get("command") or []
+    return output_dir([tuple(field.split("=", 1)) for field in map(str, command) if "=" in field])
+
+
+def invocations_from_snapshots(snapshots: list[dict], origin: pd.Timestamp) -> pd.DataFrame:
+    """
+    One row per stage call the recorded workflows made, in seconds since
+    origin. A pod is one call, unless it is a fused pod (coalesce.py) whose
+    calls output lists the calls it made itself. Skipped nodes are reuse
+    hits and count as avoided calls with no runtime.
+    """
+    rows = []
+    for snapshot in snapshots:
+        wf = snapshot["workflow"]
+        pipeline = (wf["metadata"].get("generateName") or wf["metadata"]["name"]).rstrip("-")
+        templates = {t["name"]: t for t in wf.get("spec", {}).get("templates", [])}
+        for node in ((wf.get("status") or {}).get("nodes") or {}).values():
+            if node.get("type") not in ("Pod", "Skipped"):
+                continue
+            template = templates.get(node.get("templateName"), {})
+            stage = _stage_of(template, node.get("templateName"), node.get("displayName"))
+            base = {"workflow": wf["metadata"]["name"], "pipeline": pipeline, "source": "workflow"}
+
+            if node.get("type") == "Skipped" or node.get("phase") == "Skipped":
+                t = (pd.Timestamp(node["startedAt"]) - origin).total_seconds() if node.get("startedAt") else np.nan
+                rows.append({**base, "stage": stage, "artifact": _artifact(template, node), "start": t, "end": t, "avoided": True})
+                continue
+            if not node.get("startedAt") or not node.get("finishedAt"):
+                continue
+
+            outputs = {p["name"]: p.get("value") for p in (node.get("outputs") or {}).get("parameters") or []}
+            if outputs.get("calls"):
+                fused = dict(FUSED_CALL.findall((template.get("script") or {}).get("source") or ""))
+                for line in outputs["calls"].splitlines():
+                    call = json.loads(line)
+                    start = pd.Timestamp(call["start"], unit="s", tz="UTC")
+                    rows.append({
+                        **base, "stage": fused.get(call["name"], call["name"]), "artifact": None,
+                        "start": (start - origin).total_seconds(),
+                        "end": (start - origin).total_seconds() + float(call.get("seconds") or 0.0),
+                        "avoided": False, "source": "fused",
+                    })
+                continue
+
+            rows.append({
+                **base, "stage": stage, "artifact": _artifact(template, node),
+                "start": (pd.Timestamp(node["startedAt"]) - origin).total_seconds(),
+                "end": (pd.Timestamp(node["finishedAt"]) - origin).total_seconds(),
+                "avoided": False,
+            })
+    return pd.DataFrame(rows, columns=INVOCATION_COLUMNS)
+
+
+def invocations_from_access_log(path: str, origin: pd.Timestamp, workflow_calls: pd.DataFrame) -> pd.DataFrame:
+    """
+    The proxy's view of the same calls: exact service side intervals, with
+    cache hits and coalesced calls as avoided ones. Each request inherits the
+    workflow and pipeline of the latest workflow call of its stage that
+    started before it.
+    """
+    requests = pd.read_json(path, lines=True)
+    if requests.empty:
+        return pd.DataFrame(columns=INVOCATION_COLUMNS)
+    calls = pd.DataFrame({
+        "stage": requests["service"],
+        "artifact": requests.get("output"),
+        "start": requests["start"] - origin.timestamp(),
+        "end": requests["end"] - origin.timestamp(),
+        "avoided": requests["result"].isin(AVOIDED_RESULTS),
+        "source": "proxy",
+    }).sort_values("start")
+    known = workflow_calls.dropna(subset=["start"]).sort_values("start")[["stage", "start", "workflow", "pipeline"]]
+    if known.empty:
+        calls["workflow"], calls["pipeline"] = None, "unknown"
+    else:
+        calls = pd.merge_asof(calls, known, on="start", by="stage", direction="backward")
+        calls["pipeline"] = calls["pipeline"].fillna("unknown")
+    return calls[INVOCATION_COLUMNS]
+
+
+def attach_access_log(run_dir: str) -> Optional[str]:
+    """
+    Copy the requests of a run's treatment window from the proxy access log
+    recorded in run.json into the run directory
+    """
+    with open(os.path.join(run_dir, "run.json"), "r") as f:
+        info = json.load(f)
+    source = (info.get("user_data") or {}).get("proxy_access_log")
+    target = os.path.join(run_dir, ACCESS_LOG)
+    if not source or os.path.exists(target):
+        return None
+    if not os.path.isfile(source):
+        # a hostPath on the proxy's node, see pipeline/service_proxy.py
+        log.warning(f"{run_dir}: recorded proxy access log {source} is not on this host, "
+                    f"copy it here or run on the proxy's node")
+        return None
+    # the proxy appends to one log across runs
+    start, end = run_time(info["treatment_start"]).timestamp(), run_time(info["treatment_end"]).timestamp()
+    with open(source, "r") as src, open(target, "w") as dst:
+        for line in src:
+            if line.strip() and start <= json.loads(line)["start"] <= end:
+                dst.write(line)
+    return target
+
+
+def segments(series: Series) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Linear pieces between consecutive samples of one series: (series, start, end, integral)"""
+    t, v, s = series.t, np.nan_to_num(series.values), series.series
+    same = s[1:] == s[:-1]
+    area = 0.5 * (v[:-1] + v[1:]) * (t[1:] - t[:-1])
+    return s[:-1][same], t[:-1][same], t[1:][same], area[same]
+
+
+def split_by_overlap(
+    seg_group: np.ndarray, seg_start: np.ndarray, seg_end: np.ndarray, seg_value: np.ndarray,
+    call_group: np.ndarray, call_start: np.ndarray, call_end: np.ndarray, n_groups: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Split every segment's value across the calls of its group that overlap it,
+    in proportion to the overlap. Segments of a group must not overlap each
+    other. Returns the value per call and, per group, the value of segments
+    no call overlapped.
+
+    Groups are laid side by side on one time axis, so a single searchsorted
+    finds the segment range of every call, and (call, segment) pairs are
+    expanded without a Python loop.
+    """
+    n_calls, n_segments = len(call_start), len(seg_start)
+    if n_segments == 0:
+        return np.zeros(n_calls), np.zeros(n_groups)
+    t0 = min(seg_start.min(), call_start.min() if n_calls else np.inf)
+    width = max(seg_end.max(), call_end.max() if n_calls else -np.inf) - t0 + 1.0
+
+    order = np.lexsort((seg_start, seg_group))
+    seg_group, seg_value = seg_group[order], seg_value[order]
+    lo = seg_group * width + (seg_start[order] - t0)
+    hi = seg_group * width + (seg_end[order] - t0)
+    a = call_group * width + (call_start - t0)
+    b = call_group * width + (call_end - t0)
+
+    first = np.searchsorted(hi, a, side="right")
+    last = np.searchsorted(lo, b, side="left") - 1
+    counts = np.clip(last - first + 1, 0, None)
+    pair_call = np.repeat(np.arange(n_calls), counts)
+    pair_seg = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    overlap = np.clip(np.minimum(b[pair_call], hi[pair_seg]) - np.maximum(a[pair_call], lo[pair_seg]), 0.0, None)
+    busy = np.bincount(pair_seg, weights=overlap, minlength=n_segments)
+    share = np.divide(overlap, busy[pair_seg], out=np.zeros_like(overlap), where=busy[pair_seg] > 0)
+    per_call = np.bincount(pair_call, weights=share * seg_value[pair_seg], minlength=n_calls)
+    unassigned = np.bincount(seg_group, weights=np.where(busy > 0, 0.0, seg_value), minlength=n_groups)
+    return per_call, unassigned
+
+
+def pod_stages(labels: list[str], stages: list[str]) -> np.ndarray:
+    """Index into stages of the service each pod series belongs to (<stage>-<replicaset>-<id>), -1 if none"""
+    by_length = sorted(range(len(stages)), key=lambda i: -len(stages[i]))
+    patterns = [(i, re.compile(rf"(^|/){re.escape(stages[i])}-[a-z0-9]+-[a-z0-9]+($|/)")) for i in by_length]
+    return np.array([next((i for i, p in patterns if p.search(label)), -1) for label in labels], dtype=np.int64)
+
+
+def attribute(run: Run, calls: pd.DataFrame, metrics: dict[str, str] = SERVICE_METRICS) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Split the per-pod metrics of a run across the calls each service pod
+    served: a pod's integral over a sample interval goes to the calls of its
+    stage running in that interval, in proportion to their overlap with it.
+    All replicas of a stage share its calls. Returns the calls with one column
+    per metric and, per stage, what was spent with no call running (idle).
+    When the export has no per-pod series, every call shares the whole
+    namespace total instead, and the idle row is named "*".
+    """
+    calls = calls.reset_index(drop=True).copy()
+    stages = sorted(calls["stage"].dropna().unique())
+    call_stage = pd.Categorical(calls["stage"], categories=stages).codes.astype(np.int64)
+    idle = pd.DataFrame(index=pd.Index(stages + ["*"], name="stage"))
+
+    for metric, unit in metrics.items():
+        calls[unit] = 0.0
+        idle[unit] = 0.0
+        if metric not in run.metrics:
+            continue
+        series = run.metrics[metric]
+        pod_stage = pod_stages(series.labels, stages)
+        pooled = not (pod_stage >= 0).any()
+        if pooled:
+            pod_stage = np.full(series.n_series, len(stages), dtype=np.int64)
+            stage_of_call = np.where(call_stage >= 0, len(stages), -1)
+        else:
+            stage_of_call = call_stage
+
+        # every call is split against each pod (replica) of its stage
+        pods = np.flatnonzero(pod_stage >= 0)
+        pods = pods[np.argsort(pod_stage[pods], kind="stable")]
+        pods_per_stage = np.bincount(pod_stage[pods], minlength=len(stages) + 1)
+        stage_offset = np.cumsum(pods_per_stage) - pods_per_stage
+        valid = np.flatnonzero(stage_of_call >= 0)
+        counts = pods_per_stage[stage_of_call[valid]]
+        copy_call = np.repeat(valid, counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        copy_group = pods[stage_offset[stage_of_call[copy_call]] + within]
+
+        seg_series, seg_start, seg_end, seg_value = segments(series)
+        start = calls["start"].to_numpy(dtype=float)
+        end = calls["end"].to_numpy(dtype=float)
+        per_copy, unassigned = split_by_overlap(
+            seg_series, seg_start, seg_end, seg_value,
+            copy_group, start[copy_call], end[copy_call], series.n_series,
+        )
+        calls[unit] = np.bincount(copy_call, weights=per_copy, minlength=len(calls))
+        idle_per_stage = np.bincount(pod_stage[pods], weights=unassigned[pods], minlength=len(stages) + 1)
+        idle[unit] = idle_per_stage
+    return calls, idle.loc[(idle != 0).any(axis=1)]
+
+
+def attribution_tables(calls: pd.DataFrame, idle: pd.DataFrame, unit: str = "joules") -> dict[str, pd.DataFrame]:
+    """
+    Per stage, per pipeline and per reused artifact: calls computed and
+    avoided, what the computed ones cost, and the estimate of what the
+    avoided ones saved (avoided calls x mean cost of a computed call of the
+    same stage in this run).
+    """
+    computed = calls[~calls["avoided"]]
+    per_call = computed.groupby("stage")[unit].mean()
+    calls = calls.assign(
+        computed=~calls["avoided"],
+        avoided_cost=np.where(calls["avoided"], calls["stage"].map(per_call).fillna(0.0), 0.0),
+    )
+
+    def summarize(keys):
+        grouped = calls.groupby(keys)
+        return pd.DataFrame({
+            "calls": grouped.size(),
+            "computed": grouped["computed"].sum(),
+            "avoided": grouped["avoided"].sum(),
+            unit: grouped[unit].sum(),
+            f"avoided_{unit}": grouped["avoided_cost"].sum(),
+        })
+
+    by_stage = summarize("stage")
+    by_stage[f"{unit}_per_call"] = per_call.reindex(by_stage.index)
+    by_stage[f"idle_{unit}"] = idle[unit].reindex(by_stage.index).fillna(0.0) if unit in idle else 0.0
+    reused = calls[calls["avoided"]].fillna({"artifact": "-"})
+    by_artifact = reused.groupby(["stage", "artifact"]).agg(avoided=("avoided", "size"), **{f"avoided_{unit}": ("avoided_cost", "sum")})
+    return {
+        "stages": by_stage.sort_values(unit, ascending=False),
+        "pipelines": summarize("pipeline").sort_values(unit, ascending=False),
+        "artifacts": by_artifact.sort_values(f"avoided_{unit}", ascending=False),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from workflow_status import attach, load_snapshots
+
+    parser = argparse.ArgumentParser(description="Split per-pod Kepler metrics across the stage calls the pods served")
+    parser.add_argument("run_dir")
+    parser.add_argument("--access-log", default=None, help=f"proxy access log, defaults to <run_dir>/{ACCESS_LOG} if present")
+    parser.add_argument("--output-dir", default=None, help="defaults to the run directory")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    attach(args.run_dir)
+    attach_access_log(args.run_dir)
+    run = load_run(args.run_dir, list(SERVICE_METRICS))
+    calls = invocations_from_snapshots(load_snapshots(args.run_dir), run.treatment_start)
+    access_log = args.access_log or os.path.join(args.run_dir, ACCESS_LOG)
+    if os.path.exists(access_log):
+        calls = invocations_from_access_log(access_log, run.treatment_start, calls)
+    if calls.empty:
+        raise SystemExit(f"{args.run_dir}: no recorded workflow status or proxy access log to attribute to")
+
+    calls, idle = attribute(run, calls)
+    tables = attribution_tables(calls, idle)
+    output_dir = args.output_dir or args.run_dir
+    calls.to_csv(os.path.join(output_dir, "attribution-calls.csv"), index=False)
+    for name, table in tables.items():
+        table.to_csv(os.path.join(output_dir, f"attribution-{name}.csv"))
+    print(tables["stages"].round(2).to_string())
+    print(f"✅ {len(calls)} calls attributed in {time.perf_counter() - start:.2f}s, tables in {output_dir}")
@@ -0,0 +1,54 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from analysis.runs import Run, Series
+
+POWER_METRICS = ["kepler_container_power_watts", "kepler_node_cpu_power_sum", "wall_power"]
+
+
+def integrate(series: Series, start: float = 0.0, end: Optional[float] = None) -> np.ndarray:
+    """
+    Joules per series: trapezoidal integral of watts over [start, end] seconds,
+    with segments that cross the window edges cut at the interpolated value.
+    """
+    if end is None:
+        end = np.inf
+    t, v, s = series.t, series.values, series.series
+    if len(t) < 2:
+        return np.zeros(series.n_series)
+
+    # consecutive samples of the same series form one linear segment
+    same = s[1:] == s[:-1]
+    t0, t1, v0, v1 = t[:-1], t[1:], v[:-1], v[1:]
+    a = np.clip(t0, start, end)
+    b = np.clip(t1, start, end)
+
+    span = np.where(t1 > t0, t1 - t0, 1.0)
+    va = v0 + (v1 - v0) * (a - t0) / span
+    vb = v0 + (v1 - v0) * (b - t0) / span
+    area = np.where(same & (b > a), 0.5 * (va + vb) * (b - a), 0.0)
+    area = np.nan_to_num(area)
+
+    return np.bincount(s[:-1], weights=area, minlength=series.n_series)
+
+
+def run_energy(run: Run, metric: str) -> float:
+    """Joules of one power metric over the run's treatment window, NaN if it was not exported"""
+    if metric not in run.metrics:
+        return np.nan
+    return float(integrate(run.metrics[metric], 0.0, run.duration).sum())
+
+
+def energy_table(runs: list[Run], metrics: list[str] = POWER_METRICS) -> pd.DataFrame:
+    """One row per run: user_data, treatment duration, joules and mean watts per power metric"""
+    rows = []
+    for run in runs:
+        row = {"run_dir": run.name, **run.user_data, "duration": run.duration}
+        for metric in metrics:
+            joules = run_energy(run, metric)
+            row[f"{metric}_joules"] = joules
+            row[f"{metric}_mean_watts"] = joules / run.duration if run.duration else np.nan
+        rows.append(row)
+    return pd.DataFrame(rows)
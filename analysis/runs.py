@@ -0,0 +1,128 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from metric_store import MetricStore, STORE_DIR, MANIFEST, TIME_COLUMN
+
+# run.json records wall-clock times of the measuring host, the exports are UTC
+RUN_TIMEZONE = "Europe/Berlin"
+RUN_TIME_FORMAT = "%Y_%m_%d_%H_%M_%S"
+
+# per-sample annotations that never distinguish one series from another
+SAMPLE_COLUMNS = {"treatment", "layer", "unit"}
+
+
+@dataclass
+class Series:
+    """
+    One metric of one run, flattened: every sample has a time in seconds since
+    treatment start and a code into `labels` naming the series it belongs to
+    (a pod, a container, a plug, ...). Samples are sorted by (series, t).
+    """
+
+    t: np.ndarray
+    values: np.ndarray
+    series: np.ndarray
+    labels: list[str]
+
+    @property
+    def n_series(self) -> int:
+        return len(self.labels)
+
+
+@dataclass
+class Run:
+    name: str
+    path: str
+    treatment_start: pd.Timestamp
+    treatment_end: pd.Timestamp
+    user_data: dict
+    metrics: dict[str, Series] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return (self.treatment_end - self.treatment_start).total_seconds()
+
+
+def run_time(value: str, tz: str = RUN_TIMEZONE) -> pd.Timestamp:
+    """A time from run.json as a UTC timestamp"""
+    return pd.Timestamp(datetime.strptime(value, RUN_TIME_FORMAT)).tz_localize(tz).tz_convert("UTC")
+
+
+def _read_metric(run_dir: str, metric: str) -> Optional[pd.DataFrame]:
+    if os.path.exists(os.path.join(run_dir, STORE_DIR, MANIFEST)):
+        store = MetricStore(run_dir)
+        if metric not in store.metrics:
+            return None
+        df = store.load(metric)
+        constants = store.constants(metric)
+        if metric in constants:
+            df[metric] = constants[metric]  # a value that never changed is stored as a constant
+        return df
+    path = os.path.join(run_dir, "data", f"{metric}.csv")
+    if not os.path.exists(path):
+        return None
+    df = pd.read_csv(path, low_memory=False)
+    df = df.drop(columns=[c for c in df.columns if c.startswith(f"{TIME_COLUMN}.")])
+    df[TIME_COLUMN] = pd.to_datetime(df[TIME_COLUMN], utc=True, format="ISO8601")
+    return df
+
+
+def to_series(df: pd.DataFrame, metric: str, origin: pd.Timestamp) -> Series:
+    value_column = metric if metric in df else df.select_dtypes("number").columns[-1]
+    label_columns = [
+        c for c in df.columns
+        if c not in SAMPLE_COLUMNS and c not in (TIME_COLUMN, value_column)
+        and not pd.api.types.is_numeric_dtype(df[c])
+    ]
+
+    # combine the per-column codes into one key instead of joining strings row by row
+    key = np.zeros(len(df), dtype=np.int64)
+    for column in label_columns:
+        column_codes, uniques = pd.factorize(df[column])
+        key = key * (len(uniques) + 1) + column_codes + 1
+    codes, _ = pd.factorize(key)
+    first = np.unique(codes, return_index=True)[1]
+    labels = [
+        "/".join(str(df[c].iat[i]) for c in label_columns) or metric
+        for i in first
+    ]
+
+    ns = df[TIME_COLUMN].dt.tz_convert(None).to_numpy().astype("datetime64[ns]").view(np.int64)
+    t = (ns - origin.value) / 1e9
+    values = df[value_column].to_numpy(dtype=float)
+    order = np.lexsort((t, codes))
+    return Series(t[order], values[order], codes[order].astype(np.int64), labels)
+
+
+def load_run(run_dir: str, metrics: list[str], tz: str = RUN_TIMEZONE) -> Run:
+    """A run with every requested metric it exported, timed relative to its treatment window"""
+    with open(os.path.join(run_dir, "run.json"), "r") as f:
+        info = json.load(f)
+
+    run = Run(
+        name=os.path.basename(os.path.normpath(run_dir)),
+        path=run_dir,
+        treatment_start=run_time(info["treatment_start"], tz),
+        treatment_end=run_time(info["treatment_end"], tz),
+        user_data=info.get("user_data") or {},
+    )
+    for metric in metrics:
+        df = _read_metric(run_dir, metric)
+        if df is not None and len(df):
+            run.metrics[metric] = to_series(df, metric, run.treatment_start)
+    return run
+
+
+def load_runs(run_dirs: list[str], metrics: list[str], workers: Optional[int] = None, tz: str = RUN_TIMEZONE) -> list[Run]:
+    """load_run for every directory on a process pool, in the order given"""
+    if workers == 1 or len(run_dirs) <= 1:
+        return [load_run(d, metrics, tz) for d in run_dirs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(load_run, run_dirs, [metrics] * len(run_dirs), [tz] * len(run_dirs)))
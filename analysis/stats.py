@@ -0,0 +1,189 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from analysis.energy import POWER_METRICS, run_energy
+from analysis.runs import Run, Series
+
+# what run_summary() needs loaded
+SUMMARY_METRICS = POWER_METRICS + ["system_cpu_usage", "pod_memory_usage", "apiserver_latency_95th"]
+SUMMARY_COLUMNS = [
+    "makespan", "treatment_seconds", "wall_joules", "node_cpu_joules", "container_joules",
+    "cpu_seconds", "peak_pod_memory", "apiserver_p95",
+]
+CONFIG_COLUMNS = ["platform", "users", "reuse_users", "n_rows"]
+
+
+def _in_window(series: Series, duration: float) -> np.ndarray:
+    return (series.t >= 0) & (series.t <= duration)
+
+
+def counter_increase(series: Series, duration: float) -> float:
+    """Sum of per-series increases of a monotonic counter inside the window, ignoring resets"""
+    mask = _in_window(series, duration)
+    v, s = series.values[mask], series.series[mask]
+    if len(v) < 2:
+        return 0.0
+    step = np.diff(v)
+    keep = (s[1:] == s[:-1]) & (step > 0)
+    return float(step[keep].sum())
+
+
+def makespan(run: Run) -> float:
+    """
+    Seconds from the first workflow start to the last workflow finish the
+    tracker recorded, over all rounds of the run; NaN when it recorded none
+    """
+    rounds = [run.user_data.get("timings") or {}]
+    rounds += [e.get("timings") or {} for e in run.user_data.get("extensions") or []]
+    starts = [r["first_start"] for r in rounds if r.get("first_start")]
+    finishes = [r["last_finish"] for r in rounds if r.get("last_finish")]
+    if not starts or not finishes:
+        return np.nan
+    return (pd.Timestamp(max(finishes)) - pd.Timestamp(min(starts))).total_seconds()
+
+
+def run_summary(run: Run) -> dict:
+    """The per-run numbers compared between variants; NaN for metrics the run did not export"""
+    def window(metric):
+        series = run.metrics.get(metric)
+        return None if series is None else series.values[_in_window(series, run.duration)]
+
+    memory = window("pod_memory_usage")
+    latency = window("apiserver_latency_95th")
+    return {
+        "makespan": makespan(run),
+        # the treatment window also covers submission and the wait for the last pod
+        "treatment_seconds": run.duration,
+        "wall_joules": run_energy(run, "wall_power"),
+        "node_cpu_joules": run_energy(run, "kepler_node_cpu_power_sum"),
+        "container_joules": run_energy(run, "kepler_container_power_watts"),
+        "cpu_seconds": (
+            counter_increase(run.metrics["system_cpu_usage"], run.duration)
+            if "system_cpu_usage" in run.metrics else np.nan
+        ),
+        "peak_pod_memory": np.nanmax(memory) if memory is not None and len(memory) else np.nan,
+        "apiserver_p95": np.nanmean(latency) if latency is not None and len(latency) else np.nan,
+    }
+
+
+def summary_table(runs: list[Run], info: Optional[list[dict]] = None) -> pd.DataFrame:
+    """One row per run; info (e.g. catalog records, same order as runs) adds columns such as variant"""
+    rows = []
+    for i, run in enumerate(runs):
+        row = {"run_dir": run.name, **run.user_data}
+        if info is not None:
+            row.update(info[i])
+        row.update(run_summary(run))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _pad(groups: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    sizes = np.array([len(g) for g in groups])
+    padded = np.zeros((len(groups), max(sizes.max(initial=0), 1)))
+    for i, g in enumerate(groups):
+        padded[i, :len(g)] = g
+    return padded, sizes
+
+
+def bootstrap_means(
+    groups: list[np.ndarray], n_resamples: int, rng: np.random.Generator, chunk: int = 5000
+) -> np.ndarray:
+    """
+    Bootstrap distribution of the mean for many samples of different sizes at
+    once, shape (len(groups), n_resamples). Every group is padded to the largest
+    size; draws are scaled to each group's own size, so padding is never picked,
+    and only the first n draws of a group count towards its mean.
+    """
+    values, sizes = _pad(groups)
+    width = values.shape[1]
+    used = np.arange(width)[None, None, :] < sizes[:, None, None]
+    out = np.empty((len(groups), n_resamples))
+
+    # chunks of resamples bound memory at len(groups) * chunk * width
+    for lo in range(0, n_resamples, chunk):
+        hi = min(lo + chunk, n_resamples)
+        idx = (rng.random((len(groups), hi - lo, width)) * sizes[:, None, None]).astype(np.int64)
+        drawn = np.take_along_axis(values[:, None, :], idx, axis=2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[:, lo:hi] = np.where(used, drawn, 0.0).sum(axis=2) / sizes[:, None]
+    return out
+
+
+def hedges_g(a: np.ndarray, b: np.ndarray) -> float:
+    na, nb = len(a), len(b)
+    if na < 2 or nb < 2:
+        return np.nan
+    pooled = np.sqrt(((na - 1) * a.var(ddof=1) + (nb - 1) * b.var(ddof=1)) / (na + nb - 2))
+    if pooled == 0:
+        return np.nan
+    correction = 1 - 3 / (4 * (na + nb) - 9)
+    return float((a.mean() - b.mean()) / pooled * correction)
+
+
+def compare(
+    table: pd.DataFrame,
+    metrics: list[str] = SUMMARY_COLUMNS,
+    by: list[str] = CONFIG_COLUMNS,
+    variant_column: str = "variant",
+    treatment: str = "reuse",
+    control: str = "no-reuse",
+    n_resamples: int = 20000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Effect of treatment over control for every configuration x metric: mean
+    difference and relative change with percentile bootstrap intervals, plus
+    Hedges' g. All pairs are resampled together in one batched pass.
+    """
+    by = [c for c in by if c in table.columns]
+    groups = table.groupby(by, dropna=False) if by else [((), table)]
+    cells, treated, controls = [], [], []
+    for key, group in groups:
+        key = key if isinstance(key, tuple) else (key,)
+        for metric in metrics:
+            a = group.loc[group[variant_column] == treatment, metric].dropna().to_numpy(float)
+            b = group.loc[group[variant_column] == control, metric].dropna().to_numpy(float)
+            if len(a) and len(b):
+                cells.append((dict(zip(by, key)), metric, a, b))
+                treated.append(a)
+                controls.append(b)
+
+    if not cells:
+        return pd.DataFrame()
+
+    rng = np.random.default_rng(seed)
+    means_a = bootstrap_means(treated, n_resamples, rng)
+    means_b = bootstrap_means(controls, n_resamples, rng)
+    diff = means_a - means_b
+    with np.errstate(invalid="ignore", divide="ignore"):
+        relative = means_a / means_b - 1
+
+    q = [(1 - confidence) / 2, (1 + confidence) / 2]
+    diff_ci = np.nanquantile(diff, q, axis=1)
+    relative_ci = np.nanquantile(relative, q, axis=1)
+
+    rows = []
+    for i, (config, metric, a, b) in enumerate(cells):
+        rows.append({
+            **config,
+            "metric": metric,
+            f"n_{treatment}": len(a),
+            f"n_{control}": len(b),
+            f"mean_{treatment}": a.mean(),
+            f"mean_{control}": b.mean(),
+            "diff": a.mean() - b.mean(),
+            "diff_lo": diff_ci[0, i],
+            "diff_hi": diff_ci[1, i],
+            "relative": a.mean() / b.mean() - 1 if b.mean() else np.nan,
+            "relative_lo": relative_ci[0, i],
+            "relative_hi": relative_ci[1, i],
+            "hedges_g": hedges_g(a, b),
+            # the interval excludes zero: the variants differ at this confidence;
+            # a single run per side has a zero-width interval and proves nothing
+            "significant": bool(min(len(a), len(b)) > 1 and (diff_ci[0, i] > 0 or diff_ci[1, i] < 0)),
+        })
+    return pd.DataFrame(rows)
@@ -0,0 +1,396 @@
+import argparse
+import csv
+import hashlib
+import http.client
+import json
+import math
+import os
+import queue
+import shutil
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from typing import Optional
+
+import yaml
+
+from analysis.runs import RUN_TIMEZONE, run_time
+from submitter import RETRY_STATUS
+
+log = getLogger("experiment.backfill")
+
+CACHE_DIR = "backfill-cache"
+OUTPUT_DIR = "backfill"
+RUN_FILES = {"session": "session.json", "run": "run.json", "config": "config.yaml", "environment": None}
+
+
+@dataclass
+class Measurement:
+    name: str
+    query: str
+    step: float
+    layer: str
+    unit: str
+    targets: list[str]
+
+
+@dataclass
+class Chunk:
+    measurement: str
+    namespace: Optional[str]
+    query: str
+    start: float
+    end: float
+    step: float
+
+    def key(self) -> str:
+        raw = json.dumps([self.query, self.start, self.end, self.step])
+        return hashlib.sha256(raw.encode()).hexdigest()[:24]
+
+
+def parse_duration(value) -> float:
+    """Seconds of a Prometheus style duration such as 30, "10s" or "1m" """
+    if isinstance(value, (int, float)):
+        return float(value)
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400}
+    for suffix in sorted(units, key=len, reverse=True):
+        if value.endswith(suffix):
+            return float(value[:-len(suffix)]) * units[suffix]
+    return float(value)
+
+
+def load_measurements(config: dict) -> list[Measurement]:
+    measurements = []
+    for entry in config["sma"]["measurements"]:
+        (name, spec), = entry.items()
+        measurements.append(Measurement(
+            name, spec["query"].strip(), parse_duration(spec.get("step", 30)),
+            spec.get("layer", ""), spec.get("unit", ""), list(spec.get("target") or []),
+        ))
+    return measurements
+
+
+def run_window(run: dict, config: dict, tz: str = RUN_TIMEZONE) -> tuple[float, float, float, float]:
+    """Query range and treatment window of a run, as unix times"""
+    window = config["sma"]["observation"].get("window", {})
+    treatment_start = run_time(run.get("treatment_start") or run["startTime"], tz).timestamp()
+    treatment_end = run_time(run.get("treatment_end") or run["endTime"], tz).timestamp()
+    start = treatment_start - parse_duration(window.get("left", 0))
+    end = treatment_end + parse_duration(window.get("right", 0))
+    return start, end, treatment_start, treatment_end
+
+
+def plan_chunks(measurement: Measurement, namespaces: dict[str, str], start: float, end: float,
+                chunk_seconds: float, step: Optional[float] = None) -> list[Chunk]:
+    """
+    The range queries of one measurement, one per target namespace and time
+    chunk. Chunk boundaries sit on the step grid of the whole range and don't
+    overlap, so joining the chunks gives exactly the samples of one big query.
+    """
+    step = step or measurement.step
+    per_chunk = max(1, int(chunk_seconds // step))
+    samples = int(math.floor((end - start) / step)) + 1
+    targets = [namespaces.get(t, t) for t in measurement.targets] or [None]
+
+    chunks = []
+    for namespace in targets:
+        query = measurement.query.replace("${namespace}", namespace) if namespace else measurement.query
+        for first in range(0, samples, per_chunk):
+            last = min(first + per_chunk, samples) - 1
+            chunks.append(Chunk(measurement.name, namespace, query, start + first * step, start + last * step, step))
+    return chunks
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections to one server, shared by worker threads"""
+
+    def __init__(self, url: str, size: int, timeout: float = 30.0):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme, self.host, self.port = parsed.scheme, parsed.hostname, parsed.port
+        self.prefix = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def get(self, path: str, params: dict) -> tuple[int, bytes]:
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = self._connect()
+        try:
+            connection.request("GET", f"{self.prefix}{path}?{urllib.parse.urlencode(params)}")
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self.idle.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        return response.status, body
+
+    def close(self) -> None:
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+
+class Backfill:
+    """
+    Re-runs the range queries of a run against Prometheus. Responses are
+    cached on disk per chunk as they arrive, so an interrupted backfill
+    resumes with the chunks still missing.
+    """
+
+    def __init__(self, prometheus: str, cache_dir: str, workers: int = 8,
+                 retries: int = 3, backoff: float = 0.5, timeout: float = 30.0):
+        self.prometheus = prometheus
+        self.pool = ConnectionPool(prometheus, workers, timeout)
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.fetched = 0
+        self.cached = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def fetch(self, chunk: Chunk) -> dict:
+        path = os.path.join(self.cache_dir, f"{chunk.key()}.json")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                body = f.read()
+            with self._lock:
+                self.cached += 1
+            return json.loads(body)
+
+        params = {"query": chunk.query, "start": f"{chunk.start:.3f}", "end": f"{chunk.end:.3f}", "step": f"{chunk.step:g}"}
+        error = None
+        for attempt in range(1, self.retries + 2):
+            try:
+                status, body = self.pool.get("/api/v1/query_range", params)
+                if status == 200:
+                    break
+                error = f"HTTP {status}: {body[:200].decode(errors='replace')}"
+                if status not in RETRY_STATUS:
+                    raise RuntimeError(f"{chunk.measurement}: {error}")
+            except (http.client.HTTPException, OSError) as e:
+                error = str(e)
+            time.sleep(self.backoff * 2 ** (attempt - 1))
+        else:
+            raise RuntimeError(f"{chunk.measurement}: gave up after {attempt} attempts: {error}")
+
+        response = json.loads(body)
+        if response.get("status") != "success":
+            raise RuntimeError(f"{chunk.measurement}: {response.get('errorType')}: {response.get('error')}")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.fetched += 1
+        return response
+
+    def fetch_all(self, chunks: list[Chunk]) -> dict[str, list[dict]]:
+        """Raw results per measurement, chunks fetched concurrently"""
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for chunk, response in zip(chunks, pool.map(self.fetch, chunks)):
+                results.setdefault(chunk.measurement, []).extend(response["data"]["result"])
+        self.pool.close()
+        return results
+
+
+def _timestamp(t: float) -> str:
+    return datetime.fromtimestamp(t, timezone.utc).isoformat(sep=" ")
+
+
+def write_metric(path: str, measurement: Measurement, results: list[dict],
+                 treatment_start: float, treatment_end: float) -> Optional[dict]:
+    """
+    One metric as the SMA agent exports it: a row per sample, ordered by series
+    and time, label columns sorted, then the sample time, value, layer, unit and
+    whether the sample falls into the treatment window.
+    """
+    series = {}
+    for result in results:
+        labels = tuple(sorted(result["metric"].items()))
+        samples = series.setdefault(labels, {})
+        for t, value in result.get("values", []):
+            samples[float(t)] = value  # chunks don't overlap, but a resumed cache may come from an older plan
+    if not series:
+        return None
+
+    label_names = sorted({name for labels in series for name, _ in labels})
+    columns = ["timestamp", *label_names, "timestamp", measurement.name, "layer", "unit", "treatment"]
+    rows = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for labels in sorted(series):
+            values = dict(labels)
+            for t in sorted(series[labels]):
+                treatment = "Treatment" if treatment_start <= t <= treatment_end else "NoTreatment"
+                writer.writerow([
+                    _timestamp(t), *(values.get(name, "") for name in label_names),
+                    t, series[labels][t], measurement.layer, measurement.unit, treatment,
+                ])
+                rows += 1
+    return {"filename": os.path.basename(path), "rows": rows, "columns": columns}
+
+
+def backfill_run(run_dir: str, output_dir: str, prometheus: Optional[str] = None, metrics: Optional[list[str]] = None,
+                 extra_queries: Optional[dict[str, str]] = None, step: Optional[float] = None,
+                 chunk_seconds: float = 3600, workers: int = 8, cache_dir: Optional[str] = None,
+                 tz: str = RUN_TIMEZONE) -> dict:
+    """Backfill the measurements of one run into output_dir, return its manifest"""
+    with open(os.path.join(run_dir, "run.json"), "r") as f:
+        run = json.load(f)
+    with open(os.path.join(run_dir, "config.yaml"), "r") as f:
+        config = yaml.safe_load(f)
+
+    measurements = load_measurements(config)
+    if metrics:
+        measurements = [m for m in measurements if m.name in metrics]
+    default_targets = sorted({t for m in load_measurements(config) for t in m.targets})
+    for name, query in (extra_queries or {}).items():
+        measurements.append(Measurement(name, query, step or 30.0, "", "", default_targets))
+
+    start, end, treatment_start, treatment_end = run_window(run, config, tz)
+    namespaces = {t["name"]: t["namespace"] for t in config["sma"]["observation"].get("targets", [])}
+    chunks = [c for m in measurements for c in plan_chunks(m, namespaces, start, end, chunk_seconds, step)]
+
+    backfill = Backfill(prometheus or config["sma"]["services"]["prometheus"]["address"],
+                        cache_dir or os.path.join(run_dir, CACHE_DIR), workers)
+    started = time.time()
+    results = backfill.fetch_all(chunks)
+    log.info(f"{run_dir}: {len(chunks)} chunks, {backfill.fetched} fetched, "
+             f"{backfill.cached} from cache in {time.time() - started:.1f}s")
+
+    os.makedirs(os.path.join(output_dir, "data"), exist_ok=True)
+    data_files = {}
+    for m in measurements:
+        entry = write_metric(os.path.join(output_dir, "data", f"{m.name}.csv"), m, results.get(m.name, []),
+                             treatment_start, treatment_end)
+        if entry is None:
+            log.warning(f"{run_dir}: {m.name} returned no samples")
+            continue
+        data_files[m.name] = entry
+
+    # the run's own files come along, so the output is a run directory of its own
+    if os.path.abspath(output_dir) != os.path.abspath(run_dir):
+        for name in RUN_FILES.values():
+            if name and os.path.exists(os.path.join(run_dir, name)):
+                shutil.copyfile(os.path.join(run_dir, name), os.path.join(output_dir, name))
+    manifest = {
+        "version": "1.0",
+        "created_at": datetime.now().isoformat(),
+        "format": "csv",
+        "data_files": data_files,
+        "files": RUN_FILES,
+        "backfill": {"prometheus": backfill.prometheus, "start": start, "end": end, "step": step,
+                     "chunk_seconds": chunk_seconds, "chunks": len(chunks)},
+    }
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=4)
+    return manifest
+
+
+def serve_fake(port: int, series: int = 2, fail_every: int = 0) -> None:
+    """
+    A stand-in Prometheus for trying out backfills: /api/v1/query_range answers
+    every query with a few deterministic series on the requested step grid,
+    every fail_every-th request fails with 503, /requests counts the queries.
+    """
+    state = {"requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status: int, value) -> None:
+            body = json.dumps(value).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            if url.path == "/requests":
+                return self._reply(200, state)
+            if url.path != "/api/v1/query_range":
+                return self._reply(404, {"status": "error", "error": "not found"})
+            with lock:
+                state["requests"] += 1
+                count = state["requests"]
+            if fail_every and count % fail_every == 0:
+                return self._reply(503, {"status": "error", "error": "unavailable"})
+
+            params = dict(urllib.parse.parse_qsl(url.query))
+            start, end, step = float(params["start"]), float(params["end"]), parse_duration(params["step"])
+            seed = int(hashlib.sha256(params["query"].encode()).hexdigest()[:6], 16)
+            times = [start + i * step for i in range(int((end - start) // step) + 1)]
+            result = [
+                {
+                    "metric": {"__name__": "fake", "pod": f"pod-{i}", "query": f"{seed:x}"},
+                    "values": [[t, str(round((seed % 97) + i + math.sin(t / 60), 6))] for t in times],
+                }
+                for i in range(series)
+            ]
+            self._reply(200, {"status": "success", "data": {"resultType": "matrix", "result": result}})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    print(f"✅ fake Prometheus on http://127.0.0.1:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    parser = argparse.ArgumentParser(description="Re-export the metrics of recorded runs from Prometheus")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="backfill one or more run directories")
+    run_parser.add_argument("run_dirs", nargs="+")
+    run_parser.add_argument("--prometheus", default=None, help="defaults to the address in the run's config.yaml")
+    run_parser.add_argument("--metrics", nargs="+", default=None, help="only these measurements")
+    run_parser.add_argument("--query", action="append", default=[], metavar="NAME=PROMQL", help="an extra measurement")
+    run_parser.add_argument("--step", type=parse_duration, default=None, help="override every measurement's step")
+    run_parser.add_argument("--chunk", type=parse_duration, default=3600, help="seconds per range query")
+    run_parser.add_argument("--workers", type=int, default=8)
+    run_parser.add_argument("--output", default=OUTPUT_DIR, help=f"relative to the run directory, '.' overwrites the export")
+    run_parser.add_argument("--tz", default=RUN_TIMEZONE, help="timezone of the times in run.json")
+
+    fake_parser = sub.add_parser("fake", help="serve a fake Prometheus for testing")
+    fake_parser.add_argument("--port", type=int, default=9090)
+    fake_parser.add_argument("--series", type=int, default=2)
+    fake_parser.add_argument("--fail-every", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "fake":
+        serve_fake(args.port, args.series, args.fail_every)
+    else:
+        extra = dict(q.split("=", 1) for q in args.query)
+        for run_dir in args.run_dirs:
+            output_dir = os.path.join(run_dir, args.output)
+            manifest = backfill_run(run_dir, output_dir, args.prometheus, args.metrics, extra, args.step,
+                                    args.chunk, args.workers, tz=args.tz)
+            rows = sum(entry["rows"] for entry in manifest["data_files"].values())
+            print(f"✅ {len(manifest['data_files'])} metrics, {rows} rows saved to {output_dir}")
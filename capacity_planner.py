@@ -0,0 +1,336 @@
+import argparse
+import dataclasses
+import hashlib
+import json
+import math
+import os
+from glob import glob
+from logging import getLogger, basicConfig, INFO
+from typing import Optional
+
+import pandas as pd
+import yaml
+
+from loadgen import ARRIVALS, user_workflows
+from pipeline.dag_utils import called_service
+from simulator import MODEL_PATH, PROFILES_PATH, ClusterModel, Profiles, load_pipelines, match_stage, simulate
+from submitter import load_workflows
+
+log = getLogger("experiment.capacity_planner")
+
+DEPLOYMENTS_DIR = "pipeline/k8s-deployment-files/transformation-services"
+KNATIVE_DIR = "pipeline/k8s-deployment-files/knative-transformation-service"
+PLANNED_DIR = "pipeline/k8s-deployment-files/planned"
+
+
+def _call_stage(template: dict, stages: list[str]) -> Optional[str]:
+    # the service a curl or fused template calls; other leaves (merge-shards, ...) are no service calls
+    service = called_service(template)
+    if service in stages:
+        return service
+    return match_stage(template["name"], stages) if "container" in template else None
+
+
+def workflow_calls(workflow: dict, stages: list[str]) -> list[dict]:
+    """
+    Every service call of a workflow as {stage, level, key, dependencies}.
+    dependencies are the indices of the earlier calls it waits for and level
+    the step group (or DAG depth) it runs in, both followed through nested
+    templates; key identifies what the call computes, so calls with equal
+    keys are one computation under reuse. withItems makes one call per item.
+    """
+    templates = {t["name"]: t for t in workflow["spec"]["templates"]}
+    calls = []
+
+    def expand(step: dict, after: list[int]) -> list[int]:
+        items = step.get("withItems") or [None]
+        return sorted({i for item in items for i in walk(step["template"], after, step.get("arguments"), item)})
+
+    def walk(name: str, after: list[int], arguments, item) -> list[int]:
+        """Runs the template once the calls in after are done, returns the calls it ends with"""
+        template = templates[name]
+        if "steps" in template:
+            for group in template["steps"]:
+                after = sorted({i for step in group for i in expand(step, after)}) or after
+            return after
+        if "dag" in template:
+            done = {}
+            for task in template["dag"]["tasks"]:
+                upstream = sorted({i for d in task.get("dependencies") or [] for i in done[d]})
+                done[task["name"]] = expand(task, upstream if task.get("dependencies") else after)
+            return sorted({i for ends in done.values() for i in ends}) or after
+
+        stage = _call_stage(template, stages)
+        if stage is None:
+            return after
+        spec = {k: v for k, v in template.items() if k != "name"}
+        raw = json.dumps([spec, arguments, item], sort_keys=True, default=str)
+        calls.append({
+            "stage": stage,
+            "level": max((calls[i]["level"] + 1 for i in after), default=0),
+            "key": hashlib.sha256(raw.encode()).hexdigest()[:16],
+            "dependencies": list(after),
+        })
+        return [len(calls) - 1]
+
+    walk(workflow["spec"]["entrypoint"], [], None, None)
+    return calls
+
+
+def workflow_pipelines(templates: list[dict], stages: list[str]) -> dict[str, list[tuple[str, list[int]]]]:
+    """
+    The generated workflows as the simulator's (stage, dependencies) tasks, in
+    file order, so the simulation runs the DAG that workflow_demand counts
+    """
+    return {
+        (wf["metadata"].get("generateName") or wf["metadata"].get("name", "")).rstrip("-"):
+            [(call["stage"], call["dependencies"]) for call in workflow_calls(wf, stages)]
+        for wf in templates
+    }
+
+
+def workflow_demand(templates: list[dict], stages: list[str], users: int, reuse_users: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Per stage and plan, what loadgen would send for users with the generated
+    workflows: calls, computations (distinct keys with reuse, every call
+    without), the widest step group of a single workflow, and the peak number
+    of distinct computations in one level across all users (burst arrivals).
+    """
+    rows = []
+    for user, wf in enumerate(user_workflows(templates, users, reuse_users, seed)):
+        rows.extend({"user": user, **call} for call in workflow_calls(wf, stages))
+    calls = pd.DataFrame(rows, columns=["user", "stage", "level", "key"])
+
+    width = calls.groupby(["user", "stage", "level"]).size().groupby("stage").max()
+    tables = []
+    for plan in ("reuse", "no-reuse"):
+        distinct = "key" if plan == "reuse" else ["user", "key"]
+        unique = calls.drop_duplicates(distinct)
+        tables.append(pd.DataFrame({
+            "plan": plan,
+            "calls": calls.groupby("stage").size(),
+            "computed": unique.groupby("stage").size(),
+            "width": width,
+            "peak": unique.groupby(["stage", "level"]).size().groupby("stage").max(),
+        }))
+    return pd.concat(tables).rename_axis("stage").reset_index()
+
+
+def service_times(model: ClusterModel, profiles: Profiles, stages: list[str], n_rows: Optional[int] = None) -> dict[str, float]:
+    """Seconds a replica is busy with one computed call, as simulate() models it"""
+    scale = profiles.scale("reuse", n_rows)
+    return {
+        stage: (profiles.stages.get(stage, model.stage_default).duration + model.request) * scale
+        for stage in stages
+    }
+
+
+def initial_servers(demand: pd.DataFrame, service: dict[str, float], hit: float, target: float,
+                    max_utilization: float, max_servers: int) -> dict[str, int]:
+    """Enough servers per stage to get through its work in target seconds at max_utilization"""
+    reuse = demand[demand["plan"] == "reuse"].set_index("stage")
+    servers = {}
+    for stage, row in reuse.iterrows():
+        work = row["computed"] * service.get(stage, 0.0) + (row["calls"] - row["computed"]) * hit
+        cap = max(1, min(int(row["peak"]), max_servers))
+        servers[stage] = min(max(1, math.ceil(work / (target * max_utilization))), cap)
+    return servers
+
+
+def plan_servers(pipelines: dict, model: ClusterModel, profiles: Profiles, demand: pd.DataFrame, target: float,
+                 users: int, reuse_users: int, max_utilization: float = 0.7, max_servers: int = 16,
+                 n_rows: Optional[int] = None, arrival: str = "burst", rate: Optional[float] = None,
+                 seed: int = 0, max_rounds: int = 100) -> tuple[dict[str, int], dict]:
+    """
+    Servers (concurrent calls) per stage for the reuse plan to finish users in
+    target seconds. Starts from the work each stage has to do and then grows
+    the busiest stage that can still grow until the simulated makespan meets
+    the target, a stage never getting more servers than it has concurrent
+    computations. Growth that does not shorten the makespan is undone, and
+    that stage is left alone until growing another one helps. Returns the
+    servers and the best simulation.
+    """
+    stages = sorted({stage for tasks in pipelines.values() for stage, _ in tasks})
+    service = service_times(model, profiles, stages, n_rows)
+    hit = model.cache_hit * profiles.scale("reuse", n_rows)
+    servers = {stage: 1 for stage in stages}
+    servers.update(initial_servers(demand, service, hit, target, max_utilization, max_servers))
+    peaks = demand[demand["plan"] == "reuse"].set_index("stage")["peak"]
+    caps = {stage: max(1, min(int(peaks.get(stage, 1)), max_servers)) for stage in stages}
+
+    best, grown, frozen = None, None, set()
+    for _ in range(max_rounds):
+        result = simulate(pipelines, dataclasses.replace(model, replica_overrides=dict(servers)), profiles,
+                          "reuse", users, reuse_users, arrival, rate, n_rows, seed)
+        if grown and result["makespan"] >= best["makespan"]:
+            # not the bottleneck after all, keep it where it was
+            servers[grown[0]] = grown[1]
+            frozen.add(grown[0])
+        else:
+            best = result
+            frozen.clear()
+        if best["makespan"] <= target:
+            break
+        growable = {
+            stage: best["stage_busy"][stage] / (servers[stage] * best["makespan"])
+            for stage in stages
+            if stage not in frozen and servers[stage] < caps[stage] and best["stage_busy"][stage] > 0
+        }
+        if not growable:
+            log.warning(f"Target of {target:.0f}s not reachable, no stage that is short of servers can grow "
+                        f"(simulated makespan {best['makespan']:.0f}s)")
+            break
+        busiest = max(growable, key=growable.get)
+        grown = (busiest, servers[busiest])
+        servers[busiest] = min(caps[busiest], servers[busiest] + max(1, servers[busiest] // 4))
+    else:
+        log.warning(f"Stopped after {max_rounds} rounds at a simulated makespan of {best['makespan']:.0f}s")
+    return servers, best
+
+
+def utilization_report(pipelines: dict, model: ClusterModel, profiles: Profiles, demand: pd.DataFrame,
+                       servers: dict[str, int], users: int, reuse_users: int, n_rows: Optional[int] = None,
+                       arrival: str = "burst", rate: Optional[float] = None, seed: int = 0) -> pd.DataFrame:
+    """
+    Predicted per-stage utilization of both plans: reuse on the planned
+    replicas, no-reuse on the shared cores its pods queue for.
+    """
+    rows = []
+    for plan in ("reuse", "no-reuse"):
+        result = simulate(pipelines, dataclasses.replace(model, replica_overrides=dict(servers)), profiles,
+                          plan, users, reuse_users, arrival, rate, n_rows, seed)
+        for stage, busy in result["stage_busy"].items():
+            capacity = servers.get(stage, model.replicas) if plan == "reuse" else model.nodes * model.cores
+            rows.append({
+                "plan": plan,
+                "stage": stage,
+                "servers": capacity,
+                "busy_seconds": busy,
+                "utilization": busy / (capacity * result["makespan"]) if result["makespan"] else 0.0,
+                "makespan": result["makespan"],
+            })
+    report = pd.DataFrame(rows)
+    return demand.merge(report, on=["plan", "stage"], how="outer")
+
+
+def _find_service(directory: str, name: str) -> tuple[Optional[str], list[dict]]:
+    for path in sorted(glob(os.path.join(directory, "*.yaml"))):
+        with open(path, "r") as f:
+            docs = [doc for doc in yaml.safe_load_all(f) if doc]
+        if any(doc.get("metadata", {}).get("name") == name for doc in docs):
+            return path, docs
+    return None, []
+
+
+def patch_deployment(docs: list[dict], replicas: int, max_replicas: int, cpu_millis: int, max_utilization: float) -> list[dict]:
+    """The Deployment at replicas with a CPU request, plus an HPA scaling it up to max_replicas"""
+    patched = []
+    for doc in docs:
+        patched.append(doc)
+        if doc.get("kind") != "Deployment":
+            continue
+        doc["spec"]["replicas"] = replicas
+        for container in doc["spec"]["template"]["spec"]["containers"]:
+            # the HPA measures utilization against the request
+            container.setdefault("resources", {}).setdefault("requests", {}).setdefault("cpu", f"{cpu_millis}m")
+        patched.append({
+            "apiVersion": "autoscaling/v2",
+            "kind": "HorizontalPodAutoscaler",
+            "metadata": {"name": doc["metadata"]["name"], "namespace": doc["metadata"].get("namespace")},
+            "spec": {
+                "scaleTargetRef": {"apiVersion": "apps/v1", "kind": "Deployment", "name": doc["metadata"]["name"]},
+                "minReplicas": replicas,
+                "maxReplicas": max(replicas, max_replicas),
+                "metrics": [{"type": "Resource", "resource": {
+                    "name": "cpu", "target": {"type": "Utilization", "averageUtilization": round(max_utilization * 100)},
+                }}],
+            },
+        })
+    return patched
+
+
+def patch_knative(docs: list[dict], replicas: int, max_replicas: int, concurrency: int) -> list[dict]:
+    """The Knative Service kept at replicas warm pods, each taking concurrency calls at a time"""
+    for doc in docs:
+        if doc.get("kind") != "Service" or not doc.get("apiVersion", "").startswith("serving.knative.dev"):
+            continue
+        template = doc["spec"]["template"]
+        annotations = template.setdefault("metadata", {}).setdefault("annotations", {})
+        annotations["autoscaling.knative.dev/minScale"] = str(replicas)
+        annotations["autoscaling.knative.dev/maxScale"] = str(max(replicas, max_replicas))
+        annotations["autoscaling.knative.dev/target"] = str(concurrency)
+        template["spec"]["containerConcurrency"] = concurrency
+    return docs
+
+
+def write_manifests(servers: dict[str, int], caps: dict[str, int], profiles: Profiles, concurrency: int,
+                    max_utilization: float, deployments_dir: str, knative_dir: str, output_dir: str) -> list[str]:
+    written = []
+    for stage, n in sorted(servers.items()):
+        replicas, max_replicas = math.ceil(n / concurrency), math.ceil(caps[stage] / concurrency)
+        profile = profiles.stages.get(stage)
+        # cores a replica keeps busy while serving a call
+        cpu_millis = max(100, round(1000 * profile.cpu / profile.duration)) if profile and profile.duration else 1000
+        for directory, patch in (
+            (deployments_dir, lambda docs: patch_deployment(docs, replicas, max_replicas, cpu_millis, max_utilization)),
+            (knative_dir, lambda docs: patch_knative(docs, replicas, max_replicas, concurrency)),
+        ):
+            path, docs = _find_service(directory, stage)
+            if path is None:
+                log.warning(f"No manifest for {stage} in {directory}")
+                continue
+            target = os.path.join(output_dir, os.path.basename(directory.rstrip("/")), os.path.basename(path))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "w") as f:
+                yaml.safe_dump_all(patch(docs), f, sort_keys=False)
+            written.append(target)
+    return written
+
+
+if __name__ == "__main__":
+    basicConfig(level=INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Size the stage services for a target makespan and predict their utilization")
+    parser.add_argument("workflow_file", help="generated workflows, as loadgen submits them")
+    parser.add_argument("--target", type=float, required=True, help="makespan to plan for, in seconds")
+    parser.add_argument("--users", type=int, required=True)
+    parser.add_argument("--reuse-users", type=int, default=None, help="users whose requests overlap, all by default")
+    parser.add_argument("--n-rows", type=int, default=None)
+    parser.add_argument("--arrival", choices=ARRIVALS, default="burst")
+    parser.add_argument("--rate", type=float, default=None, help="users per second for constant/poisson arrivals")
+    parser.add_argument("--max-utilization", type=float, default=0.7, help="busy share a replica is planned for")
+    parser.add_argument("--max-replicas", type=int, default=16, help="per stage")
+    parser.add_argument("--concurrency", type=int, default=1, help="calls a replica serves at a time (Knative containerConcurrency)")
+    parser.add_argument("--model", default=MODEL_PATH, help="cluster model")
+    parser.add_argument("--profiles", default=PROFILES_PATH)
+    parser.add_argument("--deployments", default=DEPLOYMENTS_DIR)
+    parser.add_argument("--knative", default=KNATIVE_DIR)
+    parser.add_argument("--output-dir", default=PLANNED_DIR, help="patched manifests go here")
+    parser.add_argument("--report", default="capacity-report.csv")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model = ClusterModel.from_file(args.model)
+    profiles = Profiles.load(args.profiles)
+    # the configured stages name the services, the submitted workflows give the DAG
+    stages = sorted({stage for tasks in load_pipelines(model.config).values() for stage, _ in tasks})
+    templates = load_workflows(args.workflow_file)
+    pipelines = workflow_pipelines(templates, stages)
+    reuse_users = args.users if args.reuse_users is None else args.reuse_users
+    max_servers = args.max_replicas * args.concurrency
+
+    demand = workflow_demand(templates, stages, args.users, reuse_users, args.seed)
+    servers, result = plan_servers(
+        pipelines, model, profiles, demand, args.target, args.users, reuse_users, args.max_utilization,
+        max_servers, args.n_rows, args.arrival, args.rate, args.seed,
+    )
+    peaks = demand[demand["plan"] == "reuse"].set_index("stage")["peak"]
+    caps = {stage: max(servers[stage], min(int(peaks.get(stage, 1)), max_servers)) for stage in servers}
+    written = write_manifests(servers, caps, profiles, args.concurrency, args.max_utilization,
+                              args.deployments, args.knative, args.output_dir)
+
+    report = utilization_report(pipelines, model, profiles, demand, servers, args.users, reuse_users,
+                                args.n_rows, args.arrival, args.rate, args.seed)
+    report.to_csv(args.report, index=False)
+    print(report.pivot_table(index="stage", columns="plan", values=["computed", "servers", "utilization"]).round(2).to_string())
+    print(f"✅ reuse makespan {result['makespan']:.0f}s for a {args.target:.0f}s target with "
+          f"{sum(servers.values())} servers, {len(written)} manifests in {args.output_dir}, report in {args.report}")
@@ -0,0 +1,115 @@
+import argparse
+import copy
+import random
+import re
+from logging import getLogger
+from typing import Optional
+
+from submitter import WorkflowSubmitter, load_workflows, write_submit_log, summarize
+
+log = getLogger("experiment.loadgen")
+
+ARRIVALS = ("burst", "constant", "poisson")
+# the shared PVC's data directory; the stage services mount it at this path
+# and parser_reuse/parser_noreuse write below it
+DATA_ROOT = "/mnt/data/argo-shard"
+DATA_PATH = re.compile(rf"(?<![\w/.-]){re.escape(DATA_ROOT)}(?=/|$|[\s\"',;])")
+MOUNT_KEYS = {"mountPath", "volumes"}  # where the volume is mounted, not a path on it
+
+
+def arrival_offsets(n: int, arrival: str = "burst", rate: Optional[float] = None, seed: int = 0) -> list[float]:
+    """Submit times in seconds from the start of the run, one per user"""
+    if arrival == "burst":
+        return [0.0] * n
+    if not rate or rate <= 0:
+        raise ValueError(f"{arrival} arrivals need a positive rate (users per second)")
+    if arrival == "constant":
+        return [i / rate for i in range(n)]
+    if arrival == "poisson":
+        rng = random.Random(seed)
+        offsets, t = [], 0.0
+        for _ in range(n):
+            offsets.append(t)
+            t += rng.expovariate(rate)
+        return offsets
+    raise ValueError(f"Unknown arrival process {arrival!r}, expected one of {ARRIVALS}")
+
+
+def _isolate(value, tag: str):
+    if isinstance(value, str):
+        return DATA_PATH.sub(f"{DATA_ROOT}/{tag}", value)
+    if isinstance(value, list):
+        return [_isolate(v, tag) for v in value]
+    if isinstance(value, dict):
+        return {k: v if k in MOUNT_KEYS else _isolate(v, tag) for k, v in value.items()}
+    return value
+
+
+def user_workflows(templates: list[dict], users: int, reuse_users: int, seed: int = 0) -> list[dict]:
+    """
+    One workflow instance per user, cycling through the templates. reuse_users
+    of them (picked at random) keep the template's data paths, so their requests
+    overlap with every other such user of the same pipeline; the rest write under
+    a per-user directory and share nothing.
+    """
+    if not templates:
+        raise ValueError("No workflows to instantiate")
+    overlapping = set(random.Random(seed).sample(range(users), min(reuse_users, users)))
+
+    instances = []
+    for user in range(users):
+        template = templates[user % len(templates)]
+        if user in overlapping:
+            wf = copy.deepcopy(template)
+        else:
+            wf = dict(template, spec=_isolate(template["spec"], f"user-{user}"))
+            if wf["spec"] == template["spec"]:
+                raise ValueError(
+                    f"{template['metadata'].get('generateName')} has no paths under {DATA_ROOT}, "
+                    f"so user {user} would share its data with every other user"
+                )
+            wf["metadata"] = copy.deepcopy(template["metadata"])
+        labels = wf["metadata"].setdefault("labels", {})
+        labels["user"] = str(user)
+        labels["overlap"] = str(user in overlapping).lower()
+        instances.append(wf)
+    return instances
+
+
+def generate_load(
+    submitter: WorkflowSubmitter,
+    templates: list[dict],
+    users: int,
+    reuse_users: int,
+    arrival: str = "burst",
+    rate: Optional[float] = None,
+    seed: int = 0,
+) -> list:
+    """Open loop: every user is submitted at its arrival time, whether or not earlier ones finished"""
+    workflows = user_workflows(templates, users, reuse_users, seed)
+    offsets = arrival_offsets(users, arrival, rate, seed)
+    log.info(f"Submitting {users} users ({reuse_users} overlapping) with {arrival} arrivals over {max(offsets, default=0):.1f}s")
+    return submitter.submit_all(workflows, offsets)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Submit one workflow per simulated user with a given arrival process")
+    parser.add_argument("workflow_file")
+    parser.add_argument("--namespace", "-n", required=True)
+    parser.add_argument("--users", type=int, required=True)
+    parser.add_argument("--reuse-users", type=int, default=0, help="users whose requests overlap")
+    parser.add_argument("--arrival", choices=ARRIVALS, default="burst")
+    parser.add_argument("--rate", type=float, default=None, help="users per second for constant/poisson arrivals")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--log", default="submit-log.csv", help="per-workflow submit timestamps")
+    args = parser.parse_args()
+
+    submitter = WorkflowSubmitter.from_env(args.namespace, workers=args.workers)
+    results = generate_load(
+        submitter, load_workflows(args.workflow_file), args.users, args.reuse_users,
+        args.arrival, args.rate, args.seed,
+    )
+    write_submit_log(results, args.log)
+    summary = summarize(results)
+    print(f"✅ Submitted {summary['submitted']} users ({summary['failed']} failed, max lag {summary['max_lag']:.2f}s), log in {args.log}")
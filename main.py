@@ -1,12 +1,27 @@
-import subprocess
 from logging import getLogger
+import os
 import sys
 from sma import SustainabilityMeasurementAgent, Config, SMAObserver, SMASession
 from dataclasses import dataclass
-from typing import Callable
+from typing import Callable, Optional
 
+from submitter import WorkflowSubmitter, load_workflows, write_submit_log, summarize
+from loadgen import generate_load
+from tracker import WorkflowTracker, NAMESPACES
+from scheduler import ExperimentMatrix, Checkpoint, run_schedule
+from steady_state import SteadyStateSettings, live_watch
+
+EXPERIMENTS_FILE = "experiments.yaml"
+SMA_CONFIG = "./sma-measurments.yaml"
+STATUS_DIR = "workflow-status"  # per-experiment workflow snapshots, see workflow_status.py
+PROXY_ACCESS_LOG = "/var/log/transformation-proxy/access.jsonl"  # hostPath of pipeline/service_proxy.py
+
+# (workflow file, namespace) per variant
+WORKFLOWS = {
+    True: ("pipeline/output/pipeline_reuse.yaml", "pipeline"),
+    False: ("pipeline/output/pipeline_noreuse.yaml", "no-reuse-pipeline"),
+}
 
-#TODO: add thing to handle the experimentes, e.g., multiple runs, which varaibles we are doing etc
 
 @dataclass
 class Experiment:
@@ -15,14 +30,70 @@ class Experiment:
     
     users: int
     reuse_users:int
+
+    reuse: bool = False
+    n_rows: int = 1000
+    arrival: str = "burst"
+    rate: float = 1.0
+
+    @classmethod
+    def from_factors(
+        cls, reuse: bool, users: int, reuse_users: int, n_rows: int, arrival: str, run: int, rate: float = 1.0
+    ) -> "Experiment":
+        variant = "reuse" if reuse else "no-reuse"
+        return cls(
+            name=f"{variant}-baremetal-u{users}-ru{reuse_users}-rows{n_rows}-{arrival}",
+            run=run,
+            users=users,
+            reuse_users=reuse_users,
+            reuse=reuse,
+            n_rows=n_rows,
+            arrival=arrival,
+            rate=rate,
+        )
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}-run{self.run}"
+
+    @property
+    def workflow_file(self) -> str:
+        return WORKFLOWS[self.reuse][0]
+
+    @property
+    def namespace(self) -> str:
+        return WORKFLOWS[self.reuse][1]
     
     def to_dict(self) -> dict:
         return {
             "experiment": self.name,
             "run": self.run,
             "users": self.users,
-            "reuse_users": self.reuse_users
+            "reuse_users": self.reuse_users,
+            "reuse": self.reuse,
+            "n_rows": self.n_rows,
+            "arrival": self.arrival,
+            "rate": self.rate,
         }
+
+
+def with_n_rows(workflows: list[dict], n_rows: int) -> list[dict]:
+    """Rewrite the n_rows argument of every container (curl -F n_rows=X and --n_rows X)"""
+    for wf in workflows:
+        for template in wf["spec"].get("templates", []):
+            container = template.get("container")
+            if not container:
+                continue
+            for field in ("command", "args"):
+                values = container.get(field) or []
+                for i, value in enumerate(values):
+                    if not isinstance(value, str):
+                        continue
+                    if value.startswith("n_rows="):
+                        values[i] = f"n_rows={n_rows}"
+                    elif value == "--n_rows" and i + 1 < len(values):
+                        values[i + 1] = str(n_rows)
+    return workflows
     
     
 def prepare_experiment(experiment: Experiment) -> None:
@@ -30,14 +101,90 @@ def prepare_experiment(experiment: Experiment) -> None:
     pass
 
 
-def wait_for_experiment_completion(experiment) -> Callable[[], dict]:
+def submit_experiment_workflows(experiment: Experiment, extension: int = 0) -> list:
+    # ARGO_SERVER / ARGO_TOKEN are read like the argo CLI does
+    submitter = WorkflowSubmitter.from_env(experiment.namespace, workers=32)
+    templates = with_n_rows(load_workflows(experiment.workflow_file), experiment.n_rows)
+    # the run number seeds arrivals and the overlapping users, so repetitions
+    # differ from each other but a rerun of the same run does not
+    results = generate_load(
+        submitter, templates, experiment.users, experiment.reuse_users,
+        experiment.arrival, experiment.rate, seed=experiment.run + 1000 * extension,
+    )
+    suffix = f"-ext{extension}" if extension else ""
+    write_submit_log(results, f"submit-log-{experiment.key}{suffix}.csv")
+    return results
+
+
+def submit_and_wait(experiment: Experiment, status_dir: str, extension: int = 0, cancel=None) -> tuple[dict, dict]:
+    # the watch streams start with the current state, so opening them
+    # after submission cannot miss a workflow that finished quickly
+    results = submit_experiment_workflows(experiment, extension)
+    submission = summarize(results)
+    print(f"Submitted {submission['submitted']} workflows ({submission['failed']} failed)")
+
+    expected = {namespace: set() for namespace in NAMESPACES}
+    for r in results:
+        if r.ok:
+            expected[r.namespace].add(r.name)
+
+    print("Waiting for all workflows to finish...")
+    timings = WorkflowTracker.from_env(snapshot_dir=status_dir).wait(expected, cancel=cancel)
+    print(f"{timings['completed']}/{timings['tracked']} workflows finished ✅")
+    return submission, timings
+
+
+def stop_workflows(names: list[str]) -> None:
+    submitters = {}
+    for item in names:
+        namespace, name = item.split("/", 1)
+        submitter = submitters.setdefault(namespace, WorkflowSubmitter.from_env(namespace))
+        submitter.stop(name)
+
+
+def wait_for_experiment_completion(experiment, steady_state: Optional[SteadyStateSettings] = None) -> Callable[[], dict]:
     def trigger() -> dict:
-        wrapper_script = "./run_all_experiments.sh"  
-        print(f"Starting experiment batch via {wrapper_script}...")
-        result = subprocess.run(wrapper_script, shell=True, check=True)
-        print("Wrapper script finished ✅")
+        status_dir = os.path.join(STATUS_DIR, experiment.key)
+        if steady_state is None or not steady_state.enabled:
+            submission, timings = submit_and_wait(experiment, status_dir)
+            return {
+                **experiment.to_dict(),
+                "submission": submission,
+                "timings": timings,
+                "workflow_status": status_dir,
+                "proxy_access_log": PROXY_ACCESS_LOG,
+            }
+
+        # the monitor decides when the repetition has seen enough: it stops
+        # waiting once the CI targets are met, or adds rounds of the same
+        # load while they are not
+        watch = live_watch(steady_state, SMA_CONFIG, experiment.namespace).start()
+        try:
+            submission, timings = submit_and_wait(experiment, status_dir, cancel=watch.stop_requested)
+            extensions = []
+            while not watch.monitor.converged and len(extensions) < steady_state.max_extensions:
+                watch.monitor.decide("extend", round=len(extensions) + 1)
+                more, more_timings = submit_and_wait(experiment, status_dir, len(extensions) + 1, watch.stop_requested)
+                extensions.append({"submission": more, "timings": more_timings})
 
-        return experiment.to_dict()
+            unfinished = timings["unfinished"] + [u for e in extensions for u in e["timings"]["unfinished"]]
+            if watch.stop_requested.is_set() and unfinished:
+                watch.monitor.decide("stop", unfinished=len(unfinished))
+                stop_workflows(unfinished)
+            else:
+                watch.monitor.decide("complete" if watch.monitor.converged else "not_converged")
+        finally:
+            watch.close()
+
+        return {
+            **experiment.to_dict(),
+            "submission": submission,
+            "timings": timings,
+            "extensions": extensions,
+            "workflow_status": status_dir,
+            "proxy_access_log": PROXY_ACCESS_LOG,
+            "steady_state": watch.monitor.report(),
+        }
 
     return trigger
     
@@ -47,7 +194,7 @@ def cleanup_experiment(experiment: Experiment) -> None:
 
 
 def main() -> None:
-    config = Config.from_file("./sma-measurments.yaml")
+    config = Config.from_file(SMA_CONFIG)
     log = getLogger("experiment.main")
 
     sma = SustainabilityMeasurementAgent(config)
@@ -55,27 +202,30 @@ def main() -> None:
        name="PipelineReuse"
     ))
     sma.connect()
-    
-    #TODO: generate Experiments form
-    
-    exp = Experiment(
-        name="no-reuse-baremetal-pipeline-experiment",
-        run=1,
-        users=100,
-        reuse_users=50
-    ) 
-    
-    prepare_experiment(exp)
-    
-    wait_for_exp = wait_for_experiment_completion(exp)
-    
-    #TODO: if you need to start trigger something before wating, now's the time, possibly in parallel...
-    
-    sma.run(wait_for_exp)
-    
-    cleanup_experiment(exp)
+
+    experiments_file = sys.argv[1] if len(sys.argv) > 1 else EXPERIMENTS_FILE
+    matrix = ExperimentMatrix.from_file(experiments_file)
+    experiments = [Experiment.from_factors(**factors, rate=matrix.rate) for factors in matrix.expand()]
+    checkpoint = Checkpoint(matrix.checkpoint, matrix.fingerprint())
+    steady_state = SteadyStateSettings.from_file(experiments_file)
+
+    def run_one(exp: Experiment) -> None:
+        prepare_experiment(exp)
+        
+        wait_for_exp = wait_for_experiment_completion(exp, steady_state)
+        
+        #TODO: if you need to start trigger something before wating, now's the time, possibly in parallel...
+        
+        try:
+            sma.run(wait_for_exp)
+        finally:
+            cleanup_experiment(exp)
+
+    ran = run_schedule(experiments, run_one, checkpoint, matrix.cooldown)
     sma.teardown()
 
+    log.info(f"Ran {ran} experiments")
+
     log.info("Sustainability Measurement Agent finished.")
 
 
@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+from datetime import datetime
+from glob import glob
+from logging import getLogger
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+log = getLogger("experiment.metric_store")
+
+STORE_DIR = "columnar"
+MANIFEST = "manifest.json"
+TIME_COLUMN = "timestamp"
+DICT_SUFFIX = ".dict"
+
+TimeBound = Union[str, int, float, datetime, pd.Timestamp, None]
+
+
+def _scalar(value):
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _to_ns(bound: TimeBound) -> Optional[int]:
+    if bound is None:
+        return None
+    if isinstance(bound, (int, float)):
+        return int(bound * 1e9)  # epoch seconds, like the second timestamp column of the exports
+    ts = pd.Timestamp(bound)
+    return (ts.tz_localize("UTC") if ts.tzinfo is None else ts).value
+
+
+def is_run_dir(path: str) -> bool:
+    return bool(glob(os.path.join(path, "data", "*.csv")))
+
+
+def convert_metric(csv_path: str, out_dir: str) -> dict:
+    """Write one exported metric CSV as one .npy file per column, returns its manifest entry"""
+    df = pd.read_csv(csv_path, low_memory=False)
+
+    # the exports carry the sample time twice: as an ISO string and, under the
+    # same header, as epoch seconds (read back as "timestamp.1")
+    df = df.drop(columns=[c for c in df.columns if c.startswith(f"{TIME_COLUMN}.")])
+    timestamps = pd.to_datetime(df.pop(TIME_COLUMN), utc=True, format="ISO8601")
+    ns = timestamps.dt.tz_convert(None).to_numpy().astype("datetime64[ns]").view(np.int64)
+    order = np.argsort(ns, kind="stable")
+    df = df.iloc[order].reset_index(drop=True)
+
+    arrays = {TIME_COLUMN: ns[order]}
+    constants, columns = {}, {}
+    for name in df.columns:
+        values = df[name]
+        if len(df) and values.nunique(dropna=False) == 1:
+            constants[name] = _scalar(values.iloc[0])
+        elif values.dtype == object:
+            codes, categories = pd.factorize(values)
+            arrays[name] = codes.astype(np.int32)  # -1 marks a missing value
+            arrays[name + DICT_SUFFIX] = np.asarray(categories, dtype=str)
+            columns[name] = {"encoding": "dictionary", "dtype": "str", "cardinality": len(categories)}
+        else:
+            arrays[name] = values.to_numpy()
+            columns[name] = {"encoding": "plain", "dtype": str(values.dtype)}
+
+    # separate files rather than one .npz: reading a zip member costs more than
+    # the small columns themselves, and projection then never touches the rest
+    os.makedirs(out_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), array)
+    return {
+        "directory": os.path.basename(out_dir),
+        "rows": len(df),
+        "start": int(arrays[TIME_COLUMN][0]) if len(df) else None,
+        "end": int(arrays[TIME_COLUMN][-1]) if len(df) else None,
+        "constants": constants,
+        "columns": columns,
+    }
+
+
+def convert_run(run_dir: str, force: bool = False) -> Optional[str]:
+    """Convert data/*.csv of one run into {run_dir}/columnar, returns the store path"""
+    store = os.path.join(run_dir, STORE_DIR)
+    manifest_path = os.path.join(store, MANIFEST)
+    if os.path.exists(manifest_path) and not force:
+        return None
+
+    os.makedirs(store, exist_ok=True)
+    metrics = {}
+    for csv_path in sorted(glob(os.path.join(run_dir, "data", "*.csv"))):
+        metric = os.path.splitext(os.path.basename(csv_path))[0]
+        metrics[metric] = convert_metric(csv_path, os.path.join(store, metric))
+
+    manifest = {
+        "version": "1.0",
+        "created_at": datetime.now().isoformat(),
+        "format": "npy",
+        "time_unit": "ns",
+        "metrics": metrics,
+    }
+    # written last, so a store without a manifest is an interrupted conversion
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+    return store
+
+
+class MetricStore:
+    """
+    Read side of a converted run. Only the requested columns are read, and
+    time predicates are applied by binary search on the sorted timestamps.
+    """
+
+    def __init__(self, run_dir: str):
+        self.run_dir = run_dir
+        self.path = os.path.join(run_dir, STORE_DIR)
+        with open(os.path.join(self.path, MANIFEST), "r") as f:
+            self.manifest = json.load(f)
+
+    @property
+    def metrics(self) -> list[str]:
+        return list(self.manifest["metrics"])
+
+    def columns(self, metric: str) -> list[str]:
+        return [TIME_COLUMN, *self.manifest["metrics"][metric]["columns"]]
+
+    def constants(self, metric: str) -> dict:
+        return dict(self.manifest["metrics"][metric]["constants"])
+
+    def load(
+        self,
+        metric: str,
+        columns: Optional[list[str]] = None,
+        start: TimeBound = None,
+        end: TimeBound = None,
+        constants: bool = False,
+    ) -> pd.DataFrame:
+        """Rows with start <= timestamp < end; constant labels are only added as columns on request"""
+        entry = self.manifest["metrics"][metric]
+        wanted = self.columns(metric) if columns is None else list(columns)
+        unknown = set(wanted) - set(self.columns(metric)) - set(entry["constants"])
+        if unknown:
+            raise KeyError(f"{metric} has no columns {sorted(unknown)}")
+
+        directory = os.path.join(self.path, entry["directory"])
+
+        def read(name):
+            return np.load(os.path.join(directory, f"{name}.npy"))
+
+        ts = read(TIME_COLUMN)
+        lo = 0 if start is None else int(np.searchsorted(ts, _to_ns(start), side="left"))
+        hi = len(ts) if end is None else int(np.searchsorted(ts, _to_ns(end), side="left"))
+
+        frame = {}
+        if constants:
+            wanted += [name for name in entry["constants"] if name not in wanted]
+        for name in wanted:
+            if name == TIME_COLUMN:
+                frame[name] = pd.DatetimeIndex(ts[lo:hi].view("datetime64[ns]")).tz_localize("UTC")
+            elif name in entry["constants"]:
+                frame[name] = entry["constants"][name]
+            elif entry["columns"][name]["encoding"] == "dictionary":
+                dtype = pd.CategoricalDtype(read(name + DICT_SUFFIX))
+                frame[name] = pd.Categorical.from_codes(read(name)[lo:hi], dtype=dtype, validate=False)
+            else:
+                frame[name] = read(name)[lo:hi]
+
+        return pd.DataFrame(frame, index=pd.RangeIndex(hi - lo), columns=wanted)
+
+
+def convert_all(root: str, force: bool = False) -> list[str]:
+    run_dirs = [p for p in sorted(glob(os.path.join(root, "*"))) if os.path.isdir(p) and is_run_dir(p)]
+    converted = [store for store in (convert_run(p, force) for p in run_dirs) if store]
+    log.info(f"Converted {len(converted)}/{len(run_dirs)} runs under {root}")
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert exported run metrics into a columnar store")
+    parser.add_argument("root", nargs="?", default="data", help="directory holding the run directories")
+    parser.add_argument("--force", action="store_true", help="rewrite runs that were already converted")
+    args = parser.parse_args()
+
+    converted = convert_all(args.root, args.force)
+    print(f"✅ Converted {len(converted)} runs")
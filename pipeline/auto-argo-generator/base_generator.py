@@ -1,22 +1,170 @@
+import os
+import sys
 import yaml
 import hashlib
 
+# dependency inference and shard expansion are shared with the parsers in pipeline/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dag_utils import MERGE_IMAGE, MERGE_SCRIPT, MERGE_STAGE, expand_shards, infer_dependencies, param_role, produced_names
+
 
 class BaseArgoGenerator:
-    def __init__(self, config_path: str):
+    def __init__(self, config_path: str, input_root: str = None):
         with open(config_path, "r") as f:
             self.config = yaml.safe_load(f)
+        self.input_root = input_root
+        if any("sharding" in stage for stage in self.config["stages"]):
+            self.config["stages"].append(MERGE_STAGE)
+        # looked up for every parameter of every call, so not a scan of the list
+        self.stage_defs = {stage["name"]: stage for stage in self.config["stages"]}
 
 
     def _hash_stage(self, stage_name: str, parameters: dict) -> str:
         raw = f"{stage_name}:{sorted(parameters.items())}"
         return hashlib.md5(raw.encode()).hexdigest()[:8]
 
+    def _lineage_hash(self, stage_name: str, parameters: dict, upstream: list[str],
+                      input_digests: list[str] = ()) -> str:
+        raw = f"{self._hash_stage(stage_name, parameters)}:{sorted(upstream)}:{sorted(input_digests)}"
+        return hashlib.md5(raw.encode()).hexdigest()[:8]
+
+    def _file_digest(self, value) -> str:
+        if self.input_root is None:
+            return None
+
+        path = os.path.join(self.input_root, str(value).lstrip("/"))
+        if os.path.isfile(path):
+            files = [path]
+        elif os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names
+            )
+        else:
+            return None
+
+        digest = hashlib.sha256()
+        for file_path in files:
+            digest.update(os.path.relpath(file_path, path).encode())
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def _pipeline_lineage(self, pipeline: dict) -> list[tuple[dict, list[int], str]]:
+        # Merkle-style: a call's hash covers its own parameters, the hashes of
+        # the calls it reads from and the content of external input files.
+        nodes = []
+        for block, upstream in self._infer_upstream(pipeline):
+            stage_name = block["stage"]
+            params = block.get("parameters", {})
+            produced = set().union(*(self._produced_names(nodes[i][0]) for i in upstream))
+            digests = [
+                d for d in (
+                    self._file_digest(v) for k, v in params.items()
+                    if self._param_role(stage_name, k) == "input" and str(v) not in produced
+                )
+                if d is not None
+            ]
+            node_hash = self._lineage_hash(
+                stage_name, params, [nodes[i][2] for i in upstream], digests
+            )
+            nodes.append((block, upstream, node_hash))
+        return nodes
+
     def _get_stage_params(self, stage_name: str):
-        for stage in self.config["stages"]:
-            if stage["name"] == stage_name:
-                return list(stage["parameters"].keys())
-        raise ValueError(f"Stage not found: {stage_name}")
+        stage = self._get_stage_def(stage_name)
+        params = list(stage["parameters"].keys())
+        if "sharding" in stage and stage["sharding"].get("seed", "seed") not in params:
+            params.append(stage["sharding"].get("seed", "seed"))
+        return params
+
+    def _get_stage_def(self, stage_name: str) -> dict:
+        if stage_name not in self.stage_defs:
+            raise ValueError(f"Stage not found: {stage_name}")
+        return self.stage_defs[stage_name]
+
+    def _param_role(self, stage_name: str, param: str) -> str:
+        return param_role(self._get_stage_def(stage_name), param)
+
+    def _produced_names(self, block: dict) -> set[str]:
+        return produced_names(block, self._get_stage_def(block["stage"]))
+
+    def _expand(self, block: dict) -> list[dict]:
+        # each shard gets its own lineage hash, so shards are reused one by one
+        return expand_shards(block, self._get_stage_def(block["stage"]))
+
+    def _fan_outs(self, nodes: list) -> list[list[int]]:
+        # node indices per task: the shards of one call fan out as one task
+        groups = []
+        for i, node in enumerate(nodes):
+            shard = node[0].get("shard")
+            if shard and shard["index"] > 0:
+                groups[-1].append(i)
+            else:
+                groups.append([i])
+        return groups
+
+    def _fan_out(self, steps: list[dict]) -> dict:
+        """
+        One withItems step for the shards' steps: parameters that differ
+        between shards come from the item. The step is only skipped when every
+        shard would be.
+        """
+        if len(steps) == 1:
+            return steps[0]
+        by_name = [{p["name"]: p["value"] for p in s["arguments"]["parameters"]} for s in steps]
+        varying = [k for k in by_name[0] if any(b[k] != by_name[0][k] for b in by_name)]
+        step = dict(steps[0])
+        names = ",".join(s["name"] for s in steps)
+        step["name"] = f"{step['template'].removesuffix('-cached')}-shards-{hashlib.md5(names.encode()).hexdigest()[:8]}"
+        step["arguments"] = {"parameters": [
+            {"name": k, "value": f"{{{{item.{k}}}}}" if k in varying else v}
+            for k, v in by_name[0].items()
+        ]}
+        step["withItems"] = [{k: b[k] for k in varying} for b in by_name]
+        if not all("when" in s for s in steps):
+            step.pop("when", None)
+        return step
+
+    def _argument_value(self, value):
+        return ",".join(map(str, value)) if isinstance(value, list) else value
+
+    def _flow_groups(self, pipeline: dict) -> list[list[dict]]:
+        groups = []
+        for block in pipeline["flow"]:
+            if "parallel" in block:
+                groups.append(list(block["stages"]))
+            else:
+                groups.append([block])
+        return groups
+
+    def _infer_upstream(self, pipeline: dict) -> list[tuple[dict, list[int]]]:
+        # Dependencies between the configured calls come from
+        # dag_utils.infer_dependencies. A sharded call expands to its shards,
+        # which share its upstream, and a merge call that stands in for it
+        # downstream.
+        groups = self._flow_groups(pipeline)
+        blocks = [block for group in groups for block in group]
+        dependencies = infer_dependencies(
+            [[(block, block) for block in group] for group in groups], self.stage_defs
+        )
+        nodes = []
+        stand_in = []  # node index of each configured call
+
+        for block, upstream in zip(blocks, dependencies):
+            upstream = [stand_in[i] for i in upstream]
+            expanded = self._expand(block)
+            for call in expanded[:-1]:
+                nodes.append((call, upstream))
+            if len(expanded) > 1:
+                upstream = list(range(len(nodes) - len(expanded) + 1, len(nodes)))
+
+            stand_in.append(len(nodes))
+            nodes.append((expanded[-1], upstream))
+
+        return nodes
 
 
     def _base_workflow(self, name: str) -> dict:
@@ -34,6 +182,16 @@ class BaseArgoGenerator:
 
     def _create_template(self, stage_name: str) -> dict:
         params = self._get_stage_params(stage_name)
+        if stage_name == MERGE_STAGE["name"]:
+            return {
+                "name": stage_name,
+                "inputs": {"parameters": [{"name": p} for p in params]},
+                "container": {
+                    "image": MERGE_IMAGE,
+                    "command": ["python", "-c", MERGE_SCRIPT],
+                    "args": [f"--{p}={{{{inputs.parameters.{p}}}}}" for p in params],
+                },
+            }
 
         return {
             "name": stage_name,
@@ -44,7 +202,7 @@ class BaseArgoGenerator:
                 "image": f"{stage_name}:latest",
                 "command": ["python", "app.py"],
                 "args": [
-                    f"--{p}={{inputs.parameters.{p}}}" for p in params
+                    f"--{p}={{{{inputs.parameters.{p}}}}}" for p in params
                 ]
             }
         }
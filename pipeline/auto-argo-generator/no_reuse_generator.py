@@ -1,13 +1,24 @@
+from typing import Iterator
+
 from base_generator import BaseArgoGenerator
+from dag_utils import annotate_critical_path
 
 
 class NoReuseArgoGenerator(BaseArgoGenerator):
 
+    def __init__(self, config_path: str, dag: bool = False):
+        super().__init__(config_path)
+        self.dag = dag
+
     def generate_all(self) -> list[dict]:
-        workflows = []
+        return list(self.iter_all())
+
+    def iter_all(self) -> Iterator[dict]:
         for pipeline in self.config["pipelines"]:
-            workflows.append(self._generate_one(pipeline))
-        return workflows
+            if self.dag:
+                yield self._generate_dag(pipeline)
+            else:
+                yield self._generate_one(pipeline)
 
     def _generate_one(self, pipeline: dict) -> dict:
         workflow = self._base_workflow(pipeline["name"])
@@ -15,22 +26,23 @@ class NoReuseArgoGenerator(BaseArgoGenerator):
         templates = {}
         steps = []
 
-        for block in pipeline["flow"]:
-            if "parallel" in block:
-                parallel_steps = []
-                for stage in block["stages"]:
-                    step_name = f"{stage['stage']}-{id(stage)}"
-                    parallel_steps.append([
-                        self._create_step(step_name, stage)
-                    ])
-                    templates[stage["stage"]] = self._create_template(stage["stage"])
-                steps.append(parallel_steps)
-            else:
-                step_name = f"{block['stage']}-{id(block)}"
-                steps.append([
-                    [self._create_step(step_name, block)]
-                ])
-                templates[block["stage"]] = self._create_template(block["stage"])
+        for group in self._flow_groups(pipeline):
+            # a sharded call fans out in its group and merges in the next one
+            parallel_steps, merge_steps = [], []
+            for block in group:
+                *shards, call = self._expand(block)
+                if shards:
+                    parallel_steps.append([self._fan_out([
+                        self._create_step(f"{shard['stage']}-{id(shard)}", shard) for shard in shards
+                    ])])
+                    merge_steps.append([self._create_step(f"{call['stage']}-{id(call)}", call)])
+                    templates[block["stage"]] = self._create_template(block["stage"])
+                else:
+                    parallel_steps.append([self._create_step(f"{call['stage']}-{id(call)}", call)])
+                templates[call["stage"]] = self._create_template(call["stage"])
+            steps.append(parallel_steps)
+            if merge_steps:
+                steps.append(merge_steps)
 
         workflow["spec"]["templates"] = (
             [{"name": "main", "steps": steps}]
@@ -39,13 +51,41 @@ class NoReuseArgoGenerator(BaseArgoGenerator):
 
         return workflow
 
+    def _generate_dag(self, pipeline: dict) -> dict:
+        workflow = self._base_workflow(pipeline["name"])
+
+        templates = {}
+        tasks = []
+
+        nodes = self._infer_upstream(pipeline)
+        task_names = {}
+        for indices in self._fan_outs(nodes):
+            calls = []
+            for i in indices:
+                block, upstream = nodes[i]
+                task = self._create_step(f"{block['stage']}-{id(block)}", block)
+                if upstream:
+                    task["dependencies"] = list(dict.fromkeys(task_names[u] for u in upstream))
+                calls.append(task)
+                templates[block["stage"]] = self._create_template(block["stage"])
+            tasks.append(self._fan_out(calls))
+            for i in indices:
+                task_names[i] = tasks[-1]["name"]
+
+        main = {"name": "main", "dag": {"tasks": tasks}}
+        annotate_critical_path(workflow, main)
+
+        workflow["spec"]["templates"] = [main] + list(templates.values())
+
+        return workflow
+
     def _create_step(self, name: str, block: dict) -> dict:
         return {
             "name": name,
             "template": block["stage"],
             "arguments": {
                 "parameters": [
-                    {"name": k, "value": v}
+                    {"name": k, "value": self._argument_value(v)}
                     for k, v in block["parameters"].items()
                 ]
             }
@@ -1,13 +1,42 @@
+import json
+import os
+import shlex
+from typing import Iterator
+
 from base_generator import BaseArgoGenerator
+from dag_utils import annotate_critical_path
+from stage_cache import StageCacheIndex, DONE_MARKER
+
+
+PVC_NAME = "argo-shard-pvc"
+RECOMPUTE_GUARD = "{{workflow.parameters.recompute}} == true"
 
 
 class ReuseAwareArgoGenerator(BaseArgoGenerator):
 
+    def __init__(self, config_path: str, global_reuse: bool = False,
+                 cache_index: StageCacheIndex = None, input_root: str = None,
+                 dag: bool = False):
+        super().__init__(config_path, input_root)
+        self.global_reuse = global_reuse
+        self.cache_index = cache_index
+        self.dag = dag
+
     def generate_all(self) -> list[dict]:
-        workflows = []
-        for pipeline in self.config["pipelines"]:
-            workflows.append(self._generate_one(pipeline))
-        return workflows
+        return list(self.iter_all())
+
+    def iter_all(self) -> Iterator[dict]:
+        if self.global_reuse:
+            yield self._generate_global()
+        else:
+            for pipeline in self.config["pipelines"]:
+                if self.dag:
+                    yield self._generate_dag(pipeline)
+                else:
+                    yield self._generate_one(pipeline)
+
+        if self.cache_index is not None:
+            self.cache_index.save()
 
     def _generate_one(self, pipeline: dict) -> dict:
         workflow = self._base_workflow(f"{pipeline['name']}-reuse")
@@ -16,40 +45,197 @@ class ReuseAwareArgoGenerator(BaseArgoGenerator):
         executed = {}
         steps = []
 
-        for block in pipeline["flow"]:
-            if "parallel" in block:
-                parallel_steps = []
-                for stage in block["stages"]:
-                    step = self._reuse_step(stage, templates, executed)
-                    parallel_steps.append([step])
-                steps.append(parallel_steps)
-            else:
-                step = self._reuse_step(block, templates, executed)
-                steps.append([[step]])
+        nodes = self._pipeline_lineage(pipeline)
+        position = 0
+
+        for group in self._flow_groups(pipeline):
+            # a sharded call fans out in its group and merges in the next one
+            size = sum(len(self._expand(block)) for block in group)
+            group_nodes = nodes[position:position + size]
+            parallel_steps, merge_steps = [], []
+            for indices in self._fan_outs(group_nodes):
+                calls = []
+                for i in indices:
+                    block, upstream, node_hash = group_nodes[i]
+                    step = self._reuse_step(block, node_hash, templates, executed)
+                    upstream_nodes = [(nodes[u][0], nodes[u][2]) for u in upstream]
+                    calls.append(self._with_cache(step, block, node_hash, upstream_nodes, templates))
+                target = merge_steps if "merges" in group_nodes[indices[0]][0] else parallel_steps
+                target.append([self._fan_out(calls)])
+            steps.append(parallel_steps)
+            if merge_steps:
+                steps.append(merge_steps)
+            position += size
 
         workflow["spec"]["templates"] = (
             [{"name": "main", "steps": steps}]
             + list(templates.values())
         )
 
-        return workflow
+        return self._with_cache_volume(workflow)
+
+    def _generate_dag(self, pipeline: dict) -> dict:
+        workflow = self._base_workflow(f"{pipeline['name']}-reuse")
+
+        templates = {}
+        tasks = {}
+        self._add_dag_tasks(pipeline, tasks, templates)
+
+        main = {"name": "main", "dag": {"tasks": list(tasks.values())}}
+        annotate_critical_path(workflow, main)
+        workflow["spec"]["templates"] = [main] + list(templates.values())
+
+        return self._with_cache_volume(workflow)
+
+    def _generate_global(self) -> dict:
+        workflow = self._base_workflow("global-reuse")
+
+        templates = {}
+        tasks = {}
+        consumers = {}
+
+        for pipeline in self.config["pipelines"]:
+            consumers[pipeline["name"]] = self._add_dag_tasks(pipeline, tasks, templates)
+
+        workflow["metadata"]["annotations"] = {
+            "reuse/consumers": json.dumps(consumers, sort_keys=True)
+        }
+        workflow["spec"]["templates"] = (
+            [{"name": "main", "dag": {"tasks": list(tasks.values())}}]
+            + list(templates.values())
+        )
+
+        return self._with_cache_volume(workflow)
 
-    def _reuse_step(self, block: dict, templates: dict, executed: dict) -> dict:
+    def _add_dag_tasks(self, pipeline: dict, tasks: dict, templates: dict) -> list[str]:
+        pipeline_tasks = []
+        nodes = self._pipeline_lineage(pipeline)
+        task_names = {}
+
+        for indices in self._fan_outs(nodes):
+            key = ",".join(nodes[i][2] for i in indices)
+            if key not in tasks:
+                calls = []
+                for i in indices:
+                    block, upstream, node_hash = nodes[i]
+                    task = self._reuse_task(block, node_hash)
+                    templates[block["stage"]] = self._create_template(block["stage"])
+                    dependencies = [task_names[u] for u in upstream]
+                    if dependencies:
+                        task["dependencies"] = sorted(set(dependencies))
+                    upstream_nodes = [(nodes[u][0], nodes[u][2]) for u in upstream]
+                    calls.append(self._with_cache(task, block, node_hash, upstream_nodes, templates))
+                tasks[key] = self._fan_out(calls)
+
+            for i in indices:
+                task_names[i] = tasks[key]["name"]
+            pipeline_tasks.append(tasks[key]["name"])
+
+        return pipeline_tasks
+
+    def _reuse_task(self, block: dict, node_hash: str) -> dict:
+        return {
+            "name": f"{block['stage']}-{node_hash}",
+            "template": block["stage"],
+            "arguments": {
+                "parameters": [
+                    {"name": k, "value": self._argument_value(v)}
+                    for k, v in block.get("parameters", {}).items()
+                ]
+            }
+        }
+
+    def _reuse_step(self, block: dict, node_hash: str, templates: dict, executed: dict) -> dict:
         stage_name = block["stage"]
-        params = block["parameters"]
-        stage_hash = self._hash_stage(stage_name, params)
 
-        if stage_hash not in executed:
-            executed[stage_hash] = f"{stage_name}-{stage_hash}"
+        if node_hash not in executed:
+            executed[node_hash] = f"{stage_name}-{node_hash}"
             templates[stage_name] = self._create_template(stage_name)
 
         return {
-            "name": executed[stage_hash],
+            "name": executed[node_hash],
             "template": stage_name,
             "arguments": {
                 "parameters": [
-                    {"name": k, "value": v}
-                    for k, v in params.items()
+                    {"name": k, "value": self._argument_value(v)}
+                    for k, v in block["parameters"].items()
                 ]
             }
         }
+
+    def _with_cache(self, step: dict, block: dict, node_hash: str,
+                    upstream: list[tuple[dict, str]], templates: dict) -> dict:
+        # Outputs go to a content-addressed directory on the PVC; inputs read
+        # from upstream calls are pointed at that call's directory.
+        if self.cache_index is None:
+            return step
+
+        stage_name = block["stage"]
+        location = self.cache_index.register(
+            node_hash, stage_name, [upstream_hash for _, upstream_hash in upstream]
+        )
+
+        locations = {}
+        for upstream_block, upstream_hash in upstream:
+            upstream_location = self.cache_index.location(upstream_hash)
+            for name in self._produced_names(upstream_block):
+                if name in (upstream_block["stage"], upstream_block.get("merges")):
+                    locations[name] = upstream_location
+                else:
+                    locations[name] = f"{upstream_location}/{name}"
+
+        parameters = []
+        for k, v in block.get("parameters", {}).items():
+            role = self._param_role(stage_name, k)
+            if role == "output":
+                v = f"{location}/{v}"
+            elif role == "input" and isinstance(v, list):
+                v = [locations.get(str(item), item) for item in v]
+            elif role == "input" and str(v) in locations:
+                v = locations[str(v)]
+            parameters.append({"name": k, "value": self._argument_value(v)})
+        parameters.append({"name": "cache_dir", "value": location})
+
+        step["template"] = f"{stage_name}-cached"
+        step["arguments"] = {"parameters": parameters}
+        templates.pop(stage_name, None)
+        templates[step["template"]] = self._create_cached_template(stage_name)
+
+        if self.cache_index.is_materialized(node_hash):
+            step["when"] = RECOMPUTE_GUARD
+        return step
+
+    def _with_cache_volume(self, workflow: dict) -> dict:
+        if self.cache_index is None:
+            return workflow
+
+        workflow["spec"]["arguments"] = {
+            "parameters": [{"name": "recompute", "value": "false"}]
+        }
+        workflow["spec"]["volumes"] = [
+            {"name": "shared-data", "persistentVolumeClaim": {"claimName": PVC_NAME}}
+        ]
+        return workflow
+
+    def _create_cached_template(self, stage_name: str) -> dict:
+        # Pre-check: a call whose output directory is already marked done is a
+        # no-op, so concurrent or later runs never recompute it.
+        template = self._create_template(stage_name)
+        container = template["container"]
+        cache_dir = "{{inputs.parameters.cache_dir}}"
+        run = " ".join(shlex.quote(c) for c in container["command"] + container["args"])
+
+        template["name"] = f"{stage_name}-cached"
+        template["inputs"]["parameters"].append({"name": "cache_dir"})
+        template["container"] = {
+            "image": container["image"],
+            "command": ["sh", "-c"],
+            "args": [
+                f"test -f {cache_dir}/{DONE_MARKER} && exit 0; "
+                f"mkdir -p {cache_dir} && {run} && touch {cache_dir}/{DONE_MARKER}"
+            ],
+            "volumeMounts": [
+                {"name": "shared-data", "mountPath": os.path.dirname(self.cache_index.cache_root)}
+            ]
+        }
+        return template
@@ -0,0 +1,65 @@
+import json
+import os
+import sys
+from datetime import datetime
+
+
+CACHE_ROOT = "/mnt/data/argo-shard/cache"
+DONE_MARKER = ".done"
+
+
+class StageCacheIndex:
+    """Persistent map from a stage call's lineage hash to its output location on the PVC."""
+
+    def __init__(self, path: str, cache_root: str = CACHE_ROOT):
+        self.path = path
+        self.cache_root = cache_root
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+
+    def location(self, lineage_hash: str) -> str:
+        return f"{self.cache_root}/{lineage_hash}"
+
+    def is_materialized(self, lineage_hash: str) -> bool:
+        entry = self.entries.get(lineage_hash)
+        return bool(entry and entry["materialized"])
+
+    def register(self, lineage_hash: str, stage_name: str, upstream: list[str]) -> str:
+        if lineage_hash not in self.entries:
+            self.entries[lineage_hash] = {
+                "stage": stage_name,
+                "location": self.location(lineage_hash),
+                "upstream": sorted(upstream),
+                "materialized": False,
+                "registered_at": datetime.now().isoformat(),
+            }
+        return self.entries[lineage_hash]["location"]
+
+    def refresh(self, mount_path: str) -> int:
+        # mount_path is a local mount of cache_root, e.g. via pvc-copy-pod
+        materialized = 0
+        for lineage_hash, entry in self.entries.items():
+            entry["materialized"] = os.path.exists(
+                os.path.join(mount_path, lineage_hash, DONE_MARKER)
+            )
+            materialized += entry["materialized"]
+        return materialized
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=4, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python stage_cache.py <index.json> <mounted cache dir>")
+        sys.exit(1)
+
+    index = StageCacheIndex(sys.argv[1])
+    count = index.refresh(sys.argv[2])
+    index.save()
+    print(f"✅ {count}/{len(index.entries)} cached stage outputs materialized")
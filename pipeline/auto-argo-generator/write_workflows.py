@@ -1,27 +1,35 @@
 #pip install pyyaml
-import yaml
+from typing import Iterable
+
 from no_reuse_generator import NoReuseArgoGenerator
 from reuse_generator import ReuseAwareArgoGenerator
+from dag_utils import report_critical_paths
+from stage_cache import StageCacheIndex
+from workflow_writer import write_workflows
 
 CONFIG_PATH = "config.yaml"
+CACHE_INDEX_PATH = "stage-cache.json"
 
 
-def write_yaml(filename: str, workflows: list[dict]):
-    with open(filename, "w") as f:
-        yaml.dump_all(
-            workflows,
-            f,
-            explicit_start=True, 
-            sort_keys=False
-        )
+def write_yaml(filename: str, workflows: Iterable[dict]) -> None:
+    # the parsers' writer: same Dumper, so both paths emit the same bytes,
+    # and workflows are written as the generators yield them
+    write_workflows(workflows, filename)
 
 
 if __name__ == "__main__":
     no_reuse_gen = NoReuseArgoGenerator(CONFIG_PATH)
+    no_reuse_dag_gen = NoReuseArgoGenerator(CONFIG_PATH, dag=True)
     reuse_gen = ReuseAwareArgoGenerator(CONFIG_PATH)
+    reuse_dag_gen = ReuseAwareArgoGenerator(CONFIG_PATH, dag=True)
+    global_reuse_gen = ReuseAwareArgoGenerator(CONFIG_PATH, global_reuse=True)
+    cached_reuse_gen = ReuseAwareArgoGenerator(
+        CONFIG_PATH, global_reuse=True, cache_index=StageCacheIndex(CACHE_INDEX_PATH)
+    )
 
-    no_reuse_workflows = no_reuse_gen.generate_all()
-    reuse_workflows = reuse_gen.generate_all()
-
-    write_yaml("argo-no-reuse.yaml", no_reuse_workflows)
-    write_yaml("argo-reuse.yaml", reuse_workflows)
+    write_yaml("argo-no-reuse.yaml", no_reuse_gen.iter_all())
+    write_yaml("argo-no-reuse-dag.yaml", report_critical_paths(no_reuse_dag_gen.iter_all()))
+    write_yaml("argo-reuse.yaml", reuse_gen.iter_all())
+    write_yaml("argo-reuse-dag.yaml", report_critical_paths(reuse_dag_gen.iter_all()))
+    write_yaml("argo-reuse-global.yaml", global_reuse_gen.iter_all())
+    write_yaml("argo-reuse-cached.yaml", cached_reuse_gen.iter_all())
@@ -0,0 +1,226 @@
+import argparse
+import cProfile
+import itertools
+import json
+import multiprocessing
+import os
+import pstats
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "auto-argo-generator"))
+
+RESULTS_PATH = "bench-results.json"
+BASELINE_PATH = "bench-baseline.json"
+PHASES = ("generate", "serialize")
+TARGETS = ["parser_reuse", "parser_reuse_dag", "parser_noreuse", "no_reuse_generator", "reuse_generator", "reuse_generator_global"]
+
+
+def synthetic_config(pipelines: int, stages: int, width: int, params: int, seed: int = 0) -> dict:
+    """
+    A config.yaml shaped config with the given number of pipelines, stage calls
+    per pipeline, calls per parallel group and value parameters per stage.
+    Every call reads the output of an earlier call of its pipeline, so the
+    dependency inference has real work to do.
+    """
+    rng = random.Random(seed)
+    stage_defs = []
+    for s in range(stages):
+        parameters = {f"p{j}": {"type": "string"} for j in range(params)}
+        parameters.update({"input_file": {"type": "string"}, "output_file": {"type": "string"}})
+        stage_defs.append({"name": f"stage-{s}", "image": f"sepidmas/reuse_scale-stage-{s}",
+                           "data-path": "/mnt/data", "port": 5000 + s, "parameters": parameters})
+
+    pipeline_defs = []
+    for p in range(pipelines):
+        flow, calls = [], 0
+        while calls < stages:
+            group = []
+            for _ in range(min(width, stages - calls)):
+                source = f"out-{rng.randrange(calls)}.csv" if calls else "/app/data/input/real-data.csv"
+                group.append({
+                    "stage": f"stage-{calls}",
+                    "parameters": {
+                        **{f"p{j}": f"value-{p}-{j}-{rng.randrange(1000)}" for j in range(params)},
+                        "input_file": source,
+                        "output_file": f"out-{calls}.csv",
+                    },
+                })
+                calls += 1
+            flow.append({"parallel": True, "stages": group} if len(group) > 1 else group[0])
+        pipeline_defs.append({"name": f"pipeline-{p}", "flow": flow})
+
+    return {"Deployment": {"namespace": "pipeline"}, "stages": stage_defs, "pipelines": pipeline_defs}
+
+
+def _generator(target: str, config: dict, workdir: str):
+    """A zero-argument callable generating all workflows of config with target"""
+    if target.startswith("parser_reuse"):
+        import parser_reuse
+        return lambda: parser_reuse.generate_argo_with_reuse(config, dag=target.endswith("_dag"))
+    if target == "parser_noreuse":
+        import parser_noreuse
+        return lambda: parser_noreuse.generate_argo_with_parallel(config)
+
+    # the class based generators load their config from a file
+    config_path = os.path.join(workdir, "config.yaml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+    if target == "no_reuse_generator":
+        from no_reuse_generator import NoReuseArgoGenerator
+        generator = NoReuseArgoGenerator(config_path)
+    else:
+        from reuse_generator import ReuseAwareArgoGenerator
+        generator = ReuseAwareArgoGenerator(config_path, global_reuse=target.endswith("_global"))
+    return generator.generate_all
+
+
+def _serialize(workflows: list[dict]) -> int:
+    from workflow_writer import dump_workflow
+    return sum(len(dump_workflow(wf)) for wf in workflows)
+
+
+def _hotspots(profile: cProfile.Profile, top: int) -> list[dict]:
+    stats = pstats.Stats(profile)
+    rows = []
+    for (path, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.basename(path)}:{line}({function})",
+            "calls": calls,
+            "tottime": round(tottime, 6),
+            "cumtime": round(cumtime, 6),
+        })
+    return sorted(rows, key=lambda r: r["tottime"], reverse=True)[:top]
+
+
+def run_case(case: dict, repeat: int = 10, top: int = 10) -> dict:
+    """
+    Time generation and serialization of one synthetic config with one target.
+    Meant to run in a fresh process, so peak RSS belongs to this case alone.
+    Timings are the best of repeat runs, which scheduler and cache noise only
+    ever slow down; every run's time is kept as well. Hotspots come from one
+    extra profiled run.
+    """
+    config = synthetic_config(case["pipelines"], case["stages"], case["width"], case["params"])
+    with tempfile.TemporaryDirectory() as workdir:
+        generate = _generator(case["target"], config, workdir)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        generate_times, serialize_times = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            workflows = generate()
+            generate_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            size = _serialize(workflows)
+            serialize_times.append(time.perf_counter() - start)
+
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        generate_profile, serialize_profile = cProfile.Profile(), cProfile.Profile()
+        workflows = generate_profile.runcall(generate)
+        serialize_profile.runcall(_serialize, workflows)
+
+    return {
+        **case,
+        "workflows": len(workflows),
+        "yaml_bytes": size,
+        "generate_seconds": min(generate_times),
+        "serialize_seconds": min(serialize_times),
+        "generate_samples": generate_times,
+        "serialize_samples": serialize_times,
+        "peak_rss_kb": peak_rss,
+        "rss_growth_kb": peak_rss - rss_before,
+        "generate_hotspots": _hotspots(generate_profile, top),
+        "serialize_hotspots": _hotspots(serialize_profile, top),
+    }
+
+
+def case_key(result: dict) -> str:
+    return f"{result['target']}/p{result['pipelines']}-s{result['stages']}-w{result['width']}-k{result['params']}"
+
+
+def spread(result: dict, phase: str) -> float:
+    """How far the median run of a phase sat above the best one"""
+    samples = result.get(f"{phase}_samples") or [result[f"{phase}_seconds"]]
+    return statistics.median(samples) - min(samples)
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float, min_delta: float = 0.005,
+            noise: float = 3.0) -> list[str]:
+    """
+    Cases whose best generation or serialization time got slower than the
+    baseline's by more than tolerance. Slowdowns within the noise floor do
+    not count: min_delta seconds, or noise times the baseline's spread,
+    whichever is larger.
+    """
+    previous = {case_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(case_key(result))
+        if before is None:
+            continue
+        for phase in PHASES:
+            metric = f"{phase}_seconds"
+            ratio = result[metric] / before[metric] if before[metric] else 1.0
+            floor = max(min_delta, noise * spread(before, phase))
+            if ratio > 1 + tolerance and result[metric] - before[metric] > floor:
+                regressions.append(f"{case_key(result)} {metric}: {before[metric]:.4f}s -> {result[metric]:.4f}s "
+                                   f"({ratio:.2f}x, noise floor {floor:.4f}s)")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the workflow generators on synthetic configs")
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=TARGETS)
+    parser.add_argument("--pipelines", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--stages", type=int, nargs="+", default=[10])
+    parser.add_argument("--width", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--params", type=int, nargs="+", default=[4])
+    parser.add_argument("--repeat", type=int, default=10, help="runs per case, the best one counts")
+    parser.add_argument("--top", type=int, default=10, help="hotspots kept per case")
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="slowdowns below this many seconds are ignored")
+    parser.add_argument("--noise", type=float, default=3.0, help="slowdowns below this many times the baseline's median-to-best spread are ignored")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args()
+
+    cases = [
+        {"target": t, "pipelines": p, "stages": s, "width": w, "params": k}
+        for t, p, s, w, k in itertools.product(args.targets, args.pipelines, args.stages, args.width, args.params)
+    ]
+    results = []
+    # every case in a fresh interpreter so memory peaks and import state don't leak between cases
+    context = multiprocessing.get_context("spawn")
+    for case in cases:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_case, (case, args.repeat, args.top))
+        results.append(result)
+        hottest = result["generate_hotspots"][0]["function"] if result["generate_hotspots"] else "-"
+        print(f"{case_key(result)}: generate {result['generate_seconds']:.4f}s, "
+              f"serialize {result['serialize_seconds']:.4f}s, peak {result['peak_rss_kb'] / 1024:.1f} MiB, "
+              f"hottest {hottest}")
+
+    with open(args.output, "w") as f:
+        json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+    print(f"✅ {len(results)} cases saved to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+        print(f"✅ baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance, args.min_delta, args.noise)
+        for line in regressions:
+            print(f"regression: {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"✅ no slowdown beyond {args.tolerance:.0%} against {args.baseline}")
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import workflow_writer
+from workflow_writer import dump_workflow
+
+CACHE_DIR = "output/.build-cache"
+
+
+def source_digest(*paths):
+    """Digest of the generator sources, so code changes invalidate the cache too"""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def referenced_stages(pipeline):
+    names = set()
+    for step in pipeline["flow"]:
+        if isinstance(step, dict) and step.get("parallel", False):
+            names.update(s["stage"] for s in step["stages"])
+        elif isinstance(step, dict):
+            names.add(step["stage"])
+        else:
+            names.add(step)
+    return names
+
+
+def pipeline_fingerprint(config, pipeline, salt=""):
+    """Hash of everything a single workflow is generated from"""
+    names = referenced_stages(pipeline)
+    payload = {
+        "pipeline": pipeline,
+        "stages": [s for s in config["stages"] if s["name"] in names],
+        "deployment": config.get("Deployment"),
+        "salt": salt,
+    }
+    raw = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def _write(path, text):
+    with open(f"{path}.tmp", "w") as f:
+        f.write(text)
+    os.replace(f"{path}.tmp", path)
+
+
+def iter_cached_documents(config, generate, mode, salt="", cache_dir=CACHE_DIR, stats=None, report=None):
+    """
+    Yield (pipeline name, yaml text) for every pipeline in config. Text is
+    read back from cache_dir/mode when the pipeline's fingerprint is known, and
+    only pipelines whose definition or referenced stages changed go through
+    generate(config) again, with config narrowed to that one pipeline.
+
+    report(workflow) returns a line printed for every pipeline. It is stored
+    next to the cached text, so reused pipelines are reported too. Once all
+    pipelines are through, entries of this mode that were not used are removed.
+    """
+    cache_dir = os.path.join(cache_dir, mode)
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    if stats is None:
+        stats = {}
+    stats.setdefault("reused", 0)
+    stats.setdefault("generated", 0)
+    # the text is dumped here, so the dumper is part of what it comes from
+    salt = f"{mode}:{salt}:{source_digest(__file__, workflow_writer.__file__)}"
+    used = set()
+
+    for pipeline in config["pipelines"]:
+        fingerprint = pipeline_fingerprint(config, pipeline, salt)
+        path = os.path.join(cache_dir, f"{pipeline['name']}-{fingerprint}.yaml")
+        report_path = f"{path[:-len('.yaml')]}.report"
+        used.update({os.path.basename(path), os.path.basename(report_path)})
+
+        if os.path.exists(path) and (report is None or os.path.exists(report_path)):
+            with open(path, "r") as f:
+                text = f.read()
+            if report is not None:
+                with open(report_path, "r") as f:
+                    print(f.read(), end="")
+            stats["reused"] += 1
+        else:
+            [workflow] = generate(dict(config, pipelines=[pipeline]))
+            text = dump_workflow(workflow)
+            _write(path, text)
+            if report is not None:
+                line = f"{report(workflow)}\n"
+                _write(report_path, line)
+                print(line, end="")
+            stats["generated"] += 1
+
+        yield pipeline["name"], text
+
+    for name in os.listdir(cache_dir):
+        if name not in used:
+            os.remove(os.path.join(cache_dir, name))
@@ -0,0 +1,148 @@
+import argparse
+import copy
+import shlex
+from pathlib import Path
+
+import yaml
+
+from workflow_writer import write_workflows
+
+CALL_LOG = "/tmp/calls.jsonl"
+
+# call NAME CMD...: runs one curl call, keeps its response out of the way and
+# reports start time, curl's own total time and exit status as one JSON line
+CALL_FUNCTION = """\
+mkdir -p /tmp/calls
+call() {
+  name=$1; shift
+  start=$(date +%s)
+  took=$("$@" -sS -o /tmp/calls/$name.out -w '%{time_total}')
+  rc=$?
+  echo "{\\"name\\": \\"$name\\", \\"start\\": $start, \\"seconds\\": ${took:-null}, \\"exit\\": $rc}" | tee -a CALL_LOG
+  cat /tmp/calls/$name.out; echo
+  return $rc
+}
+""".replace("CALL_LOG", CALL_LOG)
+
+
+def _call_container(step, templates):
+    """The curl container a step runs, or None if the step does more than one plain call"""
+    if set(step) - {"name", "template"}:
+        return None  # when, arguments, withItems, ... keep their own pod
+    template = templates.get(step["template"])
+    if template is None or set(template) - {"name", "container"}:
+        return None  # retries, inputs/outputs, scripts, nested steps
+    container = template["container"]
+    if not container.get("command") or container["command"][0] != "curl" or container.get("args"):
+        return None
+    return container
+
+
+def _pod_spec(container):
+    # everything but the command has to match for calls to share a pod
+    return {k: v for k, v in container.items() if k != "command"}
+
+
+def _group_script(group, templates):
+    lines = []
+    if len(group) == 1:
+        step = group[0]
+        command = shlex.join(templates[step["template"]]["container"]["command"])
+        lines.append(f"call {step['name']} {command} || exit $?")
+        return lines
+
+    # a parallel group runs its calls concurrently and fails after all of them finished
+    lines.append('pids=""')
+    for step in group:
+        command = shlex.join(templates[step["template"]]["container"]["command"])
+        lines.append(f'call {step["name"]} {command} & pids="$pids $!"')
+    lines.append("failed=0; for pid in $pids; do wait $pid || failed=1; done")
+    lines.append("[ $failed -eq 0 ] || exit 1")
+    return lines
+
+
+def _fused_template(name, chain, templates, spec):
+    source = [CALL_FUNCTION]
+    for group in chain:
+        source.extend(_group_script(group, templates))
+    return {
+        "name": name,
+        "outputs": {"parameters": [{"name": "calls", "valueFrom": {"path": CALL_LOG}}]},
+        "script": {**copy.deepcopy(spec), "command": ["sh"], "source": "\n".join(source) + "\n"},
+    }
+
+
+def coalesce_workflow(workflow, max_groups=None):
+    """
+    Fuse runs of consecutive step groups whose steps are plain curl calls into
+    one script pod each. Sequential calls run in order, a parallel group runs
+    concurrently inside the pod, and the pod stops at the first failed group,
+    as the steps did. At most max_groups step groups go into one pod.
+    Workflows with a DAG entrypoint are returned unchanged.
+    """
+    workflow = copy.deepcopy(workflow)
+    spec = workflow["spec"]
+    templates = {t["name"]: t for t in spec["templates"]}
+    entry = templates[spec["entrypoint"]]
+    if "steps" not in entry:
+        return workflow
+
+    new_steps, chain, chain_spec, fused = [], [], None, []
+
+    def flush():
+        nonlocal chain, chain_spec
+        if not chain:
+            return
+        name = f"{entry['name']}-calls-{len(fused) + 1}"
+        fused.append(_fused_template(name, chain, templates, chain_spec))
+        new_steps.append([{"name": f"calls-{len(fused)}", "template": name}])
+        chain, chain_spec = [], None
+
+    for group in entry["steps"]:
+        containers = [_call_container(step, templates) for step in group]
+        specs = [_pod_spec(c) for c in containers if c is not None]
+        fusable = None not in containers and all(s == specs[0] for s in specs)
+        if not fusable:
+            flush()
+            new_steps.append(group)
+            continue
+        if chain_spec is not None and (specs[0] != chain_spec or len(chain) == max_groups):
+            flush()
+        chain.append(group)
+        chain_spec = specs[0]
+    flush()
+
+    entry["steps"] = new_steps
+    used = {step["template"] for group in new_steps for step in group}
+    spec["templates"] = [
+        t for t in spec["templates"]
+        if t is entry or t["name"] in used or "steps" in t or "dag" in t
+    ] + fused
+    return workflow
+
+
+def pod_count(workflow):
+    """Pods one run of the entrypoint creates, for steps workflows"""
+    templates = {t["name"]: t for t in workflow["spec"]["templates"]}
+    entry = templates[workflow["spec"]["entrypoint"]]
+    if "steps" in entry:
+        return sum(len(group) for group in entry["steps"])
+    return len(entry.get("dag", {}).get("tasks", []))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fuse consecutive service calls of generated workflows into fewer pods")
+    parser.add_argument("workflow_file")
+    parser.add_argument("--output", default=None, help="defaults to <workflow_file>_coalesced.yaml")
+    parser.add_argument("--max-groups", type=int, default=None, help="step groups per pod, all by default")
+    args = parser.parse_args()
+
+    with open(args.workflow_file, "r") as f:
+        workflows = [wf for wf in yaml.safe_load_all(f) if wf]
+    coalesced = [coalesce_workflow(wf, args.max_groups) for wf in workflows]
+
+    output = args.output or str(Path(args.workflow_file).with_name(f"{Path(args.workflow_file).stem}_coalesced.yaml"))
+    write_workflows(coalesced, output)
+    before = sum(pod_count(wf) for wf in workflows)
+    after = sum(pod_count(wf) for wf in coalesced)
+    print(f"✅ {len(coalesced)} workflows, {before} -> {after} pods per run, saved to {output}")
@@ -0,0 +1,243 @@
+import hashlib
+import os
+import re
+
+FILE_PARAM_HINTS = ("file", "csv", "json", "dir", "path")
+# http://data-preprocess.pipeline.svc.cluster.local:8080/run -> data-preprocess
+SERVICE_URL = re.compile(r"https?://([a-z0-9-]+)[.:/]")
+
+# Built-in stage that concatenates the outputs of a sharded call, inserted
+# after the fan-out. CSV shards keep only the first header.
+MERGE_STAGE = {
+    "name": "merge-shards",
+    "parameters": {
+        "inputs": {"type": "list", "role": "input"},
+        "output_file": {"type": "string"},
+    },
+}
+MERGE_IMAGE = "python:3.12-slim"
+MERGE_SCRIPT = """\
+import os, sys
+args = dict(a[2:].split("=", 1) for a in sys.argv[1:])
+os.makedirs(os.path.dirname(args["output_file"]) or ".", exist_ok=True)
+with open(args["output_file"], "wb") as out:
+    for n, path in enumerate(args["inputs"].split(",")):
+        with open(path, "rb") as f:
+            if n and path.endswith(".csv"):
+                f.readline()
+            data = f.read()
+        out.write(data if not data or data.endswith(b"\\n") else data + b"\\n")
+"""
+
+
+def param_role(stage_def, key):
+    """Classify a stage parameter as 'input', 'output' or plain 'value'"""
+    params = stage_def.get("parameters")
+    spec = params.get(key) if isinstance(params, dict) else None
+    if isinstance(spec, dict) and "role" in spec:
+        return spec["role"]
+    if key.startswith("output"):
+        return "output"
+    if any(hint in key for hint in FILE_PARAM_HINTS):
+        return "input"
+    return "value"
+
+
+def produced_names(stage_instance, stage_def):
+    # a merge call stands in for the sharded stage it merges
+    names = {stage_instance["stage"], stage_instance.get("merges", stage_instance["stage"])}
+    for key, value in stage_instance.get("parameters", {}).items():
+        if param_role(stage_def, key) == "output":
+            names.add(str(value))
+    return names
+
+
+def expand_shards(stage_instance, stage_def):
+    """
+    A call of a sharded stage as its shard calls plus the merge call, or just
+    the call. The rows are split as evenly as possible. A shard's seed
+    depends only on its stage, its value parameters and its index. Shard i
+    therefore gets the same parameters in every call with the same rows per
+    shard, whatever the shard count.
+    """
+    spec = stage_def.get("sharding")
+    if not spec or "shard" in stage_instance:
+        return [stage_instance]
+
+    stage_name = stage_instance["stage"]
+    params = stage_instance.get("parameters", {})
+    rows_param = spec.get("rows", "n_rows")
+    seed_param = spec.get("seed", "seed")
+    outputs = [k for k in params if param_role(stage_def, k) == "output"]
+    if len(outputs) != 1:
+        raise ValueError(f"Sharded stage {stage_name} needs exactly one output parameter, has {outputs}")
+    output = outputs[0]
+    rows, count = int(params[rows_param]), int(spec["shards"])
+    seed_basis = sorted(
+        (k, str(v)) for k, v in params.items()
+        if k not in (rows_param, seed_param) and param_role(stage_def, k) == "value"
+    )
+
+    stem, ext = os.path.splitext(str(params[output]))
+    shards = []
+    for i in range(count):
+        seed = int(hashlib.md5(f"{stage_name}:{seed_basis}:{i}".encode()).hexdigest()[:8], 16)
+        shard_params = dict(params)
+        shard_params[rows_param] = rows // count + (i < rows % count)
+        shard_params[seed_param] = seed
+        shard_params[output] = f"{stem}.shard-{i}{ext}"
+        shards.append({"stage": stage_name, "parameters": shard_params, "shard": {"index": i, "count": count}})
+
+    merge = {
+        "stage": MERGE_STAGE["name"],
+        "parameters": {"inputs": [s["parameters"][output] for s in shards], "output_file": params[output]},
+        "merges": stage_name,
+    }
+    return shards + [merge]
+
+
+def fan_out(shard_params):
+    """
+    One withItems call for the (name, value) parameters of a call's shards:
+    the first shard's parameters with those that differ between shards
+    replaced by {{inputs.parameters.<name>}}, the template inputs, and the
+    arguments and items of the step
+    """
+    first = shard_params[0]
+    varying = [i for i, (_, value) in enumerate(first) if any(p[i][1] != value for p in shard_params)]
+    names = [first[i][0] for i in varying]
+    params = [(k, f"{{{{inputs.parameters.{k}}}}}" if i in varying else v) for i, (k, v) in enumerate(first)]
+    inputs = {"parameters": [{"name": k} for k in names]}
+    step = {
+        "arguments": {"parameters": [{"name": k, "value": f"{{{{item.{k}}}}}"} for k in names]},
+        "withItems": [{k: str(p[i][1]) for k, i in zip(names, varying)} for p in shard_params],
+    }
+    return params, inputs, step
+
+
+def merge_call(step_name, template_name, merge, mount_path):
+    """The step and template of a merge call on the volume mounted like the sharded stage's"""
+    step = {
+        "name": step_name,
+        "template": template_name,
+        "arguments": {"parameters": [
+            {"name": "inputs", "value": ",".join(map(str, merge["parameters"]["inputs"]))},
+            {"name": "output_file", "value": str(merge["parameters"]["output_file"])},
+        ]},
+    }
+    template = {
+        "name": template_name,
+        "inputs": {"parameters": [{"name": "inputs"}, {"name": "output_file"}]},
+        "container": {
+            "image": MERGE_IMAGE,
+            "command": ["python", "-c", MERGE_SCRIPT],
+            "args": ["--inputs={{inputs.parameters.inputs}}", "--output_file={{inputs.parameters.output_file}}"],
+            "volumeMounts": [{"name": "shared-data", "mountPath": mount_path}],
+        },
+    }
+    return step, template
+
+
+def _resolve(value, producers):
+    if value in producers:
+        return producers[value]
+    # a directory input depends on whatever was last written below it
+    if value.rstrip("/"):
+        prefix = value.rstrip("/") + "/"
+        matches = [index for name, index in producers.items() if name.startswith(prefix)]
+        if matches:
+            return max(matches)
+    return None
+
+
+def infer_dependencies(step_groups, stages_dict):
+    """
+    Return, for every stage instance in flow order, the indices of the earlier
+    instances it reads from. Instances whose inputs match no earlier output keep
+    a dependency on the whole previous step group, like the steps barrier did.
+    """
+    dependencies = []
+    producers = {}
+    previous_group = []
+    index = 0
+
+    for group in step_groups:
+        current_group = []
+        group_outputs = {}
+        for _, stage_instance in group:
+            stage_def = stages_dict[stage_instance["stage"]]
+            inputs = [
+                str(item) for k, v in stage_instance.get("parameters", {}).items()
+                if param_role(stage_def, k) == "input"
+                for item in (v if isinstance(v, list) else [v])
+            ]
+            resolved = {_resolve(v, producers) for v in inputs} - {None}
+            upstream = sorted(resolved)
+            if inputs and not upstream:
+                upstream = list(previous_group)
+
+            dependencies.append(upstream)
+            current_group.append(index)
+            for name in produced_names(stage_instance, stage_def):
+                group_outputs[name] = index
+            index += 1
+
+        producers.update(group_outputs)
+        previous_group = current_group
+
+    return dependencies
+
+
+def critical_path(tasks):
+    """Longest dependency chain of a DAG task list given in topological order"""
+    longest = {}
+    for task in tasks:
+        best = max((longest[d] for d in task.get("dependencies", [])), key=len, default=[])
+        longest[task["name"]] = best + [task["name"]]
+    return max(longest.values(), key=len, default=[])
+
+
+def build_dag_template(name, step_groups, stages_dict):
+    """Turn grouped steps into a DAG template with the tightest dependencies"""
+    entries = [entry for group in step_groups for entry, _ in group]
+    tasks = {}  # the shards of one call share their withItems entry, and so their task
+    for entry, upstream in zip(entries, infer_dependencies(step_groups, stages_dict)):
+        task = tasks.setdefault(id(entry), dict(entry))
+        names = {entries[i]["name"] for i in upstream} - {task["name"]}
+        if names:
+            task["dependencies"] = sorted(names.union(task.get("dependencies", [])))
+    return {"name": name, "dag": {"tasks": list(tasks.values())}}
+
+
+def annotate_critical_path(workflow, dag_template):
+    path = critical_path(dag_template["dag"]["tasks"])
+    annotations = workflow["metadata"].setdefault("annotations", {})
+    annotations["pipeline/critical-path"] = " -> ".join(path)
+    annotations["pipeline/critical-path-length"] = str(len(path))
+    return path
+
+
+def critical_path_report(workflow):
+    annotations = workflow["metadata"]["annotations"]
+    return (f"{workflow['metadata']['generateName'].rstrip('-')}: critical path "
+            f"{annotations['pipeline/critical-path-length']} stages "
+            f"({annotations['pipeline/critical-path']})")
+
+
+def report_critical_paths(workflows):
+    for wf in workflows:
+        print(critical_path_report(wf))
+        yield wf
+
+
+def called_service(template):
+    """
+    The service a generated template calls: the host of the URL its curl
+    command posts to, else of the first call in its script
+    """
+    for field in (template.get("container") or {}).get("command") or []:
+        match = SERVICE_URL.match(str(field))
+        if match:
+            return match.group(1)
+    match = SERVICE_URL.search((template.get("script") or {}).get("source") or "")
+    return match.group(1) if match else None
@@ -0,0 +1,289 @@
+import argparse
+import csv
+import hashlib
+import importlib
+import json
+import logging
+import os
+import random
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import yaml
+
+from dag_utils import infer_dependencies, param_role
+
+logger = logging.getLogger("experiment.local_backend")
+
+DONE_MARKER = ".done"  # same marker stage_cache.py looks for on the PVC
+INPUT_MOUNT = "/app/data/input"
+TIMING_FIELDS = ["user", "pipeline", "call", "stage", "key", "status", "ready", "started", "finished", "seconds", "pid"]
+
+
+@dataclass
+class Call:
+    user: int
+    pipeline: str
+    index: int
+    stage: str
+    params: dict
+    deps: list[int]
+    key: str = ""
+    directory: str = ""
+    status: str = "pending"
+    ready: float = 0.0
+    started: float = 0.0
+    finished: float = 0.0
+    pid: int = 0
+    dependents: list[int] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        return f"{self.index}-{self.stage}"
+
+
+def load_config(config_path: str) -> dict:
+    with open(config_path, "r") as f:
+        return yaml.safe_load(f)
+
+
+def step_groups(pipeline: dict) -> list[list[tuple[None, dict]]]:
+    """The flow as the (entry, stage instance) groups dag_utils expects"""
+    groups = []
+    for block in pipeline["flow"]:
+        stages = block["stages"] if block.get("parallel") else [block]
+        groups.append([(None, stage) for stage in stages])
+    return groups
+
+
+def plan_calls(config: dict, users: int, reuse_users: int, mode: str, root: str,
+               n_rows: Optional[int] = None, seed: int = 0) -> list[Call]:
+    """
+    Every stage call of every user, users cycling through the pipelines like
+    loadgen does. With reuse a call's output directory is its lineage hash under
+    root/cache, so users asking for the same thing share it; the users outside
+    reuse_users salt the hash with their id and share nothing. Without reuse
+    every call gets its own directory.
+    """
+    stages_dict = {s["name"]: s for s in config["stages"]}
+    pipelines = config["pipelines"]
+    overlapping = set(random.Random(seed).sample(range(users), min(reuse_users, users)))
+
+    calls = []
+    for user in range(users):
+        pipeline = pipelines[user % len(pipelines)]
+        groups = step_groups(pipeline)
+        instances = [instance for group in groups for _, instance in group]
+        offset = len(calls)
+        for index, (instance, deps) in enumerate(zip(instances, infer_dependencies(groups, stages_dict))):
+            params = dict(instance.get("parameters", {}))
+            if n_rows is not None and "n_rows" in params:
+                params["n_rows"] = n_rows
+            call = Call(user, pipeline["name"], index, instance["stage"], params, [offset + d for d in deps])
+            if mode == "reuse":
+                lineage = {
+                    "stage": call.stage,
+                    "params": sorted((k, str(v)) for k, v in params.items()),
+                    "upstream": [calls[d].key for d in call.deps],
+                    "user": None if user in overlapping else user,
+                }
+                call.key = hashlib.sha256(json.dumps(lineage).encode()).hexdigest()[:16]
+                call.directory = os.path.join(root, "cache", call.key)
+            else:
+                call.key = f"user-{user}/{pipeline['name']}/{call.name}"
+                call.directory = os.path.join(root, "no-reuse", call.key)
+            for d in call.deps:
+                calls[d].dependents.append(len(calls))
+            calls.append(call)
+    return calls
+
+
+def resolve_params(call: Call, calls: list[Call], stages_dict: dict, input_root: str) -> dict:
+    """
+    Map the call's file parameters to local paths: outputs into its own
+    directory, inputs to whatever its upstream calls wrote under that name, the
+    input mount to input_root.
+    """
+    stage_def = stages_dict[call.stage]
+    resolved = {}
+    for key, value in call.params.items():
+        role = param_role(stage_def, key)
+        value = str(value) if role != "value" else value
+        if role == "output":
+            resolved[key] = os.path.join(call.directory, value)
+        elif role == "input":
+            resolved[key] = _find_input(value, _upstream(call, calls), input_root)
+        else:
+            resolved[key] = value
+    return resolved
+
+
+def _upstream(call: Call, calls: list[Call]) -> list[Call]:
+    # transitive, since a dependency inferred from the step barrier may only
+    # reach the call that wrote the file through a stage in between
+    seen, order, frontier = set(), [], list(call.deps)
+    while frontier:
+        d = frontier.pop(0)
+        if d not in seen:
+            seen.add(d)
+            order.append(calls[d])
+            frontier.extend(calls[d].deps)
+    return order
+
+
+def _find_input(value: str, upstream: list[Call], input_root: str) -> str:
+    if value == INPUT_MOUNT or value.startswith(INPUT_MOUNT + "/"):
+        return os.path.join(input_root, value[len(INPUT_MOUNT):].lstrip("/"))
+    if os.path.isabs(value):
+        return value
+    # the nearest upstream call that has it wins, like the shared directory on the PVC
+    for dep in upstream:
+        if dep.stage == value:
+            return dep.directory
+        path = os.path.join(dep.directory, value)
+        if os.path.exists(path):
+            return path
+    for dep in upstream:
+        for parent, _, names in os.walk(dep.directory):
+            if os.path.basename(value) in names:
+                return os.path.join(parent, os.path.basename(value))
+    return os.path.join(input_root, value)
+
+
+def run_stage(module: str, stage: str, params: dict, directory: str) -> tuple[float, float, int]:
+    """Worker side of one call; returns start and end time and the worker's pid"""
+    started = time.time()
+    implementation = importlib.import_module(module).STAGES[stage]
+    os.makedirs(directory, exist_ok=True)
+    implementation(params)
+    Path(directory, DONE_MARKER).touch()
+    return started, time.time(), os.getpid()
+
+
+def execute(calls: list[Call], config: dict, module: str, input_root: str, workers: int, mode: str) -> float:
+    """
+    Run the calls on a process pool as soon as their dependencies are done.
+    With reuse a call whose output is already materialized is not run again and
+    identical calls in flight are run once. Failed calls skip their dependents.
+    Returns the makespan in seconds.
+    """
+    stages_dict = {s["name"]: s for s in config["stages"]}
+    remaining = [len(c.deps) for c in calls]
+    running, in_flight = {}, {}
+    start = time.time()
+
+    def finish(i, status, started=None, finished=None, pid=0):
+        call = calls[i]
+        call.status, call.pid = status, pid
+        call.started = (started or time.time()) - start
+        call.finished = (finished or time.time()) - start
+        for j in call.dependents:
+            remaining[j] -= 1
+            if status in ("failed", "skipped"):
+                calls[j].status = "skipped"
+            if remaining[j] == 0:
+                dispatch(j)
+
+    def dispatch(i):
+        call = calls[i]
+        call.ready = time.time() - start
+        if call.status == "skipped":
+            finish(i, "skipped")
+        elif mode == "reuse" and os.path.exists(os.path.join(call.directory, DONE_MARKER)):
+            finish(i, "cached")
+        elif mode == "reuse" and call.key in in_flight:
+            in_flight[call.key].append(i)
+        else:
+            if os.path.isdir(call.directory):
+                shutil.rmtree(call.directory)  # leftovers of an interrupted run
+            params = resolve_params(call, calls, stages_dict, input_root)
+            future = pool.submit(run_stage, module, call.stage, params, call.directory)
+            running[future] = i
+            in_flight[call.key] = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for i, call in enumerate(calls):
+            if not call.deps:
+                dispatch(i)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                waiters = in_flight.pop(calls[i].key, [])
+                try:
+                    started, finished, pid = future.result()
+                except Exception as e:
+                    logger.warning(f"{calls[i].key}: {calls[i].stage} failed: {e!r}")
+                    finish(i, "failed")
+                    for w in waiters:
+                        finish(w, "failed")
+                    continue
+                finish(i, "computed", started, finished, pid)
+                for w in waiters:
+                    finish(w, "coalesced", started, finished, pid)
+    return time.time() - start
+
+
+def save_timings(calls: list[Call], output_path: str) -> None:
+    with open(output_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=TIMING_FIELDS)
+        writer.writeheader()
+        for c in calls:
+            writer.writerow({
+                "user": c.user, "pipeline": c.pipeline, "call": c.name, "stage": c.stage, "key": c.key,
+                "status": c.status, "ready": round(c.ready, 4), "started": round(c.started, 4),
+                "finished": round(c.finished, 4), "seconds": round(c.finished - c.started, 4), "pid": c.pid,
+            })
+
+
+def stage_summary(calls: list[Call]) -> dict[str, dict]:
+    summary = {}
+    for c in calls:
+        s = summary.setdefault(c.stage, {"calls": 0, "computed": 0, "seconds": 0.0})
+        s["calls"] += 1
+        if c.status == "computed":
+            s["computed"] += 1
+            s["seconds"] += c.finished - c.started
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Run the configured pipelines locally on a process pool")
+    parser.add_argument("--config", default="auto-argo-generator/config.yaml")
+    parser.add_argument("--mode", choices=["reuse", "no-reuse"], default="reuse")
+    parser.add_argument("--users", type=int, default=1)
+    parser.add_argument("--reuse-users", type=int, default=None, help="users sharing data paths, all by default")
+    parser.add_argument("--n-rows", type=int, default=None, help="override n_rows of every stage")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--stages", default="local_stages", help="module with a STAGES dict of stage implementations")
+    parser.add_argument("--root", default="local-pvc", help="local directory standing in for the PVC")
+    parser.add_argument("--input-root", default="dataset", help="local directory standing in for " + INPUT_MOUNT)
+    parser.add_argument("--fresh", action="store_true", help="start from an empty root instead of a warm cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="timings CSV, defaults to <root>/timings-<mode>.csv")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    missing = {s["name"] for s in config["stages"]} - set(importlib.import_module(args.stages).STAGES)
+    if missing:
+        logger.warning(f"{args.stages} has no implementation for {sorted(missing)}, their calls will fail")
+    if args.fresh and os.path.isdir(args.root):
+        shutil.rmtree(args.root)
+    os.makedirs(args.root, exist_ok=True)
+
+    reuse_users = args.users if args.reuse_users is None else args.reuse_users
+    calls = plan_calls(config, args.users, reuse_users, args.mode, args.root, args.n_rows, args.seed)
+    makespan = execute(calls, config, args.stages, args.input_root, args.workers, args.mode)
+
+    output = args.output or os.path.join(args.root, f"timings-{args.mode}.csv")
+    save_timings(calls, output)
+    for stage, s in stage_summary(calls).items():
+        mean = s["seconds"] / s["computed"] if s["computed"] else 0.0
+        logger.info(f"{stage}: {s['calls']} calls, {s['computed']} computed, {mean:.3f}s mean")
+    counts = {status: sum(c.status == status for c in calls) for status in ("computed", "cached", "coalesced", "failed", "skipped")}
+    print(f"✅ {len(calls)} calls in {makespan:.2f}s ({', '.join(f'{n} {s}' for s, n in counts.items() if n)}), timings saved to {output}")
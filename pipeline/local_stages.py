@@ -0,0 +1,161 @@
+import csv
+import hashlib
+import json
+import os
+import random
+import shutil
+from collections import Counter
+from datetime import date, timedelta
+
+# Stand-ins for the sepidmas/reuse_scale-* services, for local_backend.py. Each
+# stage takes the call's parameters with file parameters already resolved to
+# local paths and writes its outputs there. The work grows with n_rows like the
+# real services do, and every stage is deterministic in its parameters.
+# Another module with the same STAGES mapping can be passed with --stages.
+
+FIRST_NAMES = {"M": ["Jaan", "Mati", "Peeter", "Andres", "Toomas", "Martin"], "F": ["Mari", "Kadri", "Liis", "Anna", "Kati", "Eva"]}
+LAST_NAMES = ["Saar", "Mets", "Tamm", "Kask", "Sepp", "Rebane", "Ilves", "Kukk"]
+STREETS = ["Narva mnt", "Tartu mnt", "Pärnu mnt", "Tehnika", "Kalevi", "Raua"]
+
+
+def _rng(params: dict) -> random.Random:
+    raw = json.dumps(sorted((k, str(v)) for k, v in params.items() if not k.startswith("output")))
+    return random.Random(hashlib.sha256(raw.encode()).hexdigest())
+
+
+def _read(path: str) -> list[dict]:
+    with open(path, "r", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def _write(path: str, rows: list[dict], columns: list[str]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _write_json(path: str, value) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(value, f, indent=2)
+
+
+def generate_name(params: dict) -> None:
+    rng = _rng(params)
+    rows = []
+    for _ in range(int(params["n_rows"])):
+        gender = "M" if rng.random() < float(params.get("mf_ratio", 0.5)) else "F"
+        rows.append({"first_name": rng.choice(FIRST_NAMES[gender]), "last_name": rng.choice(LAST_NAMES), "gender": gender})
+    _write(params["output_file"], rows, ["first_name", "last_name", "gender"])
+
+
+def generate_birthday(params: dict) -> None:
+    rng = _rng(params)
+    today = date(2026, 1, 1)
+    rows = []
+    for _ in range(int(params["n_rows"])):
+        age_days = rng.randint(int(params["min_age"]) * 365, int(params["max_age"]) * 365)
+        rows.append({"date_of_birth": (today - timedelta(days=age_days)).isoformat()})
+    _write(params["output_file"], rows, ["date_of_birth"])
+
+
+def generate_address(params: dict) -> None:
+    rng = _rng(params)
+    rows = [
+        {"address": f"{rng.choice(STREETS)} {rng.randint(1, 200)}, Tallinn"}
+        for _ in range(int(params["n_rows"]))
+    ]
+    _write(params["output_file"], rows, ["address"])
+
+
+def generate_id(params: dict) -> None:
+    rng = _rng(params)
+    rows = []
+    for person, birthday in zip(_read(params["name_csv"]), _read(params["birthday_csv"])):
+        born = date.fromisoformat(birthday["date_of_birth"])
+        century = 3 if born.year < 2000 else 5
+        prefix = century + (person["gender"] == "F")
+        code = f"{prefix}{born:%y%m%d}{rng.randint(0, 9999):04d}"
+        rows.append({**person, "date_of_birth": birthday["date_of_birth"], "id_code": code})
+    _write(params["output_file"], rows, ["first_name", "last_name", "gender", "date_of_birth", "id_code"])
+
+
+def data_preprocess(params: dict) -> None:
+    rows = _read(params["input_file"])
+    columns = list(rows[0]) if rows else []
+    if params.get("handle_missing") == "drop":
+        rows = [r for r in rows if all(r.values())]
+    else:
+        for column in columns:
+            present = Counter(r[column] for r in rows if r[column])
+            fill = present.most_common(1)[0][0] if present else ""
+            for r in rows:
+                r[column] = r[column] or fill
+    _write(params["output_file"], rows, columns)
+    _write_json(params["metadata_file"], {"input_csv": params["output_file"], "columns": columns, "num_samples": len(rows)})
+
+
+def load_data(params: dict) -> None:
+    # the evaluation pipelines read real-data.csv / synthetic-data.csv / meta-data.json
+    shutil.copytree(params["input_dir"], params["output_dir"], dirs_exist_ok=True)
+    found = {name: os.path.join(root, name) for root, _, names in os.walk(params["output_dir"]) for name in names}
+    aliases = {
+        "real-data.csv": ["real-data.csv", "clean_data.csv", "clear_data.csv"],
+        "synthetic-data.csv": ["synthetic-data.csv", "synthetic_data.csv"],
+        "meta-data.json": ["meta-data.json", "meta_data.json"],
+    }
+    for alias, candidates in aliases.items():
+        source = next((found[c] for c in candidates if c in found), None)
+        target = os.path.join(params["output_dir"], alias)
+        if source and not os.path.exists(target):
+            shutil.copyfile(source, target)
+
+
+def synthetic_generator(params: dict) -> None:
+    rng = _rng(params)
+    rows = _read(params["input_csv"])
+    columns = list(rows[0]) if rows else []
+    # every column is sampled on its own, which keeps the marginals and breaks the links
+    values = {c: [r[c] for r in rows] for c in columns}
+    synthetic = [{c: rng.choice(values[c]) for c in columns} for _ in range(int(params["n_rows"]))] if rows else []
+    _write(params["output_file"], synthetic, columns)
+
+
+def privacy_tracking(params: dict) -> None:
+    real = {tuple(r.values()) for r in _read(params["real_csv"])}
+    synthetic = [tuple(r.values()) for r in _read(params["synth_csv"])]
+    copied = sum(row in real for row in synthetic)
+    _write_json(params["output_file"], {
+        "synthetic_rows": len(synthetic),
+        "copied_rows": copied,
+        "copy_rate": copied / len(synthetic) if synthetic else 0.0,
+    })
+
+
+def data_quality(params: dict) -> None:
+    real, synthetic = _read(params["input_file_real"]), _read(params["input_file_synth"])
+    report = {}
+    for column in (real[0] if real else {}):
+        real_values = {r[column] for r in real}
+        synthetic_values = {r.get(column) for r in synthetic}
+        report[column] = {
+            "coverage": len(real_values & synthetic_values) / len(real_values) if real_values else 0.0,
+            "distinct_real": len(real_values),
+            "distinct_synthetic": len(synthetic_values),
+        }
+    _write_json(os.path.join(params["output_dir"], "quality_report.json"), {"metrics": params.get("metrics"), "columns": report})
+
+
+STAGES = {
+    "generate-name": generate_name,
+    "generate-birthday": generate_birthday,
+    "generate-address": generate_address,
+    "generate-id": generate_id,
+    "data-preprocess": data_preprocess,
+    "load-data": load_data,
+    "synthetic-generator": synthetic_generator,
+    "privacy-tracking": privacy_tracking,
+    "data-quality": data_quality,
+}
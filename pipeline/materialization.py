@@ -0,0 +1,427 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+import urllib.error
+import urllib.request
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+# `costs` and `manifest` run locally next to the generators; `gc` runs inside
+# the pvc-cleaner Job on a plain python image, so it only uses the stdlib
+LEDGER = ".materialization.json"  # kept at the PVC root
+COSTS_PATH = "output/materialization-costs.json"
+MANIFEST_PATH = "output/cleaner.yaml"
+PROFILES_PATH = "../stage-profiles.json"
+WORKFLOW_FILES = ["output/pipeline_reuse.yaml"]
+CACHE_INDEX_PATH = "auto-argo-generator/stage-cache.json"  # written by write_workflows.py
+# generate_unique_path(): /mnt/data/{pipeline}_{stage}_{input|output}_{uid}
+PATH_PATTERN = re.compile(r"^(?P<pipeline>[^_/]+)_(?P<stage>[^_/]+)_(?P<kind>input|output)_(?P<uid>[0-9a-f]{8})$")
+# stage_cache.py: cache/<lineage hash>/, complete once it holds DONE_MARKER
+CACHE_DIR = "cache"
+CACHE_ENTRY = re.compile(r"^[0-9a-f]{8}$")
+DONE_MARKER = ".done"
+DEFAULT_COST = 1.0  # seconds, for stages no run measured
+HALF_LIFE = 24 * 3600.0
+MOUNT_PATH = "/mnt/data"  # where workflow pods mount the PVC
+# admin endpoint of service_proxy.py, whose cached responses may point at evicted outputs
+PROXY_FLUSH_URL = "http://transformation-proxy:9100/flush"
+SIZE_UNITS = {"": 1, "k": 10 ** 3, "m": 10 ** 6, "g": 10 ** 9, "t": 10 ** 12,
+              "ki": 2 ** 10, "mi": 2 ** 20, "gi": 2 ** 30, "ti": 2 ** 40}
+
+
+def parse_size(value: str) -> int:
+    """Bytes in a Kubernetes quantity such as 20Gi or 500M"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kKmMgGtT]i?)?\s*", str(value))
+    if not match:
+        raise ValueError(f"Not a storage size: {value!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[(match.group(2) or "").lower()])
+
+
+@dataclass
+class Intermediate:
+    path: str  # relative to the PVC root
+    pipeline: str
+    stage: str
+    kind: str
+    size: int
+    last_access: float
+    cost: float  # seconds to recompute
+    consumers: int  # downstream steps that read it
+
+    def priority(self, now: float, half_life: float = HALF_LIFE) -> float:
+        """
+        Recompute seconds saved per byte kept, weighted by how many steps read
+        it and decayed with time since last access. Lowest is evicted first.
+        """
+        if self.size <= 0:
+            return float("inf")
+        age = max(now - self.last_access, 0.0)
+        return self.cost * (1 + self.consumers) / self.size * 0.5 ** (age / half_life)
+
+
+def workflow_outputs(workflows: list[dict]) -> dict:
+    """
+    Output directories of the curl calls in submitted workflow files, such as
+    /mnt/data/argo-shard/<pipeline>-<stage>/, with the stage that writes each
+    and how many other calls of the workflow read from it
+    """
+    from dag_utils import called_service
+
+    outputs = {}
+    for wf in workflows:
+        calls = []
+        for template in wf["spec"]["templates"]:
+            command = (template.get("container") or {}).get("command") or []
+            if command[:1] != ["curl"]:
+                continue
+            fields = [c.split("=", 1) for c in command if "=" in c and not c.startswith("http")]
+            calls.append((called_service(template), fields))
+
+        for i, (stage, fields) in enumerate(calls):
+            for key, value in fields:
+                if not key.startswith("output"):
+                    continue
+                directory = value.rstrip("/") if key.endswith("dir") else os.path.dirname(value)
+                name = os.path.basename(directory)
+                consumers = sum(
+                    any(f"{name}/" in v or v.rstrip("/") == directory for k, v in other if not k.startswith("output"))
+                    for j, (_, other) in enumerate(calls) if j != i
+                )
+                outputs[name] = {"stage": stage, "consumers": consumers}
+    return outputs
+
+
+def cache_entries(index: dict) -> dict:
+    """Stage and number of downstream calls of every entry of a stage cache index"""
+    consumers = {}
+    for entry in index.values():
+        for upstream in entry.get("upstream", []):
+            consumers[upstream] = consumers.get(upstream, 0) + 1
+    return {h: {"stage": entry["stage"], "consumers": consumers.get(h, 0)} for h, entry in index.items()}
+
+
+def stage_costs(config: dict, profiles_path: Optional[str], workflows: list[dict] = (), cache_index: dict = None) -> dict:
+    """
+    Recompute cost per stage and consumer count per output directory of the
+    generated pipelines and per stage cache entry
+    """
+    from dag_utils import infer_dependencies
+    from parser_reuse import generate_unique_path
+
+    stage_seconds = {}
+    if profiles_path and os.path.exists(profiles_path):
+        with open(profiles_path, "r") as f:
+            profiles = json.load(f)
+        # fitted durations are in simulator time, the reuse scale maps them to measured seconds
+        scales = list((profiles.get("time_scale") or {}).get("reuse", {}).values())
+        scale = sorted(scales)[len(scales) // 2] if scales else 1.0
+        stage_seconds = {name: p["duration"] * scale for name, p in profiles["stages"].items()}
+
+    stages_dict = {s["name"]: s for s in config["stages"]}
+    outputs = {}
+    for pipeline in config["pipelines"]:
+        step_groups = []
+        for step in pipeline["flow"]:
+            group = step["stages"] if isinstance(step, dict) and step.get("parallel") else [step]
+            step_groups.append([(None, s if isinstance(s, dict) else {"stage": s}) for s in group])
+        instances = [instance for group in step_groups for _, instance in group]
+
+        consumers = [0] * len(instances)
+        for upstream in infer_dependencies(step_groups, stages_dict):
+            for i in upstream:
+                consumers[i] += 1
+        for instance, count in zip(instances, consumers):
+            step_name = instance.get("template-name", instance["stage"])
+            path = generate_unique_path(instance["stage"], pipeline["name"], "output", step_name)
+            outputs[os.path.basename(path)] = {"stage": instance["stage"], "consumers": count}
+    outputs.update(workflow_outputs(workflows))
+
+    return {
+        "stages": {name: stage_seconds.get(name, DEFAULT_COST) for name in stages_dict},
+        "outputs": outputs,
+        "cache": cache_entries(cache_index or {}),
+    }
+
+
+def _tree_stats(path: str) -> tuple[int, float]:
+    size, last = 0, os.stat(path).st_mtime
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue  # written to concurrently
+            size += stat.st_size
+            last = max(last, stat.st_mtime, stat.st_atime)
+    return size, last
+
+
+def scan(root: str, costs: dict) -> list[Intermediate]:
+    """Every intermediate directory below root, including per-user copies and stage cache entries"""
+    found = []
+    for parent, dirs, _ in os.walk(root):
+        for name in list(dirs):
+            if os.path.basename(parent) == CACHE_DIR and CACHE_ENTRY.match(name):
+                dirs.remove(name)
+                path = os.path.join(parent, name)
+                size, last_access = _tree_stats(path)
+                cached = costs.get("cache", {}).get(name, {})
+                stage = cached.get("stage", CACHE_DIR)
+                found.append(Intermediate(
+                    path=os.path.relpath(path, root),
+                    pipeline=CACHE_DIR,
+                    stage=stage,
+                    kind="output",
+                    size=size,
+                    last_access=last_access,
+                    cost=costs["stages"].get(stage, DEFAULT_COST),
+                    consumers=cached.get("consumers", 0),
+                ))
+                continue
+            match = PATH_PATTERN.match(name)
+            known = costs["outputs"].get(name)
+            if not match and not known:
+                continue
+            dirs.remove(name)  # an intermediate is collected as a whole
+            path = os.path.join(parent, name)
+            size, last_access = _tree_stats(path)
+            output = known is not None or match["kind"] == "output"
+            stage = known["stage"] if known else match["stage"]
+            found.append(Intermediate(
+                path=os.path.relpath(path, root),
+                pipeline=match["pipeline"] if match else name[:-len(stage)].rstrip("-"),
+                stage=stage,
+                kind="output" if output else "input",
+                size=size,
+                last_access=last_access,
+                # staged inputs are copies, recreating them costs nothing
+                cost=costs["stages"].get(stage, DEFAULT_COST) if output else 0.0,
+                consumers=known["consumers"] if known else 0,
+            ))
+    return found
+
+
+def plan_eviction(items: list[Intermediate], budget: int, now: float, half_life: float = HALF_LIFE) -> tuple[list, list]:
+    """Keep the highest priority intermediates that fit in budget bytes, evict the rest"""
+    ranked = sorted(items, key=lambda item: item.priority(now, half_life), reverse=True)
+    keep, evict, used = [], [], 0
+    for item in ranked:
+        if used + item.size <= budget:
+            keep.append(item)
+            used += item.size
+        else:
+            evict.append(item)
+    return keep, evict
+
+
+def _load_ledger(root: str) -> dict:
+    path = os.path.join(root, LEDGER)
+    if not os.path.exists(path):
+        return {"entries": {}, "evicted": []}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _save_ledger(root: str, ledger: dict) -> None:
+    path = os.path.join(root, LEDGER)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(ledger, f, indent=4)
+    os.replace(f"{path}.tmp", path)
+
+
+def _evict(path: str) -> None:
+    # the marker goes first, so a half deleted cache entry never counts as done
+    marker = os.path.join(path, DONE_MARKER)
+    if os.path.exists(marker):
+        os.remove(marker)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def wipe(root: str) -> None:
+    """Everything below root, ledger included, like the cleaner before the GC"""
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            _evict(path)
+        else:
+            os.remove(path)
+
+
+def collect(root: str, costs: dict, budget: int, half_life: float = HALF_LIFE, dry_run: bool = False) -> dict:
+    """
+    One GC pass; returns byte and entry counts for the log. A budget of 0
+    wipes the whole PVC, not only the intermediates the scan recognizes.
+    Evicted cache entries count as materialized in the generators' index
+    until stage_cache.py refreshes it from the PVC.
+    """
+    now = time.time()
+    ledger = _load_ledger(root)
+    items = scan(root, costs)
+    for item in items:
+        entry = ledger["entries"].setdefault(item.path, {"first_seen": now})
+        # keep the latest access any pass saw, a noatime mount only moves mtime
+        item.last_access = max(item.last_access, entry.get("last_access", 0.0))
+        entry.update(asdict(item))
+
+    keep, evict = plan_eviction(items, budget, now, half_life)
+    if budget <= 0 and not dry_run:
+        wipe(root)
+        ledger["entries"] = {}
+    for item in evict:
+        if not dry_run:
+            _evict(os.path.join(root, item.path))
+            ledger["entries"].pop(item.path, None)
+            ledger["evicted"].append({"path": item.path, "size": item.size, "cost": item.cost, "at": now})
+    ledger["evicted"] = ledger["evicted"][-1000:]
+
+    seen = {item.path for item in items}
+    for path in [p for p in ledger["entries"] if p not in seen]:
+        del ledger["entries"][path]  # removed by someone else
+    if not dry_run:
+        _save_ledger(root, ledger)
+
+    return {
+        "intermediates": len(items),
+        "kept": len(keep),
+        "evicted": len(evict),
+        "bytes_kept": sum(item.size for item in keep),
+        "bytes_evicted": sum(item.size for item in evict),
+        "seconds_evicted": sum(item.cost for item in evict),
+        "evicted_paths": [item.path for item in evict],
+        "wiped": budget <= 0,
+    }
+
+
+def flush_proxy(url: str, paths: Optional[list[str]], mount_path: str = MOUNT_PATH, timeout: float = 10.0) -> Optional[int]:
+    """
+    Make the caching proxy forget the calls that used evicted paths, or every
+    call for None; None when it cannot be reached
+    """
+    body = json.dumps({} if paths is None else {"paths": [f"{mount_path.rstrip('/')}/{p}" for p in paths]}).encode()
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.load(response)["flushed"]
+    except (urllib.error.URLError, OSError, ValueError, KeyError) as e:
+        print(f"Could not flush the proxy cache at {url}: {e}")
+        return None
+
+
+def gc_manifest(costs: dict, budget: str, namespace: str = "pipeline", pvc_name: str = "argo-shard-pvc",
+                flush_url: Optional[str] = PROXY_FLUSH_URL) -> list[dict]:
+    """ConfigMap with this script and the costs, and the Job that runs one GC pass on the PVC"""
+    with open(__file__, "r") as f:
+        script = f.read()
+    config_map = {
+        "apiVersion": "v1",
+        "kind": "ConfigMap",
+        "metadata": {"name": "pvc-cleaner", "namespace": namespace},
+        "data": {"materialization.py": script, "costs.json": json.dumps(costs, indent=2, sort_keys=True)},
+    }
+    job = {
+        "apiVersion": "batch/v1",
+        "kind": "Job",
+        "metadata": {"name": "pvc-cleaner", "namespace": namespace},
+        "spec": {
+            "backoffLimit": 0,
+            "ttlSecondsAfterFinished": 600,
+            "template": {
+                "spec": {
+                    "restartPolicy": "Never",
+                    "containers": [{
+                        "name": "cleaner",
+                        "image": "python:3.12-slim",
+                        "command": [
+                            "python", "/gc/materialization.py", "gc", "/data",
+                            "--costs", "/gc/costs.json", "--budget", budget,
+                            *(["--flush", flush_url] if flush_url else []),
+                        ],
+                        "volumeMounts": [
+                            {"mountPath": "/data", "name": "pvc-volume"},
+                            {"mountPath": "/gc", "name": "gc"},
+                        ],
+                    }],
+                    "volumes": [
+                        {"name": "pvc-volume", "persistentVolumeClaim": {"claimName": pvc_name}},
+                        {"name": "gc", "configMap": {"name": "pvc-cleaner"}},
+                    ],
+                }
+            },
+        },
+    }
+    return [config_map, job]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep reusable intermediates on the PVC within a storage budget")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    costs_parser = commands.add_parser("costs", help="recompute costs and consumers of the generated pipelines")
+    costs_parser.add_argument("--config", default="./test-config-file/config.yaml")
+    costs_parser.add_argument("--profiles", default=PROFILES_PATH, help="stage profiles fitted by simulator.py --fit")
+    costs_parser.add_argument("--workflows", nargs="*", default=WORKFLOW_FILES, help="submitted workflow files whose output directories to keep track of")
+    costs_parser.add_argument("--cache-index", default=CACHE_INDEX_PATH, help="stage cache index whose entries to keep track of")
+    costs_parser.add_argument("--output", default=COSTS_PATH)
+
+    manifest_parser = commands.add_parser("manifest", help="write the GC Job that replaces the blanket wipe")
+    manifest_parser.add_argument("--costs", default=COSTS_PATH)
+    manifest_parser.add_argument("--budget", default="15Gi")
+    manifest_parser.add_argument("--namespace", default="pipeline")
+    manifest_parser.add_argument("--flush", default=PROXY_FLUSH_URL, help="proxy /flush URL the job calls after evicting, empty to skip")
+    manifest_parser.add_argument("--output", default=MANIFEST_PATH)
+
+    gc_parser = commands.add_parser("gc", help="one collection pass over a mounted PVC")
+    gc_parser.add_argument("root")
+    gc_parser.add_argument("--costs", default=COSTS_PATH)
+    gc_parser.add_argument("--budget", required=True, help="e.g. 15Gi; 0 wipes the whole PVC")
+    gc_parser.add_argument("--half-life", type=float, default=HALF_LIFE, help="seconds after which an untouched output counts half")
+    gc_parser.add_argument("--dry-run", action="store_true")
+    gc_parser.add_argument("--flush", default=None, help="proxy /flush URL to send the evicted paths to")
+    gc_parser.add_argument("--mount-path", default=MOUNT_PATH, help="where workflow pods mount the PVC")
+    args = parser.parse_args()
+
+    if args.command == "costs":
+        import yaml
+        from parser_reuse import load_config
+
+        workflows = []
+        for path in args.workflows:
+            with open(path, "r") as f:
+                workflows += [wf for wf in yaml.safe_load_all(f) if wf]
+        cache_index = {}
+        if args.cache_index and os.path.exists(args.cache_index):
+            with open(args.cache_index, "r") as f:
+                cache_index = json.load(f)
+        costs = stage_costs(load_config(args.config), args.profiles, workflows, cache_index)
+        with open(args.output, "w") as f:
+            json.dump(costs, f, indent=4, sort_keys=True)
+        print(f"✅ Costs for {len(costs['stages'])} stages, {len(costs['outputs'])} outputs "
+              f"and {len(costs['cache'])} cache entries in {args.output}")
+
+    elif args.command == "manifest":
+        import yaml
+        from workflow_writer import Dumper
+
+        with open(args.costs, "r") as f:
+            costs = json.load(f)
+        parse_size(args.budget)
+        with open(args.output, "w") as f:
+            yaml.dump_all(gc_manifest(costs, args.budget, args.namespace, flush_url=args.flush), f, Dumper=Dumper, sort_keys=False, allow_unicode=True)
+        print(f"✅ GC job with a {args.budget} budget in {args.output}")
+
+    else:
+        with open(args.costs, "r") as f:
+            costs = json.load(f)
+        stats = collect(args.root, costs, parse_size(args.budget), args.half_life, args.dry_run)
+        print(
+            f"{'Would evict' if args.dry_run else 'Evicted'} {stats['evicted']}/{stats['intermediates']} intermediates "
+            f"({stats['bytes_evicted'] / 2 ** 20:.1f} MiB, {stats['seconds_evicted']:.0f}s to recompute), "
+            f"kept {stats['bytes_kept'] / 2 ** 20:.1f} MiB"
+        )
+        if args.flush and (stats["evicted_paths"] or stats["wiped"]) and not args.dry_run:
+            flushed = flush_proxy(args.flush, None if stats["wiped"] else stats["evicted_paths"], args.mount_path)
+            if flushed is not None:
+                print(f"Dropped {flushed} cached proxy responses that used evicted paths")
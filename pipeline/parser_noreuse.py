@@ -1,18 +1,90 @@
+import shutil
+import sys
 import yaml
 from pathlib import Path
 import uuid
 
+import dag_utils
+from dag_utils import (
+    MERGE_STAGE, build_dag_template, annotate_critical_path, critical_path_report, expand_shards, fan_out, merge_call
+)
+from build_cache import CACHE_DIR, iter_cached_documents, source_digest
+from workflow_writer import write_documents, write_workflows
+
 def load_config(file_path="./test-config-file/config.yaml"):
     with open(file_path, "r") as f:
         return yaml.safe_load(f)
 
 
-def generate_argo_with_parallel(config):
+def _args(parameters):
+    """Container args for the (name, value) parameters of a call"""
+    # Build args - fix format to be separate args
+    args = []
+    for k, v in parameters:
+        args.append(f"--{k}")
+        if "=" not in str(v):  # Only add value if not already in key
+            args.append(str(v))
+    return args
+
+
+def _add_call(workflow, group, merges, stage_instance, stage_def, step_display_name, template_name):
+    """
+    Add the step and template of a stage call to the step group. A call of a
+    sharded stage runs as one withItems step over its shards, and its merge
+    call is added to merges.
+    """
+    def parameters(instance):
+        fields = []
+        for k, v in instance.get("parameters", {}).items():
+            if isinstance(v, list):
+                v = ",".join(map(str, v))
+            fields.append((k, v))
+        return fields
+
+    *shards, call = expand_shards(stage_instance, stage_def)
+    step = {"name": step_display_name, "template": template_name}
+    if shards:
+        fields, inputs, items = fan_out([parameters(s) for s in shards])
+        step.update(items)
+        group.extend((step, s) for s in shards)
+    else:
+        fields, inputs = parameters(call), None
+        group.append((step, stage_instance))
+
+    # Create container spec
+    container_spec = {
+        "image": f"no{stage_def['image']}",
+        "command": ["python", "main.py"],
+        "args": _args(fields),
+        "volumeMounts": [
+            {"name": "shared-data", "mountPath": stage_def["data-path"]}
+        ]
+    }
+
+    # Create template
+    stage_template = {
+        "name": template_name,
+        "container": container_spec
+    }
+    if inputs:
+        stage_template = {"name": template_name, "inputs": inputs, "container": container_spec}
+    workflow["spec"]["templates"].append(stage_template)
+
+    if shards:
+        merge_step, merge_template = merge_call(
+            f"{step_display_name}-merge", f"merge-{template_name}", call, stage_def["data-path"]
+        )
+        merges.append((merge_step, call))
+        workflow["spec"]["templates"].append(merge_template)
+    return step
+
+
+def iter_argo_with_parallel(config, dag=False):
     namespace = "no-reuse-pipeline" 
     pvc_name = config["Deployment"].get("pvcName", "argo-shard-pvc")
     stages_dict = {s["name"]: s for s in config["stages"]}
-
-    workflows = []
+    if any("sharding" in s for s in config["stages"]):
+        stages_dict[MERGE_STAGE["name"]] = MERGE_STAGE
 
     for pipeline in config["pipelines"]:
         pipeline_name = pipeline["name"]
@@ -41,13 +113,16 @@ def generate_argo_with_parallel(config):
         # main steps template
         steps_template = {"name": pipeline_name, "steps": []}
         step_counter = {}  # To track duplicate stage names in a pipeline
+        step_groups = []  # (step entry, stage instance) per step group, for DAG mode
 
         for step in flow:
+            merges = []  # (merge step, merge call) of the sharded calls in this group
             # -------------------------
             # PARALLEL STAGES
             # -------------------------
             if isinstance(step, dict) and step.get("parallel", False):
                 parallel_steps = []
+                step_groups.append([])
 
                 for stage_instance in step["stages"]:
                     stage_name = stage_instance["stage"]
@@ -68,34 +143,9 @@ def generate_argo_with_parallel(config):
                         step_display_name = stage_name
 
                     # Register parallel leaf
-                    parallel_steps.append({"name": step_display_name, "template": template_name})
-
-                    # Build args - fix format to be separate args
-                    args = []
-                    for k, v in stage_instance.get("parameters", {}).items():
-                        if isinstance(v, list):
-                            v = ",".join(map(str, v))
-                        args.append(f"--{k}")
-                        if "=" not in str(v):  # Only add value if not already in key
-                            args.append(str(v))
-
-                    # Create container spec
-                    container_spec = {
-                        "image": f"no{stage_def['image']}",
-                        "command": ["python", "main.py"],
-                        "args": args,
-                        "volumeMounts": [
-                            {"name": "shared-data", "mountPath": stage_def["data-path"]}
-                        ]
-                    }
-
-                    # Create template
-                    stage_template = {
-                        "name": template_name,
-                        "container": container_spec
-                    }
-
-                    workflow["spec"]["templates"].append(stage_template)
+                    parallel_steps.append(_add_call(
+                        workflow, step_groups[-1], merges, stage_instance, stage_def, step_display_name, template_name
+                    ))
 
                 steps_template["steps"].append(parallel_steps)
 
@@ -126,59 +176,63 @@ def generate_argo_with_parallel(config):
                     template_name = f"{stage_name}-{pipeline_name}"
                     step_display_name = stage_name
 
-                steps_template["steps"].append(
-                    [{"name": step_display_name, "template": template_name}]
-                )
-
-                # Build args - fix format to be separate args
-                args = []
-                for k, v in step.get("parameters", {}).items():
-                    if isinstance(v, list):
-                        v = ",".join(map(str, v))
-                    args.append(f"--{k}")
-                    if "=" not in str(v):  # Only add value if not already in key
-                        args.append(str(v))
-
-                # Create container spec
-                container_spec = {
-                    "image": f"no{stage_def['image']}",
-                    "command": ["python", "main.py"],
-                    "args": args,
-                    "volumeMounts": [
-                        {"name": "shared-data", "mountPath": stage_def["data-path"]}
-                    ]
-                }
-
-                # Create template
-                stage_template = {
-                    "name": template_name,
-                    "container": container_spec
-                }
-
-                workflow["spec"]["templates"].append(stage_template)
+                step_groups.append([])
+                steps_template["steps"].append([_add_call(
+                    workflow, step_groups[-1], merges, step, stage_def, step_display_name, template_name
+                )])
+
+            # merges of sharded calls run as the next step group
+            if merges:
+                steps_template["steps"].append([merge_step for merge_step, _ in merges])
+                step_groups.append(merges)
+
+        if dag:
+            steps_template = build_dag_template(pipeline_name, step_groups, stages_dict)
+            annotate_critical_path(workflow, steps_template)
 
         # Add the steps template as the first template
         workflow["spec"]["templates"].insert(0, steps_template)
-        workflows.append(workflow)
+        yield workflow
+
+
+def generate_argo_with_parallel(config, dag=False):
+    return list(iter_argo_with_parallel(config, dag=dag))
 
-    return workflows
+
+def save_workflows(workflows, output_path="output/pipeline_noreuse.yaml", per_file=False):
+    Path("output").mkdir(exist_ok=True)
+    if per_file:
+        output_path = str(Path(output_path).with_suffix(""))
+    return write_workflows(workflows, output_path, per_file=per_file)
 
 
-def save_workflows(workflows, output_path="output/pipeline_noreuse.yaml"):
+def save_documents(documents, output_path="output/pipeline_noreuse.yaml", per_file=False):
     Path("output").mkdir(exist_ok=True)
-    with open(output_path, "w") as f:
-        for i, wf in enumerate(workflows):
-            yaml.dump(wf, f, sort_keys=False, default_flow_style=False)
-            if i < len(workflows) - 1:  # Add separator between workflows
-                f.write("---\n")
+    if per_file:
+        output_path = str(Path(output_path).with_suffix(""))
+    return write_documents(documents, output_path, per_file=per_file)
 
 
 if __name__ == "__main__":
+    dag = "--dag" in sys.argv
+    per_file = "--split" in sys.argv
+    if "--full" in sys.argv:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
     config = load_config()
-    workflows = generate_argo_with_parallel(config)
-    
-    # Debug: print number of workflows
-    print(f"Generated {len(workflows)} workflows")
-    
-    save_workflows(workflows)
-    print("✅ Argo Workflow (parallel-capable, no reuse) saved to output/pipeline_noreuse.yaml")
\ No newline at end of file
+
+    def generate(pipeline_config):
+        workflows = iter_argo_with_parallel(pipeline_config, dag=dag)
+        return list(workflows)
+
+    # only pipelines whose definition changed since the last run are rebuilt
+    stats = {}
+    mode = "noreuse-dag" if dag else "noreuse"
+    salt = source_digest(__file__, dag_utils.__file__)
+    documents = iter_cached_documents(
+        config, generate, mode, salt=salt, stats=stats, report=critical_path_report if dag else None
+    )
+
+    count = save_documents(documents, per_file=per_file)
+    target = "output/pipeline_noreuse/" if per_file else "output/pipeline_noreuse.yaml"
+    print(f"✅ {count} Argo Workflows (parallel-capable, no reuse) saved to {target} "
+          f"({stats['generated']} regenerated, {stats['reused']} reused)")
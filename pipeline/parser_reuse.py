@@ -1,27 +1,106 @@
+import hashlib
+import shutil
+import sys
 import yaml
 from pathlib import Path
-import uuid
+
+import dag_utils
+from dag_utils import (
+    MERGE_STAGE, build_dag_template, annotate_critical_path, critical_path_report, expand_shards, fan_out, merge_call
+)
+from build_cache import CACHE_DIR, iter_cached_documents, source_digest
+import coalesce
+from coalesce import coalesce_workflow
+from workflow_writer import write_documents, write_workflows
 
 def load_config(file_path="./test-config-file/config.yaml"):
     with open(file_path, "r") as f:
         return yaml.safe_load(f)
 
 
-def generate_unique_path(stage_name, pipeline_name, path_type="input"):
+def generate_unique_path(stage_name, pipeline_name, path_type="input", step_name=None):
     """Generate unique path for input/output directories"""
-    uid = str(uuid.uuid4())[:8]
+    # derived from the step instead of uuid4, so regenerated output is stable
+    raw = f"{pipeline_name}:{step_name or stage_name}:{path_type}"
+    uid = hashlib.sha1(raw.encode()).hexdigest()[:8]
     if path_type == "input":
         return f"/mnt/data/{pipeline_name}_{stage_name}_input_{uid}"
     else:  # output
         return f"/mnt/data/{pipeline_name}_{stage_name}_output_{uid}"
 
 
-def generate_argo_with_reuse(config):
+def _call_template(template_name, service_url, parameters, inputs=None):
+    """The curl template of a service call with the (name, value) form fields"""
+    command = ["curl", "-X", "POST", service_url]
+    for key, value in parameters:
+        command += ["-F", f"{key}={value}"]
+
+    # Create container with volumeMounts INSIDE the container spec
+    container_spec = {
+        "image": "curlimages/curl:7.85.0",
+        "command": command,
+        "volumeMounts": [
+            {"name": "shared-data", "mountPath": "/mnt/data"}
+        ]
+    }
+    template = {"name": template_name, "container": container_spec}
+    if inputs:
+        template = {"name": template_name, "inputs": inputs, "container": container_spec}
+    return template
+
+
+def _add_call(workflow, group, merges, stage_instance, stage_def, step_name, template_name, pipeline_name, namespace):
+    """
+    Add the step and template of a service call to the step group. A call of a
+    sharded stage runs as one withItems step over its shards, each with its
+    own working directories so shards are reused one by one, and its merge
+    call is added to merges.
+    """
+    stage_name = stage_instance["stage"]
+    port = stage_def.get("port", 5000)
+    service_url = (
+        f"http://{stage_name}.{namespace}.svc.cluster.local:{port}/run"
+    )
+
+    def parameters(instance, name):
+        # Generate unique paths
+        fields = [
+            ("input_dir", generate_unique_path(stage_name, pipeline_name, "input", name)),
+            ("output_dir", generate_unique_path(stage_name, pipeline_name, "output", name)),
+        ]
+        # Add parameters
+        for key, value in instance.get("parameters", {}).items():
+            if isinstance(value, list):
+                value = ",".join(map(str, value))
+            fields.append((key, value))
+        return fields
+
+    *shards, call = expand_shards(stage_instance, stage_def)
+    if not shards:
+        step = {"name": step_name, "template": template_name}
+        group.append((step, stage_instance))
+        workflow["spec"]["templates"].append(_call_template(template_name, service_url, parameters(call, step_name)))
+        return step
+
+    fields, inputs, items = fan_out([parameters(s, f"{step_name}-shard-{s['shard']['index']}") for s in shards])
+    step = {"name": step_name, "template": template_name, **items}
+    group.extend((step, s) for s in shards)
+    workflow["spec"]["templates"].append(_call_template(template_name, service_url, fields, inputs))
+
+    merge_step, merge_template = merge_call(
+        f"{step_name}-merge", f"merge-{template_name}", call, stage_def.get("data-path", "/mnt/data")
+    )
+    merges.append((merge_step, call))
+    workflow["spec"]["templates"].append(merge_template)
+    return step
+
+
+def iter_argo_with_reuse(config, dag=False):
     namespace = config["Deployment"]["namespace"]
     pvc_name = config["Deployment"].get("pvcName", "argo-shard-pvc")
     stages_dict = {s["name"]: s for s in config["stages"]}
-
-    workflows = []
+    if any("sharding" in s for s in config["stages"]):
+        stages_dict[MERGE_STAGE["name"]] = MERGE_STAGE
 
     for pipeline in config["pipelines"]:
         pipeline_name = pipeline["name"]
@@ -48,16 +127,17 @@ def generate_argo_with_reuse(config):
         }
 
         steps_template = {"name": pipeline_name, "steps": []}
+        step_groups = []  # (step entry, stage instance) per step group, for DAG mode
 
         for step in flow:
+            merges = []  # (merge step, merge call) of the sharded calls in this group
             # Handle parallel steps
             if isinstance(step, dict) and "parallel" in step and step["parallel"]:
                 parallel_steps = []
+                step_groups.append([])
 
                 for stage_instance in step["stages"]:
                     stage_name = stage_instance["stage"]
-                    stage_def = stages_dict[stage_name]
-                    port = stage_def.get("port", 5000)
 
                     # Use custom template name if specified, otherwise generate from stage name
                     if "template-name" in stage_instance:
@@ -68,42 +148,10 @@ def generate_argo_with_reuse(config):
                         step_name = stage_name
 
                     # Add to parallel steps with unique step name
-                    parallel_steps.append({"name": step_name, "template": template_name})
-
-                    # Generate unique paths
-                    input_path = generate_unique_path(stage_name, pipeline_name, "input")
-                    output_path = generate_unique_path(stage_name, pipeline_name, "output")
-
-                    service_url = (
-                        f"http://{stage_name}.{namespace}.svc.cluster.local:{port}/run"
-                    )
-
-                    command = ["curl", "-X", "POST", service_url]
-                    command += ["-F", f"input_dir={input_path}"]
-                    command += ["-F", f"output_dir={output_path}"]
-
-                    # Add parameters
-                    for key, value in stage_instance.get("parameters", {}).items():
-                        if isinstance(value, list):
-                            value = ",".join(map(str, value))
-                        command += ["-F", f"{key}={value}"]
-
-                    # Create container with volumeMounts INSIDE the container spec
-                    container_spec = {
-                        "image": "curlimages/curl:7.85.0",
-                        "command": command,
-                        "volumeMounts": [
-                            {"name": "shared-data", "mountPath": "/mnt/data"}
-                        ]
-                    }
-
-                    # Add template with container spec
-                    workflow["spec"]["templates"].append(
-                        {
-                            "name": template_name,
-                            "container": container_spec
-                        }
-                    )
+                    parallel_steps.append(_add_call(
+                        workflow, step_groups[-1], merges, stage_instance, stages_dict[stage_name],
+                        step_name, template_name, pipeline_name, namespace
+                    ))
 
                 steps_template["steps"].append(parallel_steps)
 
@@ -125,66 +173,69 @@ def generate_argo_with_reuse(config):
                     template_name = f"call-{stage_name}-service"
                     step_name = stage_name
                 
-                stage_def = stages_dict[stage_name]
-                port = stage_def.get("port", 5000)
-
-                steps_template["steps"].append(
-                    [{"name": step_name, "template": template_name}]
-                )
-
-                # Generate unique paths
-                input_path = generate_unique_path(stage_name, pipeline_name, "input")
-                output_path = generate_unique_path(stage_name, pipeline_name, "output")
-
-                service_url = (
-                    f"http://{stage_name}.{namespace}.svc.cluster.local:{port}/run"
-                )
-
-                command = ["curl", "-X", "POST", service_url]
-                command += ["-F", f"input_dir={input_path}"]
-                command += ["-F", f"output_dir={output_path}"]
-
-                # Add parameters
-                for key, value in step.get("parameters", {}).items():
-                    if isinstance(value, list):
-                        value = ",".join(map(str, value))
-                    command += ["-F", f"{key}={value}"]
-
-                # Create container with volumeMounts INSIDE the container spec
-                container_spec = {
-                    "image": "curlimages/curl:7.85.0",
-                    "command": command,
-                    "volumeMounts": [
-                        {"name": "shared-data", "mountPath": "/mnt/data"}
-                    ]
-                }
-
-                # Add template with container spec
-                workflow["spec"]["templates"].append(
-                    {
-                        "name": template_name,
-                        "container": container_spec
-                    }
-                )
+                step_groups.append([])
+                steps_template["steps"].append([_add_call(
+                    workflow, step_groups[-1], merges, step, stages_dict[stage_name],
+                    step_name, template_name, pipeline_name, namespace
+                )])
+
+            # merges of sharded calls run as the next step group
+            if merges:
+                steps_template["steps"].append([merge_step for merge_step, _ in merges])
+                step_groups.append(merges)
+
+        if dag:
+            steps_template = build_dag_template(pipeline_name, step_groups, stages_dict)
+            annotate_critical_path(workflow, steps_template)
 
         # Add the steps template as the first template
         workflow["spec"]["templates"].insert(0, steps_template)
-        workflows.append(workflow)
+        yield workflow
+
+
+def generate_argo_with_reuse(config, dag=False):
+    return list(iter_argo_with_reuse(config, dag=dag))
 
-    return workflows
+
+def save_workflows(workflows, output_path="output/pipeline_reuse.yaml", per_file=False):
+    Path("output").mkdir(exist_ok=True)
+    if per_file:
+        output_path = str(Path(output_path).with_suffix(""))
+    return write_workflows(workflows, output_path, per_file=per_file)
 
 
-def save_workflows(workflows, output_path="output/pipeline_reuse.yaml"):
+def save_documents(documents, output_path="output/pipeline_reuse.yaml", per_file=False):
     Path("output").mkdir(exist_ok=True)
-    with open(output_path, "w") as f:
-        for i, wf in enumerate(workflows):
-            yaml.dump(wf, f, sort_keys=False)
-            if i < len(workflows) - 1:  # Add separator between workflows
-                f.write("---\n")
+    if per_file:
+        output_path = str(Path(output_path).with_suffix(""))
+    return write_documents(documents, output_path, per_file=per_file)
 
 
 if __name__ == "__main__":
+    dag = "--dag" in sys.argv
+    per_file = "--split" in sys.argv
+    # --coalesce fuses consecutive service calls into one pod, --coalesce=N at most N step groups per pod
+    fuse = next((a for a in sys.argv if a.split("=")[0] == "--coalesce"), None)
+    max_groups = int(fuse.split("=")[1]) if fuse and "=" in fuse else None
+    if "--full" in sys.argv:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
     config = load_config()
-    workflows = generate_argo_with_reuse(config)
-    save_workflows(workflows)
-    print("✅ Argo Workflow (with reuse) saved to output/pipeline_reuse.yaml")
\ No newline at end of file
+
+    def generate(pipeline_config):
+        workflows = iter_argo_with_reuse(pipeline_config, dag=dag)
+        if fuse and not dag:
+            workflows = (coalesce_workflow(wf, max_groups) for wf in workflows)
+        return list(workflows)
+
+    # only pipelines whose definition changed since the last run are rebuilt
+    stats = {}
+    mode = "-".join(["reuse"] + (["dag"] if dag else []) + ([fuse.lstrip("-").replace("=", "")] if fuse else []))
+    salt = source_digest(__file__, dag_utils.__file__, coalesce.__file__)
+    documents = iter_cached_documents(
+        config, generate, mode, salt=salt, stats=stats, report=critical_path_report if dag else None
+    )
+
+    count = save_documents(documents, per_file=per_file)
+    target = "output/pipeline_reuse/" if per_file else "output/pipeline_reuse.yaml"
+    print(f"✅ {count} Argo Workflows (with reuse) saved to {target} "
+          f"({stats['generated']} regenerated, {stats['reused']} reused)")
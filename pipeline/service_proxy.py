@@ -0,0 +1,503 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+import urllib.parse
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.parser import BytesParser
+from email.policy import HTTP
+from glob import glob
+from logging import getLogger, basicConfig, INFO
+from typing import Iterable, Optional
+
+log = getLogger("experiment.service_proxy")
+
+# the proxy runs on a plain python image, so it only uses the stdlib; the
+# manifest command is the one place that needs PyYAML
+SERVICES_DIR = "k8s-deployment-files/transformation-services"
+MANIFEST_PATH = "k8s-deployment-files/transformation-proxy/proxy.yaml"
+CACHED_METHODS = {"POST"}
+CACHE_PATHS = ("/run",)
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length", "expect", "host", "proxy-connection", "upgrade"}
+MAX_HEADER_BYTES = 64 * 1024
+ADMIN_PORT = 9100
+# a hostPath on the node the proxy is pinned to, experiment runs copy their part of it
+ACCESS_LOG = "/var/log/transformation-proxy/access.jsonl"
+
+
+@dataclass
+class Route:
+    service: str
+    port: int  # the proxy listens here, the Service keeps its port
+    upstream_host: str
+    upstream_port: int
+
+    @classmethod
+    def parse(cls, value: str) -> "Route":
+        """service:port=host:port, e.g. generate-name:8082=generate-name-backend:8082"""
+        listen, upstream = value.split("=", 1)
+        service, port = listen.rsplit(":", 1)
+        host, upstream_port = upstream.rsplit(":", 1)
+        return cls(service, int(port), host, int(upstream_port))
+
+
+@dataclass
+class Response:
+    status: int
+    reason: str
+    headers: list[tuple[str, str]]
+    body: bytes
+
+
+class ProxyError(Exception):
+    pass
+
+
+def form_fields(content_type: str, body: bytes) -> list[tuple[str, str]]:
+    """
+    Form fields of a request body, sorted, so equivalent calls get the same key
+    whatever the field order or multipart boundary. File parts count by digest.
+    """
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        fields = []
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True) or b""
+            if part.get_filename():
+                fields.append((name, "sha256:" + hashlib.sha256(payload).hexdigest()))
+            else:
+                fields.append((name, payload.decode(errors="replace").strip()))
+        return sorted(fields)
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return sorted((k, v.strip()) for k, v in urllib.parse.parse_qsl(body.decode(errors="replace"), keep_blank_values=True))
+    return [("body", "sha256:" + hashlib.sha256(body).hexdigest())]
+
+
+def data_paths(fields: list[tuple[str, str]]) -> tuple[str, ...]:
+    """Absolute paths a call reads or writes, from its form fields; list values are comma-separated"""
+    return tuple(p for _, value in fields for p in value.split(",") if p.startswith("/"))
+
+
+def output_dir(fields: list[tuple[str, str]]) -> Optional[str]:
+    """
+    Where a call writes, the artifact it produces: the shortest directory of
+    its output fields, an output_*dir field counting as a directory itself
+    """
+    dirs = [
+        value.rstrip("/") if key.endswith("dir") else os.path.dirname(value)
+        for key, value in fields if key.startswith("output") and value
+    ]
+    return min(dirs, key=lambda d: (len(d), d), default=None)
+
+
+def request_key(service: str, method: str, path: str, content_type: str, body: bytes) -> str:
+    raw = json.dumps([service, method, urllib.parse.urlsplit(path).path, form_fields(content_type, body)])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    LRU of finished responses, bounded by entries and bytes, each entry
+    expiring after ttl seconds. Entries remember the data paths of their call,
+    so they can be dropped when those paths are removed from the PVC.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, tuple[float, Response, tuple[str, ...]]] = OrderedDict()
+        self.bytes = 0
+
+    def get(self, key: str) -> Optional[Response]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._drop(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, response: Response, paths: Iterable[str] = ()) -> None:
+        if self.ttl <= 0 or len(response.body) > self.max_bytes:
+            return
+        if key in self.entries:
+            self._drop(key)
+        self.entries[key] = (time.monotonic() + self.ttl, response, tuple(paths))
+        self.bytes += len(response.body)
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+
+    def flush(self, paths: Optional[Iterable[str]] = None) -> int:
+        """Drop the entries of calls that used a path at or below one of paths, or all; returns how many"""
+        if paths is None:
+            keys = list(self.entries)
+        else:
+            prefixes = [p.rstrip("/") for p in paths]
+            keys = [
+                key for key, (_, _, used) in self.entries.items()
+                if any(u.rstrip("/") == p or u.startswith(f"{p}/") for u in used for p in prefixes)
+            ]
+        for key in keys:
+            self._drop(key)
+        return len(keys)
+
+    def _drop(self, key: str) -> None:
+        _, response, _ = self.entries.pop(key)
+        self.bytes -= len(response.body)
+
+
+async def read_head(reader: asyncio.StreamReader) -> tuple[str, list[tuple[str, str]]]:
+    head = await reader.readuntil(b"\r\n\r\n")
+    if len(head) > MAX_HEADER_BYTES:
+        raise ProxyError("header too large")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = []
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers.append((name.strip(), value.strip()))
+    return lines[0], headers
+
+
+def header(headers: list[tuple[str, str]], name: str, default: str = "") -> str:
+    return next((v for k, v in headers if k.lower() == name), default)
+
+
+async def read_chunked(reader: asyncio.StreamReader) -> bytes:
+    body = bytearray()
+    while True:
+        size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+        if size == 0:
+            await reader.readline()  # no trailers from the services
+            return bytes(body)
+        body += await reader.readexactly(size)
+        await reader.readline()
+
+
+def render(response: Response, extra: list[tuple[str, str]] = ()) -> bytes:
+    lines = [f"HTTP/1.1 {response.status} {response.reason}"]
+    lines += [f"{k}: {v}" for k, v in response.headers if k.lower() not in HOP_HEADERS]
+    lines += [f"{k}: {v}" for k, v in extra]
+    lines += [f"Content-Length: {len(response.body)}", "Connection: close", "", ""]
+    return "\r\n".join(lines).encode("latin-1") + response.body
+
+
+class SingleFlightProxy:
+    """
+    Forwards every request of a route to its upstream, one request per
+    connection. Cacheable calls (POST /run) are keyed on the service and the
+    normalized form fields: while one is upstream, identical calls wait for
+    its response instead of going upstream too, and successful responses are
+    served from the cache until they expire. POST /flush on the admin port
+    drops them earlier, e.g. once the PVC cleaner removed their outputs.
+    """
+
+    def __init__(self, routes: list[Route], cache: ResultCache, timeout: float = 3600.0,
+                 access_log: Optional[str] = None):
+        self.routes = routes
+        self.cache = cache
+        self.timeout = timeout
+        # one JSON line per request, the service call intervals energy attribution works from
+        self.access_log = open(access_log, "a", buffering=1) if access_log else None
+        self.in_flight: dict[str, asyncio.Future] = {}
+        self.counters: dict[tuple[str, str], int] = {}
+
+    def count(self, service: str, result: str) -> None:
+        self.counters[service, result] = self.counters.get((service, result), 0) + 1
+
+    async def upstream(self, route: Route, request_line: str, headers: list, body: bytes) -> Response:
+        reader, writer = await asyncio.open_connection(route.upstream_host, route.upstream_port)
+        try:
+            forwarded = [f"{k}: {v}" for k, v in headers if k.lower() not in HOP_HEADERS]
+            head = [request_line, f"Host: {route.upstream_host}:{route.upstream_port}", *forwarded,
+                    f"Content-Length: {len(body)}", "Connection: close", "", ""]
+            writer.write("\r\n".join(head).encode("latin-1") + body)
+            await writer.drain()
+
+            status_line, response_headers = await read_head(reader)
+            _, status, reason = (status_line.split(" ", 2) + [""])[:3]
+            if header(response_headers, "transfer-encoding").lower() == "chunked":
+                response_body = await read_chunked(reader)
+            elif header(response_headers, "content-length"):
+                response_body = await reader.readexactly(int(header(response_headers, "content-length")))
+            else:
+                response_body = await reader.read()
+            return Response(int(status), reason, response_headers, response_body)
+        finally:
+            writer.close()
+
+    async def forward(self, route: Route, request_line: str, headers: list, body: bytes) -> tuple[Response, str]:
+        method, path = request_line.split(" ")[:2]
+        if method not in CACHED_METHODS or urllib.parse.urlsplit(path).path not in CACHE_PATHS:
+            return await self.upstream(route, request_line, headers, body), "passthrough"
+
+        content_type = header(headers, "content-type")
+        key = request_key(route.service, method, path, content_type, body)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached, "hit"
+        if key in self.in_flight:
+            return await asyncio.shield(self.in_flight[key]), "coalesced"
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            response = await asyncio.wait_for(self.upstream(route, request_line, headers, body), self.timeout)
+            if 200 <= response.status < 300:
+                # failures are retried by the next caller
+                self.cache.put(key, response, data_paths(form_fields(content_type, body)))
+            future.set_result(response)
+            return response, "miss"
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; nobody may be waiting
+            raise
+        finally:
+            del self.in_flight[key]
+
+    async def handle(self, route: Route, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line, headers = await read_head(reader)
+            if header(headers, "expect").lower() == "100-continue":
+                writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            if header(headers, "transfer-encoding").lower() == "chunked":
+                body = await read_chunked(reader)
+            else:
+                body = await reader.readexactly(int(header(headers, "content-length", "0")))
+
+            start = time.time()
+            try:
+                response, result = await self.forward(route, request_line, headers, body)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, ProxyError) as e:
+                log.warning(f"{route.service}: upstream failed: {e!r}")
+                response, result = Response(502, "Bad Gateway", [], f"upstream failed: {e!r}\n".encode()), "error"
+            self.count(route.service, result)
+            if self.access_log:
+                method, path = request_line.split(" ")[:2]
+                content_type = header(headers, "content-type")
+                key = request_key(route.service, method, path, content_type, body)
+                self.access_log.write(json.dumps({
+                    "service": route.service, "start": start, "end": time.time(),
+                    "result": result, "status": response.status, "key": key,
+                    "output": output_dir(form_fields(content_type, body)),
+                }) + "\n")
+            writer.write(render(response, [("X-Proxy-Cache", result)]))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ProxyError, ConnectionError):
+            pass  # client went away or sent garbage
+        finally:
+            writer.close()
+
+    def metrics(self) -> str:
+        lines = [
+            "# TYPE service_proxy_requests_total counter",
+            *(f'service_proxy_requests_total{{service="{s}",result="{r}"}} {n}' for (s, r), n in sorted(self.counters.items())),
+            "# TYPE service_proxy_in_flight gauge",
+            f"service_proxy_in_flight {len(self.in_flight)}",
+            "# TYPE service_proxy_cache_entries gauge",
+            f"service_proxy_cache_entries {len(self.cache.entries)}",
+            "# TYPE service_proxy_cache_bytes gauge",
+            f"service_proxy_cache_bytes {self.cache.bytes}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    async def handle_admin(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line, headers = await read_head(reader)
+            method, path = (request_line.split(" ") + ["/"])[:2]
+            body = await reader.readexactly(int(header(headers, "content-length", "0")))
+            if path == "/metrics":
+                response = Response(200, "OK", [("Content-Type", "text/plain; version=0.0.4")], self.metrics().encode())
+            elif path == "/flush" and method == "POST":
+                # {"paths": [...]} drops the calls that used them, no paths drops everything
+                flushed = self.cache.flush(json.loads(body or b"{}").get("paths"))
+                log.info(f"Flushed {flushed} cached responses")
+                response = Response(200, "OK", [("Content-Type", "application/json")], json.dumps({"flushed": flushed}).encode())
+            else:
+                response = Response(200, "OK", [("Content-Type", "text/plain")], b"ok\n")
+            writer.write(render(response))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ProxyError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "0.0.0.0", admin_port: Optional[int] = None) -> None:
+        servers = []
+        for route in self.routes:
+            servers.append(await asyncio.start_server(
+                lambda r, w, route=route: self.handle(route, r, w), host, route.port
+            ))
+            log.info(f"{route.service}: :{route.port} -> {route.upstream_host}:{route.upstream_port}")
+        if admin_port:
+            servers.append(await asyncio.start_server(self.handle_admin, host, admin_port))
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+async def serve_stub(port: int, delay: float, fail_every: int = 0) -> None:
+    """A stand-in transformation service: answers /run after `delay` seconds and counts calls"""
+    calls = 0
+
+    async def handle(reader, writer):
+        nonlocal calls
+        try:
+            request_line, headers = await read_head(reader)
+            body = await reader.readexactly(int(header(headers, "content-length", "0")))
+            path = request_line.split(" ")[1]
+            if path == "/calls":
+                response = Response(200, "OK", [("Content-Type", "application/json")], json.dumps({"calls": calls}).encode())
+            else:
+                calls += 1
+                await asyncio.sleep(delay)
+                fields = form_fields(header(headers, "content-type"), body)
+                failed = fail_every and calls % fail_every == 0
+                response = Response(
+                    500 if failed else 200, "Internal Server Error" if failed else "OK",
+                    [("Content-Type", "application/json")], json.dumps({"call": calls, "fields": fields}).encode(),
+                )
+            writer.write(render(response))
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    log.info(f"stub service on :{port}, {delay}s per call")
+    await server.serve_forever()
+
+
+def proxy_manifest(services_dir: str, namespace: str, args: list[str], access_log: str = ACCESS_LOG) -> list[dict]:
+    """
+    The proxy Deployment and, for every transformation service, a Service of
+    the same name and port that now selects the proxy plus a <name>-backend
+    Service that selects the original pods. Workflows keep their URLs. The
+    access log goes to a hostPath, so it outlives the proxy pod.
+    """
+    import yaml
+
+    services = []
+    for path in sorted(glob(os.path.join(services_dir, "*.yaml"))):
+        with open(path, "r") as f:
+            services += [d for d in yaml.safe_load_all(f) if d and d["kind"] == "Service"]
+
+    routes, documents = [], []
+    for service in services:
+        name, port = service["metadata"]["name"], service["spec"]["ports"][0]["port"]
+        routes.append(f"{name}:{port}={name}-backend.{namespace}.svc.cluster.local:{port}")
+        backend = {
+            "apiVersion": "v1", "kind": "Service",
+            "metadata": {"name": f"{name}-backend", "namespace": namespace},
+            "spec": {**service["spec"], "type": "ClusterIP"},
+        }
+        front = {
+            "apiVersion": "v1", "kind": "Service",
+            "metadata": {"name": name, "namespace": namespace},
+            "spec": {"selector": {"app": "transformation-proxy"}, "ports": service["spec"]["ports"], "type": "ClusterIP"},
+        }
+        documents += [backend, front]
+
+    with open(__file__, "r") as f:
+        script = f.read()
+    config_map = {
+        "apiVersion": "v1", "kind": "ConfigMap",
+        "metadata": {"name": "transformation-proxy", "namespace": namespace},
+        "data": {"service_proxy.py": script},
+    }
+    ports = [{"containerPort": int(r.split("=")[0].rsplit(":", 1)[1])} for r in routes] + [{"containerPort": ADMIN_PORT, "name": "admin"}]
+    # /metrics for Prometheus and /flush for the PVC cleaner
+    admin = {
+        "apiVersion": "v1", "kind": "Service",
+        "metadata": {"name": "transformation-proxy", "namespace": namespace},
+        "spec": {"selector": {"app": "transformation-proxy"}, "ports": [{"name": "admin", "port": ADMIN_PORT}], "type": "ClusterIP"},
+    }
+    deployment = {
+        "apiVersion": "apps/v1", "kind": "Deployment",
+        "metadata": {"name": "transformation-proxy", "namespace": namespace},
+        "spec": {
+            "replicas": 1,  # the single-flight table lives in this one process
+            "selector": {"matchLabels": {"app": "transformation-proxy"}},
+            "template": {
+                "metadata": {
+                    "labels": {"app": "transformation-proxy"},
+                    "annotations": {"prometheus.io/scrape": "true", "prometheus.io/port": str(ADMIN_PORT)},
+                },
+                "spec": {
+                    "nodeSelector": {"baremetal": "true"},
+                    "containers": [{
+                        "name": "proxy",
+                        "image": "python:3.12-slim",
+                        "command": ["python", "/proxy/service_proxy.py", "serve", "--admin-port", str(ADMIN_PORT),
+                                    "--access-log", access_log, *args,
+                                    *(arg for route in routes for arg in ("--route", route))],
+                        "ports": ports,
+                        "volumeMounts": [
+                            {"name": "proxy", "mountPath": "/proxy"},
+                            {"name": "access-log", "mountPath": os.path.dirname(access_log)},
+                        ],
+                    }],
+                    "volumes": [
+                        {"name": "proxy", "configMap": {"name": "transformation-proxy"}},
+                        {"name": "access-log", "hostPath": {"path": os.path.dirname(access_log), "type": "DirectoryOrCreate"}},
+                    ],
+                },
+            },
+        },
+    }
+    return [config_map, deployment, admin] + documents
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Single-flight, caching proxy in front of the transformation services")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve")
+    serve_parser.add_argument("--route", action="append", required=True, help="service:port=upstream-host:port, repeatable")
+    serve_parser.add_argument("--ttl", type=float, default=600.0, help="seconds a finished response is served from cache, 0 disables the cache")
+    serve_parser.add_argument("--max-entries", type=int, default=10000)
+    serve_parser.add_argument("--max-bytes", type=int, default=64 * 2 ** 20)
+    serve_parser.add_argument("--timeout", type=float, default=3600.0, help="seconds to wait for an upstream call")
+    serve_parser.add_argument("--admin-port", type=int, default=None, help="serves /metrics and /flush")
+    serve_parser.add_argument("--access-log", default=None, help="append one JSON line per request here")
+
+    stub_parser = commands.add_parser("stub", help="local stand-in for a transformation service")
+    stub_parser.add_argument("--port", type=int, required=True)
+    stub_parser.add_argument("--delay", type=float, default=1.0)
+    stub_parser.add_argument("--fail-every", type=int, default=0, help="answer every n-th call with a 500")
+
+    manifest_parser = commands.add_parser("manifest", help="write the proxy Deployment and rerouted Services")
+    manifest_parser.add_argument("--services", default=SERVICES_DIR)
+    manifest_parser.add_argument("--namespace", default="pipeline")
+    manifest_parser.add_argument("--ttl", default="600")
+    manifest_parser.add_argument("--access-log", default=ACCESS_LOG, help="where the proxy appends its access log, on the node")
+    manifest_parser.add_argument("--output", default=MANIFEST_PATH)
+    args = parser.parse_args()
+
+    basicConfig(level=INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if args.command == "serve":
+        proxy = SingleFlightProxy(
+            [Route.parse(r) for r in args.route],
+            ResultCache(args.ttl, args.max_entries, args.max_bytes),
+            args.timeout,
+            args.access_log,
+        )
+        asyncio.run(proxy.serve(admin_port=args.admin_port))
+    elif args.command == "stub":
+        asyncio.run(serve_stub(args.port, args.delay, args.fail_every))
+    else:
+        import yaml
+        from workflow_writer import Dumper
+
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        with open(args.output, "w") as f:
+            yaml.dump_all(
+                proxy_manifest(args.services, args.namespace, ["--ttl", args.ttl], args.access_log), f,
+                Dumper=Dumper, sort_keys=False, allow_unicode=True,
+            )
+        print(f"✅ Proxy for the services in {args.services} written to {args.output}")
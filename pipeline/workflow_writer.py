@@ -0,0 +1,64 @@
+import io
+import os
+from pathlib import Path
+
+import yaml
+
+# libyaml emitter when PyYAML was built with it, pure-Python otherwise
+class Dumper(getattr(yaml, "CDumper", yaml.Dumper)):
+    pass
+
+
+# multi-line strings (script sources) as literal blocks, so they stay readable
+Dumper.add_representer(str, lambda dumper, value: dumper.represent_scalar(
+    "tag:yaml.org,2002:str", value, style="|" if "\n" in value else None
+))
+
+
+def dump_workflow(workflow):
+    stream = io.StringIO()
+    yaml.dump(workflow, stream, Dumper=Dumper, sort_keys=False, default_flow_style=False)
+    return stream.getvalue()
+
+
+def _unchanged(path, text):
+    if not os.path.exists(path):
+        return False
+    with open(path, "r") as f:
+        return f.read() == text
+
+
+def write_documents(documents, output_path, per_file=False):
+    """
+    Write (name, yaml text) pairs into the output as they are produced, so
+    memory stays flat and the output grows while generation is still running.
+    With per_file, files whose text did not change are left alone, so their
+    mtimes only move when content does. Returns the number of documents
+    written.
+    """
+    count = 0
+
+    if per_file:
+        Path(output_path).mkdir(parents=True, exist_ok=True)
+        for count, (name, text) in enumerate(documents, 1):
+            path = os.path.join(output_path, f"{count:05d}-{name}.yaml")
+            if not _unchanged(path, text):
+                with open(path, "w") as f:
+                    f.write(text)
+        return count
+
+    with open(output_path, "w") as f:
+        for count, (name, text) in enumerate(documents, 1):
+            if count > 1:  # Add separator between workflows
+                f.write("---\n")
+            f.write(text)
+            f.flush()
+    return count
+
+
+def write_workflows(workflows, output_path, per_file=False):
+    documents = (
+        (wf["metadata"]["generateName"].rstrip("-"), dump_workflow(wf))
+        for wf in workflows
+    )
+    return write_documents(documents, output_path, per_file=per_file)
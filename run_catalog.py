@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+from datetime import datetime
+from glob import glob
+from logging import getLogger
+from typing import Optional
+
+import yaml
+
+log = getLogger("experiment.run_catalog")
+
+CATALOG_PATH = "data/catalog.sqlite"
+RUN_FILES = ["run.json", "session.json", "manifest.json", "config.yaml"]
+TIME_FORMAT = "%Y_%m_%d_%H_%M_%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_dir TEXT PRIMARY KEY,
+    run_hash TEXT,
+    variant TEXT,
+    platform TEXT,
+    n_rows INTEGER,
+    experiment TEXT,
+    run INTEGER,
+    users INTEGER,
+    reuse_users INTEGER,
+    session TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    treatment_start TEXT,
+    treatment_end TEXT,
+    duration REAL,
+    treatment_duration REAL,
+    user_data TEXT,
+    config TEXT,
+    signature TEXT,
+    indexed_at TEXT
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_dir TEXT REFERENCES runs(run_dir) ON DELETE CASCADE,
+    metric TEXT,
+    rows INTEGER,
+    columns INTEGER,
+    PRIMARY KEY (run_dir, metric)
+);
+CREATE INDEX IF NOT EXISTS runs_variant ON runs(variant, users, n_rows);
+CREATE INDEX IF NOT EXISTS metrics_metric ON metrics(metric);
+"""
+
+# columns find() filters on directly; any other keyword is looked up in user_data
+RUN_COLUMNS = {
+    "run_hash", "variant", "platform", "n_rows", "experiment", "run",
+    "users", "reuse_users", "session",
+}
+
+
+def _read_json(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _iso(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    return datetime.strptime(value, TIME_FORMAT).isoformat()
+
+
+def signature(run_dir: str) -> str:
+    parts = []
+    for name in RUN_FILES:
+        path = os.path.join(run_dir, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{name}:{stat.st_mtime_ns}:{stat.st_size}")
+    return "|".join(parts)
+
+
+def describe_run(run_dir: str) -> dict:
+    """
+    Everything the catalog keeps about one run. The treatment is taken from
+    user_data when the run recorded it and otherwise from the directory name,
+    since older runs were labelled by hand (reuse_1000_baremetal_..., no_reuse_..._row_100).
+    """
+    run = _read_json(os.path.join(run_dir, "run.json"))
+    session = _read_json(os.path.join(run_dir, "session.json"))
+    manifest = _read_json(os.path.join(run_dir, "manifest.json"))
+    config = {}
+    if os.path.exists(os.path.join(run_dir, "config.yaml")):
+        with open(os.path.join(run_dir, "config.yaml"), "r") as f:
+            config = yaml.safe_load(f) or {}
+
+    user_data = run.get("user_data") or {}
+    dirname = os.path.basename(os.path.normpath(run_dir))
+
+    if "reuse" in user_data:
+        variant = "reuse" if user_data["reuse"] else "no-reuse"
+    else:
+        variant = "no-reuse" if re.match(r"no[-_]reuse", dirname) else "reuse"
+
+    n_rows = user_data.get("n_rows")
+    if n_rows is None:
+        # reuse_1000_baremetal_<time>_<hash>, or <variant>_<time>_<hash>_1000 / _row_100
+        match = (
+            re.match(r"(?:no[-_])?reuse_(\d+)_[a-z]", dirname)
+            or re.search(r"_[0-9a-f]{8}_(?:row_)?(\d+)$", dirname)
+        )
+        n_rows = int(match.group(1)) if match else None
+
+    platform = user_data.get("platform")
+    if platform is None and "baremetal" in f"{dirname} {user_data.get('experiment', '')}":
+        platform = "baremetal"
+
+    return {
+        "run_dir": dirname,
+        "run_hash": run.get("runHash"),
+        "variant": variant,
+        "platform": platform,
+        "n_rows": n_rows,
+        "experiment": user_data.get("experiment"),
+        "run": user_data.get("run"),
+        "users": user_data.get("users"),
+        "reuse_users": user_data.get("reuse_users"),
+        "session": session.get("name"),
+        "start_time": _iso(run.get("startTime")),
+        "end_time": _iso(run.get("endTime")),
+        "treatment_start": _iso(run.get("treatment_start")),
+        "treatment_end": _iso(run.get("treatment_end")),
+        "duration": run.get("duration"),
+        "treatment_duration": run.get("treatment_duration"),
+        "user_data": json.dumps(user_data, sort_keys=True),
+        "config": json.dumps(config, sort_keys=True, default=str),
+        "signature": signature(run_dir),
+        "indexed_at": datetime.now().isoformat(),
+        "metrics": [
+            (metric, entry.get("rows"), len(entry.get("columns", [])))
+            for metric, entry in (manifest.get("data_files") or {}).items()
+        ],
+    }
+
+
+class RunCatalog:
+    """SQLite index over the run directories under a data root"""
+
+    def __init__(self, path: str = CATALOG_PATH):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "RunCatalog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def update(self, root: str = "data") -> dict:
+        """Index new or changed runs under root and drop runs that are gone"""
+        known = dict(self.db.execute("SELECT run_dir, signature FROM runs").fetchall())
+        run_dirs = {
+            os.path.basename(p): p for p in sorted(glob(os.path.join(root, "*")))
+            if os.path.isfile(os.path.join(p, "run.json"))
+        }
+
+        stats = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        with self.db:
+            for name, run_dir in run_dirs.items():
+                if known.get(name) == signature(run_dir):
+                    stats["unchanged"] += 1
+                    continue
+                stats["updated" if name in known else "added"] += 1
+                self._store(describe_run(run_dir))
+
+            for name in set(known) - set(run_dirs):
+                self.db.execute("DELETE FROM runs WHERE run_dir = ?", (name,))
+                stats["removed"] += 1
+
+        log.info(f"Catalog {self.path}: {stats}")
+        return stats
+
+    def _store(self, record: dict) -> None:
+        metrics = record.pop("metrics")
+        columns = ", ".join(record)
+        placeholders = ", ".join("?" * len(record))
+        self.db.execute("DELETE FROM runs WHERE run_dir = ?", (record["run_dir"],))
+        self.db.execute(f"INSERT INTO runs ({columns}) VALUES ({placeholders})", list(record.values()))
+        self.db.executemany(
+            "INSERT INTO metrics (run_dir, metric, rows, columns) VALUES (?, ?, ?, ?)",
+            [(record["run_dir"], *m) for m in metrics],
+        )
+
+    def find(self, metric: Optional[str] = None, **filters) -> list[dict]:
+        """
+        Runs matching every filter, oldest first, e.g.
+        find(variant="reuse", users=1000, platform="baremetal", metric="wall_power").
+        Keywords that are not catalog columns are matched against user_data.
+        """
+        clauses, params = [], []
+        for key, value in filters.items():
+            if not re.fullmatch(r"\w+", key):
+                raise ValueError(f"Invalid filter {key!r}")
+            column = key if key in RUN_COLUMNS else f"json_extract(user_data, '$.{key}')"
+            if value is None:
+                clauses.append(f"{column} IS NULL")
+            else:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if metric is not None:
+            clauses.append("run_dir IN (SELECT run_dir FROM metrics WHERE metric = ?)")
+            params.append(metric)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.db.execute(f"SELECT * FROM runs {where} ORDER BY start_time", params).fetchall()
+        return [self._row(r) for r in rows]
+
+    def metrics(self, run_dir: str) -> dict[str, int]:
+        rows = self.db.execute("SELECT metric, rows FROM metrics WHERE run_dir = ? ORDER BY metric", (run_dir,))
+        return dict(rows.fetchall())
+
+    def query(self, sql: str, params: tuple = ()) -> list[dict]:
+        return [dict(r) for r in self.db.execute(sql, params).fetchall()]
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> dict:
+        record = dict(row)
+        record["user_data"] = json.loads(record["user_data"])
+        record["config"] = json.loads(record["config"])
+        return record
+
+
+def parse_filter(item: str) -> tuple[str, object]:
+    key, value = item.split("=", 1)
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index experiment runs and list the ones matching filters")
+    parser.add_argument("filters", nargs="*", help="key=value, e.g. variant=reuse users=1000 platform=baremetal")
+    parser.add_argument("--root", default="data")
+    parser.add_argument("--catalog", default=CATALOG_PATH)
+    parser.add_argument("--metric", default=None, help="only runs that exported this metric")
+    args = parser.parse_intermixed_args()
+
+    with RunCatalog(args.catalog) as catalog:
+        catalog.update(args.root)
+        runs = catalog.find(metric=args.metric, **dict(parse_filter(f) for f in args.filters))
+
+    for run in runs:
+        print(f"{run['run_dir']}  {run['variant']:<8} users={run['users']} n_rows={run['n_rows']} "
+              f"treatment={run['treatment_duration'] or 0:.0f}s")
+    print(f"✅ {len(runs)} runs")
@@ -0,0 +1,94 @@
+import hashlib
+import itertools
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from logging import getLogger
+from typing import Callable
+
+import yaml
+
+log = getLogger("experiment.scheduler")
+
+FACTORS = ["reuse", "users", "reuse_users", "n_rows", "arrival"]
+
+
+@dataclass
+class ExperimentMatrix:
+    """Full factorial over FACTORS, each combination repeated `repetitions` times"""
+
+    reuse: list[bool] = field(default_factory=lambda: [True, False])
+    users: list[int] = field(default_factory=lambda: [100])
+    reuse_users: list[int] = field(default_factory=lambda: [50])
+    n_rows: list[int] = field(default_factory=lambda: [100])
+    arrival: list[str] = field(default_factory=lambda: ["burst"])
+    rate: float = 1.0  # users per second for constant/poisson arrivals
+    repetitions: int = 1
+    seed: int = 0
+    cooldown: float = 0.0
+    checkpoint: str = "experiments-checkpoint.json"
+
+    @classmethod
+    def from_file(cls, path: str) -> "ExperimentMatrix":
+        with open(path, "r") as f:
+            spec = yaml.safe_load(f)
+        return cls(**spec.get("matrix", {}), **spec.get("schedule", {}))
+
+    def expand(self) -> list[dict]:
+        combinations = [
+            dict(zip(FACTORS, values), run=repetition)
+            for values in itertools.product(*(getattr(self, f) for f in FACTORS))
+            if values[2] <= values[1]  # reuse_users is a share of users
+            for repetition in range(1, self.repetitions + 1)
+        ]
+        # randomized, but reproducible from the seed, so drift over a long
+        # sweep does not line up with any factor
+        random.Random(self.seed).shuffle(combinations)
+        return combinations
+
+    def fingerprint(self) -> str:
+        raw = json.dumps([getattr(self, f) for f in FACTORS] + [self.rate, self.repetitions, self.seed])
+        return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+class Checkpoint:
+    """Keys of finished experiments, rewritten atomically after every run"""
+
+    def __init__(self, path: str, fingerprint: str):
+        self.path = path
+        self.state = {"fingerprint": fingerprint, "done": {}}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.state = json.load(f)
+            if self.state.get("fingerprint") != fingerprint:
+                log.warning(f"{path} was written for a different matrix, keeping finished runs that still match")
+                self.state["fingerprint"] = fingerprint
+
+    def is_done(self, key: str) -> bool:
+        return key in self.state["done"]
+
+    def mark_done(self, key: str) -> None:
+        self.state["done"][key] = datetime.now().isoformat()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+def run_schedule(experiments: list, run_one: Callable, checkpoint: Checkpoint, cooldown: float = 0.0) -> int:
+    """Run every experiment not yet in the checkpoint; returns how many ran"""
+    pending = [e for e in experiments if not checkpoint.is_done(e.key)]
+    log.info(f"{len(experiments) - len(pending)}/{len(experiments)} experiments already done, {len(pending)} to go")
+
+    for i, experiment in enumerate(pending):
+        if i > 0 and cooldown > 0:
+            log.info(f"Cooling down for {cooldown:.0f}s")
+            time.sleep(cooldown)
+        log.info(f"[{i + 1}/{len(pending)}] {experiment.key}")
+        run_one(experiment)
+        checkpoint.mark_done(experiment.key)
+
+    return len(pending)
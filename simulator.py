@@ -0,0 +1,449 @@
+import argparse
+import heapq
+import itertools
+import json
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from logging import getLogger
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from loadgen import ARRIVALS, arrival_offsets
+
+log = getLogger("experiment.simulator")
+
+MODEL_PATH = "simulation.yaml"
+PROFILES_PATH = "stage-profiles.json"
+PLANS = ("reuse", "no-reuse")
+
+
+@dataclass
+class StageProfile:
+    duration: float  # seconds of work per execution
+    cv: float = 0.3  # coefficient of variation of the duration
+    cpu: float = 0.0  # cpu-seconds per execution
+
+
+@dataclass
+class ClusterModel:
+    config: str
+    nodes: int = 1
+    cores: int = 8
+    idle_watts: float = 150.0
+    core_watts: float = 10.0
+    replicas: int = 1
+    replica_overrides: dict[str, int] = field(default_factory=dict)
+    pod_startup: float = 3.0
+    request: float = 0.2
+    cache_hit: float = 0.1
+    stage_default: StageProfile = field(default_factory=lambda: StageProfile(1.0))
+
+    @classmethod
+    def from_file(cls, path: str) -> "ClusterModel":
+        with open(path, "r") as f:
+            spec = yaml.safe_load(f)
+        services = spec.get("services", {})
+        return cls(
+            config=spec["config"],
+            **spec.get("cluster", {}),
+            replicas=services.get("replicas", 1),
+            replica_overrides=services.get("overrides") or {},
+            **spec.get("overheads", {}),
+            stage_default=StageProfile(**spec.get("stage_default", {"duration": 1.0})),
+        )
+
+    def replicas_for(self, stage: str) -> int:
+        return self.replica_overrides.get(stage, self.replicas)
+
+
+@dataclass
+class Profiles:
+    """What --fit learned from recorded runs"""
+
+    stages: dict[str, StageProfile] = field(default_factory=dict)
+    time_scale: dict[str, dict[int, float]] = field(default_factory=dict)  # plan -> n_rows -> factor
+    idle_watts: Optional[float] = None
+    pod_startup: Optional[float] = None
+    runs: int = 0
+
+    @classmethod
+    def load(cls, path: str) -> "Profiles":
+        if not os.path.exists(path):
+            log.warning(f"No stage profiles at {path}, using the model defaults (run with --fit first)")
+            return cls()
+        with open(path, "r") as f:
+            raw = json.load(f)
+        return cls(
+            stages={name: StageProfile(**p) for name, p in raw["stages"].items()},
+            time_scale={
+                plan: {int(n_rows): factor for n_rows, factor in scales.items()}
+                for plan, scales in raw["time_scale"].items()
+            },
+            idle_watts=raw.get("idle_watts"),
+            pod_startup=raw.get("pod_startup"),
+            runs=raw.get("runs", 0),
+        )
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(self), f, indent=4)
+        os.replace(tmp_path, path)
+
+    def scale(self, plan: str, n_rows: Optional[int]) -> float:
+        """Calibration factor of the closest measured n_rows, 1.0 if the plan was never measured"""
+        scales = self.time_scale.get(plan)
+        if not scales:
+            return 1.0
+        if n_rows is None:
+            return float(np.median(list(scales.values())))
+        return scales[min(scales, key=lambda measured: abs(measured - n_rows))]
+
+
+def load_pipelines(config_path: str) -> dict[str, list[tuple[str, list[int]]]]:
+    """
+    Every pipeline as (stage, dependencies) tasks in flow order. Like the
+    generated steps workflows, a task waits for the whole previous step group.
+    """
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f)
+
+    pipelines = {}
+    for pipeline in config["pipelines"]:
+        tasks, previous = [], []
+        for block in pipeline["flow"]:
+            group = block["stages"] if block.get("parallel") else [block]
+            current = []
+            for stage in group:
+                current.append(len(tasks))
+                tasks.append((stage["stage"], list(previous)))
+            previous = current
+        pipelines[pipeline["name"]] = tasks
+    return pipelines
+
+
+def _lognormal(rng: np.random.Generator, mean: np.ndarray, cv: np.ndarray) -> np.ndarray:
+    sigma = np.sqrt(np.log1p(cv ** 2))
+    with np.errstate(divide="ignore"):
+        mu = np.log(mean) - sigma ** 2 / 2
+    return np.where(mean > 0, np.exp(mu + sigma * rng.standard_normal(len(mean))), 0.0)
+
+
+def simulate(
+    pipelines: dict[str, list[tuple[str, list[int]]]],
+    model: ClusterModel,
+    profiles: Profiles,
+    plan: str,
+    users: int,
+    reuse_users: int = 0,
+    arrival: str = "burst",
+    rate: Optional[float] = None,
+    n_rows: Optional[int] = None,
+    seed: int = 0,
+    scale: Optional[float] = None,
+) -> dict:
+    """
+    One open-loop run of `users` workflows (users cycle through the pipelines,
+    as loadgen does) on the cluster model, event by event.
+
+    reuse: every task is a curl pod calling its stage's Deployment, which
+    serves `replicas` calls at a time in arrival order. Tasks of overlapping
+    users share their pipeline's outputs, so a call whose output was already
+    produced is a cache hit; calls racing for the same output both compute.
+    no-reuse: every task is its own pod and holds one of nodes * cores for
+    its startup and its work.
+    """
+    if plan not in PLANS:
+        raise ValueError(f"Unknown plan {plan!r}, expected one of {PLANS}")
+    reuse = plan == "reuse"
+    rng = np.random.default_rng(seed)
+    if scale is None:
+        scale = profiles.scale(plan, n_rows)
+    pod_startup = (profiles.pod_startup if profiles.pod_startup is not None else model.pod_startup) * scale
+
+    templates = list(pipelines.values())
+    stages = sorted({stage for tasks in templates for stage, _ in tasks})
+    stage_index = {stage: i for i, stage in enumerate(stages)}
+    stage_profiles = [profiles.stages.get(stage, model.stage_default) for stage in stages]
+
+    # flat per-template tables; a job is (user, task) laid out user by user
+    width = max(len(tasks) for tasks in templates)
+    tpl_size = np.array([len(tasks) for tasks in templates])
+    tpl_start = np.concatenate([[0], np.cumsum(tpl_size)[:-1]])
+    tpl_stage = np.array([stage_index[stage] for tasks in templates for stage, _ in tasks])
+    tpl_deps = np.array([len(deps) for tasks in templates for _, deps in tasks])
+    successors = [[[] for _ in tasks] for tasks in templates]
+    for t, tasks in enumerate(templates):
+        for j, (_, deps) in enumerate(tasks):
+            for d in deps:
+                successors[t][d].append(j)
+    roots = [[j for j, (_, deps) in enumerate(tasks) if not deps] for tasks in templates]
+
+    user_tpl = np.arange(users) % len(templates)
+    sizes = tpl_size[user_tpl]
+    base = np.concatenate([[0], np.cumsum(sizes)])
+    n_jobs = int(base[-1])
+    job_user = np.repeat(np.arange(users), sizes)
+    job_local = np.arange(n_jobs) - base[:-1][job_user]
+    job_row = tpl_start[user_tpl][job_user] + job_local
+    job_stage = tpl_stage[job_row]
+
+    mean = np.array([p.duration for p in stage_profiles]) * scale
+    cv = np.array([p.cv for p in stage_profiles])
+    work = _lognormal(rng, mean[job_stage], cv[job_stage])
+    cpu = np.array([p.cpu for p in stage_profiles])[job_stage]
+
+    overlapping = np.zeros(users, dtype=bool)
+    overlapping[random.Random(seed).sample(range(users), min(reuse_users, users))] = True
+    # overlapping users of one pipeline write the same paths, everyone else is isolated
+    key = np.where(overlapping[job_user], user_tpl[job_user] * width + job_local, -1)
+
+    if reuse:
+        servers = [model.replicas_for(stage) for stage in stages]
+        pool = job_stage
+        service = work + model.request * scale
+        delay = pod_startup
+    else:
+        servers = [model.nodes * model.cores]
+        pool = np.zeros(n_jobs, dtype=np.int64)
+        service = work + pod_startup
+        delay = 0.0
+    hit_time = model.cache_hit * scale
+
+    # plain lists: the event loop indexes them once per event
+    pool, service, key, cpu = pool.tolist(), service.tolist(), key.tolist(), cpu.tolist()
+    job_stage_l = job_stage.tolist()
+    job_user_l, job_local_l, base_l, user_tpl_l = job_user.tolist(), job_local.tolist(), base.tolist(), user_tpl.tolist()
+    remaining = tpl_deps[job_row].tolist()
+    left = sizes.tolist()
+    offsets = arrival_offsets(users, arrival, rate, seed)
+    finished = [0.0] * users
+    free = list(servers)
+    queues = [deque() for _ in servers]
+    busy = [0.0] * len(servers)
+    stage_busy = [0.0] * len(stages)
+    produced = bytearray(len(templates) * width)
+    computed = hits = 0
+    cpu_seconds = 0.0
+
+    # events are (time, code): code = 2 * job for "reaches its pool", 2 * job + 1 for "done"
+    heap = [(offsets[u] + delay, 2 * (base_l[u] + j)) for u in range(users) for j in roots[user_tpl_l[u]]]
+    heapq.heapify(heap)
+    push, pop = heapq.heappush, heapq.heappop
+
+    while heap:
+        now, code = pop(heap)
+        job = code >> 1
+        if code & 1:
+            p = pool[job]
+            if key[job] >= 0:
+                produced[key[job]] = 1
+            if queues[p]:
+                started = queues[p].popleft()
+            else:
+                free[p] += 1
+                started = None
+            user = job_user_l[job]
+            left[user] -= 1
+            if not left[user]:
+                finished[user] = now
+            for j in successors[user_tpl_l[user]][job_local_l[job]]:
+                successor = base_l[user] + j
+                remaining[successor] -= 1
+                if not remaining[successor]:
+                    push(heap, (now + delay, 2 * successor))
+            if started is None:
+                continue
+            job = started
+        else:
+            p = pool[job]
+            if not free[p]:
+                queues[p].append(job)
+                continue
+            free[p] -= 1
+
+        if reuse and key[job] >= 0 and produced[key[job]]:
+            took = hit_time
+            hits += 1
+        else:
+            took = service[job]
+            computed += 1
+            cpu_seconds += cpu[job]
+        busy[pool[job]] += took
+        stage_busy[job_stage_l[job]] += took
+        push(heap, (now + took, 2 * job + 1))
+
+    makespan = max(finished, default=0.0)
+    latency = np.array(finished) - np.array(offsets)
+    busy_seconds = float(sum(busy))
+    idle_watts = profiles.idle_watts if profiles.idle_watts is not None else model.idle_watts
+    return {
+        "plan": plan,
+        "users": users,
+        "reuse_users": min(reuse_users, users),
+        "n_rows": n_rows,
+        "arrival": arrival,
+        "executions": n_jobs,
+        "computed": computed,
+        "cache_hits": hits,
+        "makespan": makespan,
+        "throughput": users / makespan if makespan else np.nan,
+        "latency_mean": float(latency.mean()) if users else np.nan,
+        "latency_p95": float(np.quantile(latency, 0.95)) if users else np.nan,
+        "cpu_seconds": cpu_seconds,
+        "busy_core_seconds": busy_seconds,
+        "joules": model.nodes * idle_watts * makespan + model.core_watts * busy_seconds,
+        "stage_busy": dict(zip(stages, stage_busy)),
+    }
+
+
+def match_stage(label: str, stages: list[str]) -> Optional[str]:
+    """The stage a pod or step name belongs to, the longest stage name it contains"""
+    found = [stage for stage in stages if stage in label]
+    return max(found, key=len) if found else None
+
+
+def _increase_per_series(series) -> np.ndarray:
+    step = np.diff(series.values)
+    keep = (series.series[1:] == series.series[:-1]) & (step > 0)
+    return np.bincount(series.series[1:][keep], weights=step[keep], minlength=series.n_series)
+
+
+def fit_profiles(
+    records: list[dict], root: str, model: ClusterModel, pipelines: dict, workers: Optional[int] = None
+) -> Profiles:
+    """
+    Stage profiles from recorded runs (catalog records):
+      - runtime and its spread from recorded workflow status (workflow_status.py),
+        where a run has it, and pod startup from the pending times;
+      - cpu-seconds per execution from the per-pod cpu counters of no-reuse runs,
+        where every pod is one execution; it also stands in for the runtime of
+        stages without workflow status;
+      - idle watts per node from wall power net of the busy cores;
+      - per plan and n_rows, a time scale that makes the simulated makespan of
+        the recorded configuration match its median measured treatment time.
+    """
+    from analysis import load_runs, summary_table, SUMMARY_METRICS
+    from workflow_status import load_snapshots, breakdown
+
+    stages = sorted({stage for tasks in pipelines.values() for stage, _ in tasks})
+    runs = load_runs([os.path.join(root, r["run_dir"]) for r in records], SUMMARY_METRICS, workers)
+
+    runtimes, cpus, pending = {}, {}, []
+    for record, run in zip(records, runs):
+        snapshots = load_snapshots(run.path)
+        if snapshots:
+            table = breakdown(snapshots)
+            pending.extend(table["pending"].dropna())
+            for label, runtime in zip(table["stage"], table["runtime"]):
+                stage = match_stage(str(label), stages)
+                if stage and pd.notna(runtime):
+                    runtimes.setdefault(stage, []).append(runtime)
+        if record["variant"] == "no-reuse" and "system_cpu_usage" in run.metrics:
+            series = run.metrics["system_cpu_usage"]
+            for label, increase in zip(series.labels, _increase_per_series(series)):
+                stage = match_stage(label, stages)
+                if stage and increase > 0:
+                    cpus.setdefault(stage, []).append(increase)
+
+    default = model.stage_default
+    profiles = Profiles(runs=len(runs))
+    for stage in stages:
+        cpu = float(np.mean(cpus[stage])) if stage in cpus else None
+        samples = np.array(runtimes.get(stage, []))
+        duration = float(samples.mean()) if len(samples) else (cpu or default.duration)
+        cv = float(samples.std(ddof=1) / samples.mean()) if len(samples) > 1 and samples.mean() else default.cv
+        profiles.stages[stage] = StageProfile(duration, cv, cpu if cpu is not None else duration)
+    if pending:
+        profiles.pod_startup = float(np.median(pending))
+
+    summary = summary_table(runs)
+    idle = (summary["wall_joules"] - model.core_watts * summary["cpu_seconds"].fillna(0)) / summary["treatment_seconds"] / model.nodes
+    if idle.notna().any():
+        profiles.idle_watts = float(idle.median())
+
+    measured = pd.DataFrame(records)
+    measured = measured[measured["variant"].isin(PLANS) & measured["treatment_duration"].notna()]
+    for (plan, n_rows), group in measured.groupby(["variant", "n_rows"]):
+        users = int(group["users"].median())
+        reuse_users = int(group["reuse_users"].fillna(0).median())
+        result = simulate(pipelines, model, profiles, plan, users, reuse_users, n_rows=int(n_rows), scale=1.0)
+        # with burst arrivals every simulated time is proportional to the scale
+        factor = float(group["treatment_duration"].median()) / result["makespan"]
+        profiles.time_scale.setdefault(plan, {})[int(n_rows)] = factor
+        log.info(f"{plan} n_rows={n_rows}: {len(group)} runs, time scale {factor:.2f}")
+    return profiles
+
+
+def configurations(args) -> list[dict]:
+    if args.matrix:
+        from scheduler import ExperimentMatrix
+
+        matrix = ExperimentMatrix.from_file(args.matrix)
+        return [
+            {"users": users, "reuse_users": reuse_users, "n_rows": n_rows, "arrival": arrival, "rate": matrix.rate}
+            for users, reuse_users, n_rows, arrival in itertools.product(
+                matrix.users, matrix.reuse_users, matrix.n_rows, matrix.arrival
+            )
+            if reuse_users <= users
+        ]
+    return [
+        {"users": users, "reuse_users": round(users * args.reuse_share), "n_rows": args.n_rows,
+         "arrival": args.arrival, "rate": args.rate}
+        for users in args.users
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predict reuse vs no-reuse makespan, throughput, cpu and energy without the cluster")
+    parser.add_argument("--model", default=MODEL_PATH, help="cluster model")
+    parser.add_argument("--profiles", default=PROFILES_PATH)
+    parser.add_argument("--fit", action="store_true", help="fit stage profiles from recorded runs first")
+    parser.add_argument("--root", default="data")
+    parser.add_argument("--catalog", default=None, help="run catalog, defaults to the one in run_catalog.py")
+    parser.add_argument("--users", type=int, nargs="*", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--reuse-share", type=float, default=0.5, help="share of users whose requests overlap")
+    parser.add_argument("--n-rows", type=int, default=None)
+    parser.add_argument("--arrival", choices=ARRIVALS, default="burst")
+    parser.add_argument("--rate", type=float, default=None, help="users per second for constant/poisson arrivals")
+    parser.add_argument("--matrix", default=None, help="simulate every configuration of an experiment matrix instead")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="simulation.csv")
+    args = parser.parse_args()
+
+    model = ClusterModel.from_file(args.model)
+    pipelines = load_pipelines(model.config)
+
+    if args.fit:
+        from run_catalog import RunCatalog, CATALOG_PATH
+
+        with RunCatalog(args.catalog or CATALOG_PATH) as catalog:
+            catalog.update(args.root)
+            records = catalog.find()
+        profiles = fit_profiles(records, args.root, model, pipelines)
+        profiles.save(args.profiles)
+        print(f"✅ Stage profiles from {profiles.runs} runs in {args.profiles}")
+    else:
+        profiles = Profiles.load(args.profiles)
+
+    rows = []
+    for config in configurations(args):
+        for plan in PLANS:
+            start = time.perf_counter()
+            result = simulate(pipelines, model, profiles, plan, seed=args.seed, **config)
+            result["simulated_in"] = time.perf_counter() - start
+            rows.append(result)
+            print(
+                f"{plan:8} users={config['users']:<7} n_rows={config['n_rows']} {config['arrival']:8} "
+                f"makespan={result['makespan']:.0f}s throughput={result['throughput']:.2f}/s "
+                f"cpu={result['cpu_seconds']:.0f}s energy={result['joules'] / 1000:.1f}kJ "
+                f"({result['executions']} executions in {result['simulated_in']:.2f}s)"
+            )
+    pd.DataFrame(rows).drop(columns="stage_busy").to_csv(args.output, index=False)
+    print(f"✅ {len(rows)} simulations in {args.output}")
@@ -0,0 +1,362 @@
+import argparse
+import json
+import math
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timezone
+from logging import getLogger, basicConfig, INFO
+from typing import Optional
+
+import numpy as np
+import yaml
+
+from backfill import ConnectionPool, load_measurements
+from tracker import DONE_PHASES
+
+log = getLogger("experiment.steady_state")
+
+# measurements of sma-measurments.yaml the monitor follows; cumulative ones
+# (counts of finished workflows) are followed as their rate between polls
+SIGNALS = {
+    "argo_workflows_completed_total": True,
+    "kepler_node_cpu_power_sum": False,
+    "argo_workflows_average_queue_latency": False,
+}
+
+WORKFLOW_PHASES = DONE_PHASES | {"Pending", "Running"}
+
+# two-sided 95% Student t quantiles by degrees of freedom, the normal one beyond
+T_975 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]
+
+
+def t_975(df: int) -> float:
+    return T_975[df - 1] if df <= len(T_975) else 1.96
+
+
+@dataclass
+class SteadyStateSettings:
+    enabled: bool = False
+    interval: float = 5.0  # seconds between polls
+    capacity: int = 256  # samples kept per signal
+    batch: int = 5  # samples per batch mean
+    precision: float = 0.05  # 95% CI half width relative to the mean
+    min_batches: int = 5
+    min_steady: float = 60.0  # seconds of steady state before the targets count
+    stop_early: bool = True  # stop waiting for the workflows once the targets are met
+    max_extensions: int = 0  # extra rounds of the same load while they are not
+    signals: dict[str, bool] = field(default_factory=lambda: dict(SIGNALS))
+
+    @classmethod
+    def from_file(cls, path: str) -> "SteadyStateSettings":
+        with open(path, "r") as f:
+            spec = yaml.safe_load(f)
+        return cls(**(spec.get("steady_state") or {}))
+
+
+class RingBuffer:
+    """The last `capacity` (time, value) samples of one signal"""
+
+    def __init__(self, capacity: int):
+        self.t = np.zeros(capacity)
+        self.values = np.zeros(capacity)
+        self.pushed = 0
+
+    def __len__(self) -> int:
+        return min(self.pushed, len(self.t))
+
+    def push(self, t: float, value: float) -> None:
+        i = self.pushed % len(self.t)
+        self.t[i], self.values[i] = t, value
+        self.pushed += 1
+
+    def arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        """Samples oldest first"""
+        if self.pushed <= len(self.t):
+            return self.t[:self.pushed], self.values[:self.pushed]
+        i = self.pushed % len(self.t)
+        return np.concatenate((self.t[i:], self.t[:i])), np.concatenate((self.values[i:], self.values[:i]))
+
+
+def mser_truncation(values: np.ndarray, batch: int = 5) -> Optional[int]:
+    """
+    MSER warm-up truncation on batch means: how many leading samples to drop
+    so the rest has the smallest standard error of its mean. None while the
+    best point is in the second half of the data, i.e. still undecided.
+    """
+    k = len(values) // batch
+    if k < 4:
+        return None
+    means = values[:k * batch].reshape(k, batch).mean(axis=1)
+    remaining = np.arange(k, 0, -1)
+    s1 = np.cumsum(means[::-1])[::-1]
+    s2 = np.cumsum((means ** 2)[::-1])[::-1]
+    stat = (s2 - s1 ** 2 / remaining) / remaining ** 2
+    d = int(np.argmin(stat[:-1]))
+    return d * batch if d <= k // 2 else None
+
+
+def _rounded(value):
+    # run.json is plain JSON, which has no infinity
+    if isinstance(value, float):
+        return round(value, 6) if math.isfinite(value) else None
+    return value
+
+
+def batch_mean_ci(values: np.ndarray, batch: int = 5) -> tuple[float, float, int]:
+    """Mean, 95% CI half width from non-overlapping batch means, and the number of batches"""
+    k = len(values) // batch
+    if k < 2:
+        return float(np.mean(values)) if len(values) else math.nan, math.inf, k
+    means = values[len(values) - k * batch:].reshape(k, batch).mean(axis=1)
+    return float(means.mean()), t_975(k - 1) * float(means.std(ddof=1)) / math.sqrt(k), k
+
+
+class SteadyStateMonitor:
+    """
+    Streaming statistics over a few signals of a running experiment: when
+    the warm-up ended (MSER on every signal, the latest end wins), and
+    whether the batch mean CIs since then are within the precision target.
+    Every decision is appended to `decisions`, in order, for run.json.
+    """
+
+    def __init__(self, settings: SteadyStateSettings):
+        self.settings = settings
+        self.buffers = {name: RingBuffer(settings.capacity) for name in settings.signals}
+        self.previous: dict[str, tuple[float, float]] = {}
+        self.decisions: list[dict] = []
+        self.stats: dict[str, dict] = {}
+        self.warmup_end: Optional[float] = None
+        self.converged_at: Optional[float] = None
+        self.now = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, t: float, values: dict[str, float]) -> None:
+        """Samples of the signals at t seconds; missing or NaN samples are skipped"""
+        with self.lock:
+            self.now = t
+            for name, value in values.items():
+                if name not in self.buffers or value is None or math.isnan(value):
+                    continue
+                if self.settings.signals[name]:
+                    before = self.previous.get(name)
+                    self.previous[name] = (t, value)
+                    if before is None or t <= before[0]:
+                        continue
+                    # counters restart with the exporter; a drop is no negative rate
+                    value = max(value - before[1], 0.0) / (t - before[0])
+                self.buffers[name].push(t, value)
+            self._update(t)
+
+    def _update(self, t: float) -> None:
+        settings = self.settings
+        # signals that never answered (e.g. no queue activity at all) hold nothing back
+        buffers = {name: buffer for name, buffer in self.buffers.items() if buffer.pushed}
+        if not buffers:
+            return
+        # MSER reads a flat stretch at the very start as steady too, so the
+        # warm-up end is revised as more data comes in, while the buffers
+        # still reach back to the start of the run
+        if self.warmup_end is None or all(b.pushed <= settings.capacity for b in buffers.values()):
+            ends = []
+            for name, buffer in buffers.items():
+                times, values = buffer.arrays()
+                d = mser_truncation(values, settings.batch)
+                ends.append(None if d is None else times[d])
+            if None not in ends and (self.warmup_end is None or max(ends) > self.warmup_end):
+                event = "warmup_end" if self.warmup_end is None else "warmup_revised"
+                self.warmup_end = max(ends)
+                self._decide(t, event, warmup_end=self.warmup_end)
+        if self.warmup_end is None:
+            return
+
+        for name, buffer in buffers.items():
+            times, values = buffer.arrays()
+            mean, half_width, batches = batch_mean_ci(values[times >= self.warmup_end], settings.batch)
+            relative = half_width / abs(mean) if mean else (0.0 if half_width == 0 else math.inf)
+            self.stats[name] = {"mean": mean, "half_width": half_width, "relative": relative, "batches": batches}
+
+        met = t - self.warmup_end >= settings.min_steady and all(
+            s["relative"] <= settings.precision and s["batches"] >= settings.min_batches
+            for s in self.stats.values()
+        )
+        if met and self.converged_at is None:
+            self.converged_at = t
+            self._decide(t, "converged")
+        elif not met and self.converged_at is not None:
+            self.converged_at = None
+            self._decide(t, "unsettled")
+
+    def _decide(self, t: float, event: str, **details) -> None:
+        decision = {
+            "event": event,
+            "t": round(t, 3),
+            "at": datetime.now(timezone.utc).isoformat(),
+            **details,
+            "signals": {name: {k: _rounded(v) for k, v in s.items()} for name, s in self.stats.items()},
+        }
+        self.decisions.append(decision)
+        log.info(f"{event} at {t:.0f}s")
+
+    def decide(self, event: str, **details) -> None:
+        """Record a decision taken on the monitor's verdict, at the latest sample time"""
+        with self.lock:
+            self._decide(self.now, event, **details)
+
+    @property
+    def converged(self) -> bool:
+        return self.converged_at is not None
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                "settings": asdict(self.settings),
+                "warmup_end": self.warmup_end,
+                "converged_at": self.converged_at,
+                "samples": {name: buffer.pushed for name, buffer in self.buffers.items()},
+                "signals": {name: {k: _rounded(v) for k, v in s.items()} for name, s in self.stats.items()},
+                "decisions": self.decisions,
+            }
+
+
+def signal_queries(config_path: str, signals: list[str], namespace: str) -> dict[str, str]:
+    """The PromQL of the followed measurements, for one target namespace"""
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f)
+    measurements = {m.name: m for m in load_measurements(config)}
+    missing = [name for name in signals if name not in measurements]
+    if missing:
+        raise ValueError(f"{config_path} has no measurements {missing}")
+    return {name: measurements[name].query.replace("${namespace}", namespace) for name in signals}
+
+
+def vector_total(result: list[dict]) -> float:
+    """Sum of an instant vector; series split by phase only count finished phases"""
+    values = [
+        float(r["value"][1]) for r in result
+        if r["metric"].get("phase", "Succeeded") in DONE_PHASES
+    ]
+    values = [v for v in values if not math.isnan(v)]
+    return sum(values) if values else math.nan
+
+
+class LiveWatch:
+    """
+    Polls Prometheus on a daemon thread and feeds a SteadyStateMonitor until
+    closed. stop_requested is set once the monitor met its targets and the
+    settings allow stopping early.
+    """
+
+    def __init__(self, monitor: SteadyStateMonitor, prometheus: str, queries: dict[str, str]):
+        self.monitor = monitor
+        self.queries = queries
+        self.pool = ConnectionPool(prometheus, size=1, timeout=max(monitor.settings.interval, 5.0))
+        self.stop_requested = threading.Event()
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "LiveWatch":
+        self.thread.start()
+        return self
+
+    def poll(self) -> dict[str, float]:
+        values = {}
+        for name, query in self.queries.items():
+            try:
+                status, body = self.pool.get("/api/v1/query", {"query": query})
+                if status != 200:
+                    log.warning(f"{name}: Prometheus answered {status}")
+                    continue
+                values[name] = vector_total(json.loads(body)["data"]["result"])
+            except (OSError, ValueError, KeyError) as e:
+                log.warning(f"{name}: polling failed: {e!r}")
+        return values
+
+    def _run(self) -> None:
+        origin = time.time()
+        while not self.closed.is_set():
+            self.monitor.observe(time.time() - origin, self.poll())
+            if self.monitor.settings.stop_early and self.monitor.converged:
+                self.stop_requested.set()
+            self.closed.wait(self.monitor.settings.interval)
+
+    def close(self) -> None:
+        self.closed.set()
+        self.thread.join()
+        self.pool.close()
+
+
+def live_watch(settings: SteadyStateSettings, config_path: str, namespace: str) -> LiveWatch:
+    """A LiveWatch on the Prometheus and measurements of an SMA config"""
+    with open(config_path, "r") as f:
+        prometheus = yaml.safe_load(f)["sma"]["services"]["prometheus"]["address"]
+    queries = signal_queries(config_path, list(settings.signals), namespace)
+    return LiveWatch(SteadyStateMonitor(settings), prometheus, queries)
+
+
+def replay(run_dir: str, settings: SteadyStateSettings) -> dict:
+    """
+    Feed the recorded CSVs of a run through the monitor in time order, as the
+    live loop would have seen them at the export step, and say where it
+    would have stopped.
+    """
+    from analysis import load_run
+
+    run = load_run(run_dir, list(settings.signals))
+    samples = {}
+    for name, series in run.metrics.items():
+        # phase split series only count finished phases, as vector_total does
+        keep = [
+            not set(label.split("/")) & WORKFLOW_PHASES or bool(set(label.split("/")) & DONE_PHASES)
+            for label in series.labels
+        ]
+        mask = np.asarray(keep)[series.series]
+        for t, value in zip(series.t[mask], series.values[mask]):
+            samples.setdefault(round(float(t), 3), {}).setdefault(name, 0.0)
+            samples[round(float(t), 3)][name] += value
+    if not samples:
+        raise ValueError(f"{run_dir} recorded none of {list(settings.signals)}")
+
+    monitor = SteadyStateMonitor(settings)
+    for t in sorted(samples):
+        monitor.observe(t, samples[t])
+        if settings.stop_early and monitor.converged:
+            monitor.decide("stop")
+            break
+    else:
+        monitor.decide("extend" if settings.max_extensions else "complete")
+    return {"run": run.name, "duration": run.duration, **monitor.report()}
+
+
+if __name__ == "__main__":
+    basicConfig(level=INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Replay recorded runs through the steady-state monitor")
+    parser.add_argument("run_dirs", nargs="+")
+    parser.add_argument("--settings", default="experiments.yaml", help="file with a steady_state section")
+    parser.add_argument("--batch", type=int, default=None, help="override the samples per batch mean")
+    parser.add_argument("--precision", type=float, default=None, help="override the relative CI target")
+    parser.add_argument("--min-steady", type=float, default=None)
+    parser.add_argument("--output", default=None, help="write the replayed decisions as JSON")
+    args = parser.parse_args()
+
+    settings = SteadyStateSettings.from_file(args.settings)
+    for name in ("batch", "precision", "min_steady"):
+        if getattr(args, name) is not None:
+            setattr(settings, name, getattr(args, name))
+
+    results = []
+    for run_dir in args.run_dirs:
+        result = replay(run_dir, settings)
+        results.append(result)
+        stop = next((d for d in result["decisions"] if d["event"] == "stop"), None)
+        warmup = f"{result['warmup_end']:.0f}s" if result["warmup_end"] is not None else "not detected"
+        verdict = f"would stop at {stop['t']:.0f}s" if stop else f"{result['decisions'][-1]['event']}, not converged"
+        print(f"{result['run']}: warm-up end {warmup}, {verdict} of {result['duration']:.0f}s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    print(f"✅ {len(results)} runs replayed")
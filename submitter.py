@@ -0,0 +1,313 @@
+import argparse
+import csv
+import json
+import os
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from typing import Iterable, Optional
+
+import yaml
+
+log = getLogger("experiment.submitter")
+
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class SubmitResult:
+    index: int
+    generate_name: str
+    namespace: str
+    name: Optional[str]
+    submit_start: float
+    submit_end: float
+    attempts: int
+    status: Optional[int]
+    error: Optional[str] = None
+    scheduled: Optional[float] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.name is not None
+
+    def to_row(self) -> dict:
+        row = asdict(self)
+        row["submit_start_iso"] = datetime.fromtimestamp(self.submit_start, timezone.utc).isoformat()
+        row["latency"] = self.submit_end - self.submit_start
+        return row
+
+
+class RateLimiter:
+    """Token bucket shared by all submit workers; rate=None disables limiting"""
+
+    def __init__(self, rate: Optional[float], burst: int = 1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def argo_connection_from_env() -> tuple[str, Optional[str], bool]:
+    # same variables the argo CLI reads
+    server = os.environ.get("ARGO_SERVER", "localhost:2746")
+    if "://" not in server:
+        secure = os.environ.get("ARGO_SECURE", "true").lower() != "false"
+        server = f"{'https' if secure else 'http'}://{server}"
+    token = os.environ.get("ARGO_TOKEN")
+    insecure = os.environ.get("ARGO_INSECURE_SKIP_VERIFY", "false").lower() == "true"
+    return server, token, insecure
+
+
+def auth_headers(token: Optional[str]) -> dict:
+    if not token:
+        return {}
+    return {"Authorization": token if " " in token else f"Bearer {token}"}
+
+
+def load_workflows(path: str) -> list[dict]:
+    with open(path, "r") as f:
+        return [
+            doc for doc in yaml.load_all(f, Loader=Loader)
+            if doc and doc.get("kind") == "Workflow"
+        ]
+
+
+class WorkflowSubmitter:
+    """
+    Submits workflows through the Argo server REST API
+    (POST /api/v1/workflows/{namespace}) from a bounded thread pool.
+    """
+
+    def __init__(
+        self,
+        server: str,
+        namespace: str,
+        token: Optional[str] = None,
+        workers: int = 16,
+        rate: Optional[float] = None,
+        burst: int = 1,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 10.0,
+        insecure: bool = False,
+    ):
+        self.server = server.rstrip("/")
+        self.namespace = namespace
+        self.token = token
+        self.workers = workers
+        self.limiter = RateLimiter(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.ssl_context = ssl._create_unverified_context() if insecure else None
+
+    @classmethod
+    def from_env(cls, namespace: str, **kwargs) -> "WorkflowSubmitter":
+        server, token, insecure = argo_connection_from_env()
+        kwargs.setdefault("token", token)
+        kwargs.setdefault("insecure", insecure)
+        return cls(server, namespace, **kwargs)
+
+    def submit_file(self, path: str) -> list[SubmitResult]:
+        return self.submit_all(load_workflows(path))
+
+    def submit_all(self, workflows: list[dict], offsets: Optional[list[float]] = None) -> list[SubmitResult]:
+        """
+        Submit every workflow as fast as the pool and rate limit allow, or, with
+        offsets (seconds from now, ascending), each one no earlier than its offset.
+        """
+        # bodies are encoded up front so workers only do I/O once started
+        bodies = [
+            json.dumps({"namespace": self.namespace, "workflow": wf}).encode()
+            for wf in workflows
+        ]
+        names = [wf["metadata"].get("generateName") or wf["metadata"].get("name") for wf in workflows]
+        origin = time.time()
+        scheduled = [None] * len(bodies) if offsets is None else [origin + o for o in offsets]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(self._submit_one, range(len(bodies)), names, bodies, scheduled))
+
+        failed = [r for r in results if not r.ok]
+        if results:
+            skew = max(r.submit_end for r in results) - min(r.submit_start for r in results)
+            log.info(f"Submitted {len(results) - len(failed)}/{len(results)} workflows in {skew:.2f}s")
+        for r in failed:
+            log.error(f"Submitting {r.generate_name} failed after {r.attempts} attempts: {r.error}")
+        return results
+
+    def stop(self, name: str) -> Optional[int]:
+        """Ask Argo to stop a running workflow (PUT /api/v1/workflows/{namespace}/{name}/stop)"""
+        url = f"{self.server}/api/v1/workflows/{self.namespace}/{name}/stop"
+        headers = {"Content-Type": "application/json", **auth_headers(self.token)}
+        body = json.dumps({"name": name, "namespace": self.namespace}).encode()
+        request = urllib.request.Request(url, data=body, headers=headers, method="PUT")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout, context=self.ssl_context) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            log.warning(f"Stopping {name} failed: {e.code} {e.read().decode(errors='replace')[:200]}")
+            return e.code
+        except (urllib.error.URLError, OSError) as e:
+            log.warning(f"Stopping {name} failed: {e}")
+            return None
+
+    def _submit_one(self, index: int, generate_name: str, body: bytes, scheduled: Optional[float] = None) -> SubmitResult:
+        url = f"{self.server}/api/v1/workflows/{self.namespace}"
+        headers = {"Content-Type": "application/json", **auth_headers(self.token)}
+        if scheduled is not None:
+            time.sleep(max(scheduled - time.time(), 0))
+
+        status, error = None, None
+        start = None
+        for attempt in range(1, self.retries + 2):
+            self.limiter.acquire()
+            if start is None:
+                start = time.time()
+            request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout, context=self.ssl_context) as response:
+                    created = json.load(response)
+                    status = response.status
+                return SubmitResult(
+                    index, generate_name, self.namespace, created["metadata"]["name"],
+                    start, time.time(), attempt, status, scheduled=scheduled,
+                )
+            except urllib.error.HTTPError as e:
+                status, error = e.code, e.read().decode(errors="replace")[:500]
+                if e.code not in RETRY_STATUS:
+                    break
+            except (urllib.error.URLError, OSError) as e:
+                status, error = None, str(e)
+            if attempt <= self.retries:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+        return SubmitResult(index, generate_name, self.namespace, None, start, time.time(), attempt, status, error, scheduled)
+
+
+def write_submit_log(results: list[SubmitResult], path: str) -> None:
+    if not results:
+        return
+    rows = [r.to_row() for r in results]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def summarize(results: list[SubmitResult]) -> dict:
+    ok = [r for r in results if r.ok]
+    return {
+        "submitted": len(ok),
+        "failed": len(results) - len(ok),
+        "first_submit": min((r.submit_start for r in results), default=None),
+        "last_submit": max((r.submit_end for r in results), default=None),
+        # how far an open-loop schedule fell behind, 0 when submitted unscheduled
+        "max_lag": max((r.submit_start - r.scheduled for r in results if r.scheduled), default=0.0),
+    }
+
+
+def fake_server(port: int = 0, statuses: Iterable[int] = (), delay: float = 0.0) -> ThreadingHTTPServer:
+    """
+    A stand-in Argo server for trying out submissions. POST
+    /api/v1/workflows/{namespace} answers with the next status of statuses,
+    and once they run out creates the workflow under its generateName plus a
+    counter. Every request waits delay seconds first. server.requests records
+    (time, path, status) per request; run it with serve_forever().
+    """
+    statuses = iter(statuses)
+    requests = []
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status: int, value) -> None:
+            body = json.dumps(value).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self):
+            received = time.time()
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(delay)
+            with lock:
+                status = next(statuses, 200)
+                requests.append((received, self.path, status))
+                count = len(requests)
+            if status != 200:
+                return self._reply(status, {"code": status, "message": "fake failure"})
+            if self.command == "PUT":
+                return self._reply(200, {"metadata": {"name": body.get("name")}})
+            workflow = body["workflow"]
+            name = f"{workflow['metadata'].get('generateName', 'workflow-')}{count:05d}"
+            self._reply(200, dict(workflow, metadata=dict(workflow["metadata"], name=name)))
+
+        do_POST = _handle
+        do_PUT = _handle
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.requests = requests
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Submit generated Argo workflows concurrently")
+    parser.add_argument("workflow_file")
+    parser.add_argument("--namespace", "-n", required=True)
+    parser.add_argument("--server", help="Argo server URL, defaults to $ARGO_SERVER")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=None, help="max submissions per second")
+    parser.add_argument("--burst", type=int, default=1)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--log", default="submit-log.csv", help="per-workflow submit timestamps")
+    parser.add_argument("--fake", action="store_true", help="submit to an in-process stand-in Argo server")
+    args = parser.parse_args()
+
+    options = dict(workers=args.workers, rate=args.rate, burst=args.burst,
+                   retries=args.retries, timeout=args.timeout)
+    if args.fake:
+        fake = fake_server()
+        threading.Thread(target=fake.serve_forever, daemon=True).start()
+        args.server = f"http://127.0.0.1:{fake.server_address[1]}"
+    if args.server:
+        submitter = WorkflowSubmitter(args.server, args.namespace, token=os.environ.get("ARGO_TOKEN"), **options)
+    else:
+        submitter = WorkflowSubmitter.from_env(args.namespace, **options)
+
+    results = submitter.submit_file(args.workflow_file)
+    write_submit_log(results, args.log)
+    summary = summarize(results)
+    print(f"✅ Submitted {summary['submitted']} workflows ({summary['failed']} failed), log in {args.log}")
@@ -0,0 +1,53 @@
+import os
+import re
+
+import pytest
+
+from loadgen import DATA_ROOT, user_workflows
+from submitter import load_workflows
+
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "..", "pipeline", "output")
+PATH = re.compile(r"/mnt/data[^\s\"',;\]]*")
+
+
+def data_paths(value, key=None):
+    """Every /mnt/data path in a workflow spec, with the key it sits under"""
+    if isinstance(value, str):
+        return [(key, path) for path in PATH.findall(value)]
+    if isinstance(value, list):
+        return [p for v in value for p in data_paths(v, key)]
+    if isinstance(value, dict):
+        return [p for k, v in value.items() for p in data_paths(v, k)]
+    return []
+
+
+@pytest.mark.parametrize("name", ["pipeline_reuse.yaml", "pipeline_noreuse.yaml"])
+def test_isolated_users_stay_under_the_mount(name):
+    templates = load_workflows(os.path.join(OUTPUT_DIR, name))
+    users = 2 * len(templates)
+    instances = user_workflows(templates, users, reuse_users=0)
+
+    for user, wf in enumerate(instances):
+        template = templates[user % len(templates)]
+        paths = data_paths(wf["spec"])
+        mounts = {path for key, path in paths if key == "mountPath"}
+        assert mounts == {path for key, path in data_paths(template["spec"]) if key == "mountPath"}
+        assert [t.get("volumes") for t in wf["spec"]["templates"]] == [t.get("volumes") for t in template["spec"]["templates"]]
+
+        for key, path in paths:
+            if key == "mountPath":
+                continue
+            assert path == f"{DATA_ROOT}/user-{user}" or path.startswith(f"{DATA_ROOT}/user-{user}/"), path
+            assert any(path.startswith(mount.rstrip("/") + "/") for mount in mounts), path
+
+    # users of the same template share no path
+    for user in range(len(templates)):
+        first = {p for k, p in data_paths(instances[user]["spec"]) if k != "mountPath"}
+        second = {p for k, p in data_paths(instances[user + len(templates)]["spec"]) if k != "mountPath"}
+        assert first and not first & second
+
+
+def test_overlapping_users_keep_the_template_paths():
+    templates = load_workflows(os.path.join(OUTPUT_DIR, "pipeline_reuse.yaml"))
+    instances = user_workflows(templates, len(templates), reuse_users=len(templates))
+    assert [wf["spec"] for wf in instances] == [t["spec"] for t in templates]
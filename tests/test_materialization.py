@@ -0,0 +1,48 @@
+import os
+
+from materialization import DONE_MARKER, LEDGER, cache_entries, collect
+
+COSTS = {
+    "stages": {"data-preprocess": 30.0, "evaluation": 5.0},
+    "outputs": {},
+    "cache": cache_entries({
+        "0a1b2c3d": {"stage": "data-preprocess", "upstream": []},
+        "4e5f6a7b": {"stage": "evaluation", "upstream": ["0a1b2c3d"]},
+    }),
+}
+
+
+def write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+def pvc(root):
+    """A PVC with two stage cache entries, a parser output and an unrelated file"""
+    for entry in ("0a1b2c3d", "4e5f6a7b"):
+        write(os.path.join(root, "argo-shard", "cache", entry, "data.csv"), 1000)
+        write(os.path.join(root, "argo-shard", "cache", entry, DONE_MARKER), 0)
+    write(os.path.join(root, "pipeline-a_evaluation_output_0123abcd", "report.json"), 500)
+    write(os.path.join(root, "notes.txt"), 10)
+    return root
+
+
+def test_cache_entries_are_collected(tmp_path):
+    root = pvc(str(tmp_path))
+    stats = collect(root, COSTS, budget=1500)
+
+    assert stats["intermediates"] == 3
+    # the cheap evaluation entry goes, the preprocess output two calls depend on stays
+    assert os.path.join("argo-shard", "cache", "4e5f6a7b") in stats["evicted_paths"]
+    assert not os.path.exists(os.path.join(root, "argo-shard", "cache", "4e5f6a7b"))
+    assert os.path.exists(os.path.join(root, "argo-shard", "cache", "0a1b2c3d", DONE_MARKER))
+    assert os.path.exists(os.path.join(root, "notes.txt"))
+
+
+def test_zero_budget_wipes_the_pvc(tmp_path):
+    root = pvc(str(tmp_path))
+    stats = collect(root, COSTS, budget=0)
+
+    assert stats["wiped"] and stats["evicted"] == 3
+    assert os.listdir(root) == [LEDGER]
@@ -0,0 +1,47 @@
+import pytest
+
+from bench_generators import synthetic_config
+from dag_utils import MERGE_IMAGE
+from parser_noreuse import generate_argo_with_parallel
+from parser_reuse import generate_argo_with_reuse
+
+
+def sharded_config(shards=3):
+    config = synthetic_config(pipelines=1, stages=3, width=1, params=1)
+    stage = config["stages"][0]
+    stage["parameters"].update({"n_rows": {"type": "int"}, "seed": {"type": "int"}})
+    stage["sharding"] = {"rows": "n_rows", "shards": shards}
+    config["pipelines"][0]["flow"][0]["parameters"]["n_rows"] = 10
+    return config
+
+
+@pytest.mark.parametrize("generate", [generate_argo_with_reuse, generate_argo_with_parallel])
+@pytest.mark.parametrize("dag", [False, True])
+def test_sharded_calls_fan_out_and_merge(generate, dag):
+    [workflow] = generate(sharded_config(), dag=dag)
+    templates = {t["name"]: t for t in workflow["spec"]["templates"]}
+    entrypoint = templates[workflow["spec"]["entrypoint"]]
+    steps = entrypoint["dag"]["tasks"] if dag else [s for group in entrypoint["steps"] for s in group]
+    fan, merge = steps[0], steps[1]
+
+    items = fan["withItems"]
+    assert [int(item["n_rows"]) for item in items] == [4, 3, 3]
+    assert len({item["seed"] for item in items}) == 3
+    assert [item["output_file"] for item in items] == [f"out-0.shard-{i}.csv" for i in range(3)]
+    if generate is generate_argo_with_reuse:
+        assert len({item["output_dir"] for item in items}) == 3
+    assert {p["name"] for p in templates[fan["template"]]["inputs"]["parameters"]} == set(items[0])
+
+    merge_template = templates[merge["template"]]
+    assert merge_template["container"]["image"] == MERGE_IMAGE
+    arguments = {p["name"]: p["value"] for p in merge["arguments"]["parameters"]}
+    assert arguments == {"inputs": ",".join(i["output_file"] for i in items), "output_file": "out-0.csv"}
+    if dag:
+        assert merge["dependencies"] == [fan["name"]]
+        # stage-1 reads the merged file
+        assert steps[2]["dependencies"] == [merge["name"]]
+
+
+def test_unsharded_config_has_no_merge():
+    [workflow] = generate_argo_with_reuse(synthetic_config(pipelines=1, stages=3, width=1, params=1))
+    assert not any(t["name"].startswith("merge-") for t in workflow["spec"]["templates"])
@@ -0,0 +1,181 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from analysis.attribution import ACCESS_LOG, attach_access_log
+from analysis.runs import RUN_TIME_FORMAT, RUN_TIMEZONE
+from materialization import flush_proxy
+
+SCRIPT = os.path.join(os.path.dirname(__file__), "..", "pipeline", "service_proxy.py")
+SERVICE = "generate-name"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"nothing listening on {port}")
+
+
+@pytest.fixture
+def proxy():
+    processes = []
+
+    def start(delay=0.0, fail_every=0, ttl=600.0, access_log=None):
+        stub, port, admin = free_port(), free_port(), free_port()
+        processes.append(subprocess.Popen(
+            [sys.executable, SCRIPT, "stub", "--port", str(stub), "--delay", str(delay), "--fail-every", str(fail_every)],
+            stderr=subprocess.DEVNULL,
+        ))
+        processes.append(subprocess.Popen(
+            [sys.executable, SCRIPT, "serve", "--route", f"{SERVICE}:{port}=127.0.0.1:{stub}",
+             "--ttl", str(ttl), "--admin-port", str(admin), *(["--access-log", access_log] if access_log else [])],
+            stderr=subprocess.DEVNULL,
+        ))
+        for p in (stub, port, admin):
+            wait_for(p)
+        return Endpoints(stub, port, admin)
+
+    yield start
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+
+class Endpoints:
+    def __init__(self, stub: int, port: int, admin: int):
+        self.stub, self.port, self.admin = stub, port, admin
+
+    def call(self, **fields) -> tuple[int, str, dict]:
+        body = urllib.parse.urlencode(fields).encode()
+        request = urllib.request.Request(f"http://127.0.0.1:{self.port}/run", data=body, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status, response.headers["X-Proxy-Cache"], json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers["X-Proxy-Cache"], json.load(e)
+
+    def upstream_calls(self) -> int:
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.stub}/calls", timeout=10) as response:
+            return json.load(response)["calls"]
+
+    def flush(self, paths=None) -> int:
+        body = json.dumps({} if paths is None else {"paths": paths}).encode()
+        request = urllib.request.Request(f"http://127.0.0.1:{self.admin}/flush", data=body, method="POST")
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.load(response)["flushed"]
+
+
+FIELDS = {"n_rows": "100", "output_dir": "/mnt/data/full_generate-name_output_0a1b2c3d"}
+
+
+def test_identical_calls_in_flight_go_upstream_once(proxy):
+    endpoints = proxy(delay=0.5)
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: endpoints.call(**FIELDS), range(8)))
+
+    assert [status for status, _, _ in results] == [200] * 8
+    assert sorted(result for _, result, _ in results) == ["coalesced"] * 7 + ["miss"]
+    assert len({body["call"] for _, _, body in results}) == 1
+    assert endpoints.upstream_calls() == 1
+
+
+def test_field_order_does_not_matter(proxy):
+    endpoints = proxy()
+    endpoints.call(n_rows="100", output_dir=FIELDS["output_dir"])
+    assert endpoints.call(output_dir=FIELDS["output_dir"], n_rows="100")[1] == "hit"
+    assert endpoints.call(n_rows="200", output_dir=FIELDS["output_dir"])[1] == "miss"
+    assert endpoints.upstream_calls() == 2
+
+
+def test_cached_responses_expire(proxy):
+    endpoints = proxy(ttl=1.0)
+    assert endpoints.call(**FIELDS)[1] == "miss"
+    assert endpoints.call(**FIELDS)[1] == "hit"
+    time.sleep(1.2)
+    assert endpoints.call(**FIELDS)[1] == "miss"
+    assert endpoints.upstream_calls() == 2
+
+
+def test_server_errors_are_not_cached(proxy):
+    endpoints = proxy(fail_every=1)
+    first, second = endpoints.call(**FIELDS), endpoints.call(**FIELDS)
+
+    assert (first[0], first[1]) == (500, "miss")
+    assert (second[0], second[1]) == (500, "miss")
+    assert endpoints.upstream_calls() == 2
+
+
+def test_flush_drops_calls_on_evicted_paths(proxy):
+    endpoints = proxy()
+    endpoints.call(**FIELDS)
+    endpoints.call(n_rows="100", output_dir="/mnt/data/other_generate-name_output_4e5f6a7b")
+
+    assert endpoints.flush(["/mnt/data/unrelated"]) == 0
+    # what the PVC cleaner sends after evicting, paths relative to the PVC root
+    url = f"http://127.0.0.1:{endpoints.admin}/flush"
+    assert flush_proxy(url, ["full_generate-name_output_0a1b2c3d"]) == 1
+    assert endpoints.call(**FIELDS)[1] == "miss"
+    assert endpoints.call(n_rows="100", output_dir="/mnt/data/other_generate-name_output_4e5f6a7b")[1] == "hit"
+    assert endpoints.flush() == 2
+
+
+def test_access_log_is_copied_into_the_run(proxy, tmp_path):
+    access_log = str(tmp_path / "access.jsonl")
+    endpoints = proxy(access_log=access_log)
+    before = time.time()
+    endpoints.call(**FIELDS)
+    endpoints.call(**FIELDS)
+
+    with open(access_log) as f:
+        lines = [json.loads(line) for line in f]
+    assert [(line["service"], line["result"], line["status"]) for line in lines] == [(SERVICE, "miss", 200), (SERVICE, "hit", 200)]
+    assert before <= lines[0]["start"] <= lines[0]["end"]
+    assert lines[0]["output"] == FIELDS["output_dir"]
+
+    # an earlier run's request in the shared log stays out
+    with open(access_log, "a") as f:
+        f.write(json.dumps({**lines[0], "start": before - 3600, "end": before - 3599}) + "\n")
+    run_dir = tmp_path / "run"
+    run_dir.mkdir()
+    window = [datetime.fromtimestamp(t, ZoneInfo(RUN_TIMEZONE)).strftime(RUN_TIME_FORMAT) for t in (before - 1, time.time() + 1)]
+    (run_dir / "run.json").write_text(json.dumps({
+        "treatment_start": window[0], "treatment_end": window[1], "user_data": {"proxy_access_log": access_log},
+    }))
+
+    assert attach_access_log(str(run_dir)) == str(run_dir / ACCESS_LOG)
+    with open(run_dir / ACCESS_LOG) as f:
+        assert [json.loads(line)["result"] for line in f] == ["miss", "hit"]
+
+
+def test_missing_access_log_is_reported(tmp_path, caplog):
+    run_dir = tmp_path / "run"
+    run_dir.mkdir()
+    (run_dir / "run.json").write_text(json.dumps({
+        "treatment_start": "2026_01_20_12_00_00", "treatment_end": "2026_01_20_12_01_20",
+        "user_data": {"proxy_access_log": str(tmp_path / "elsewhere.jsonl")},
+    }))
+
+    assert attach_access_log(str(run_dir)) is None
+    assert "not on this host" in caplog.text
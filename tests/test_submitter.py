@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from submitter import RateLimiter, WorkflowSubmitter, fake_server, summarize
+
+
+WORKFLOW = {"apiVersion": "argoproj.io/v1alpha1", "kind": "Workflow", "metadata": {"generateName": "wf-"}}
+
+
+@pytest.fixture
+def argo():
+    servers = []
+
+    def start(statuses=(), delay=0.0):
+        server = fake_server(statuses=statuses, delay=delay)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_retries_throttled_and_failed_submissions(argo):
+    server, url = argo(statuses=[429, 503, 500])
+    [result] = WorkflowSubmitter(url, "ns", retries=3, backoff=0.01).submit_all([WORKFLOW])
+
+    assert result.ok
+    assert result.name.startswith("wf-")
+    assert result.attempts == 4
+    assert [status for _, _, status in server.requests] == [429, 503, 500, 200]
+
+
+def test_gives_up_after_retries(argo):
+    server, url = argo(statuses=[503] * 10)
+    [result] = WorkflowSubmitter(url, "ns", retries=2, backoff=0.01).submit_all([WORKFLOW])
+
+    assert not result.ok
+    assert (result.attempts, result.status) == (3, 503)
+    assert len(server.requests) == 3
+
+
+def test_no_backoff_after_the_last_attempt(argo):
+    server, url = argo(statuses=[503] * 10)
+    [result] = WorkflowSubmitter(url, "ns", retries=1, backoff=0.3).submit_all([WORKFLOW])
+
+    # one 0.3s wait between the two attempts, not another 0.6s after giving up
+    assert not result.ok
+    assert result.submit_end - result.submit_start < 0.6
+
+
+def test_client_errors_are_not_retried(argo):
+    server, url = argo(statuses=[400])
+    [result] = WorkflowSubmitter(url, "ns", retries=3, backoff=0.01).submit_all([WORKFLOW])
+
+    assert not result.ok
+    assert (result.attempts, result.status) == (1, 400)
+    assert "fake failure" in result.error
+    assert summarize([result])["failed"] == 1
+
+
+def test_rate_limit_spaces_out_concurrent_submissions(argo):
+    server, url = argo()
+    results = WorkflowSubmitter(url, "ns", workers=8, rate=20, burst=1).submit_all([WORKFLOW] * 8)
+
+    assert all(r.ok for r in results)
+    assert len({r.name for r in results}) == 8
+    received = sorted(t for t, _, _ in server.requests)
+    # one token up front, then one every 50 ms
+    assert received[-1] - received[0] >= 7 / 20 * 0.9
+
+
+def test_rate_limiter_allows_a_burst():
+    limiter = RateLimiter(rate=10, burst=3)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.05
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_timeout_is_reported_and_retried(argo):
+    server, url = argo(delay=0.5)
+    [result] = WorkflowSubmitter(url, "ns", retries=1, backoff=0.01, timeout=0.1).submit_all([WORKFLOW])
+
+    assert not result.ok
+    assert result.status is None
+    assert "timed out" in result.error
+    assert result.attempts == 2
+
+
+def test_scheduled_offsets_are_kept(argo):
+    server, url = argo()
+    results = WorkflowSubmitter(url, "ns", workers=4).submit_all([WORKFLOW] * 3, offsets=[0.0, 0.1, 0.2])
+
+    assert all(r.submit_start >= r.scheduled for r in results)
+    assert summarize(results)["max_lag"] < 0.1
+
+
+def test_stop(argo):
+    server, url = argo()
+    assert WorkflowSubmitter(url, "ns").stop("wf-00001") == 200
+    assert server.requests[0][1] == "/api/v1/workflows/ns/wf-00001/stop"
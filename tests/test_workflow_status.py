@@ -0,0 +1,62 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from workflow_status import breakdown, execution_critical_path, load_snapshots, stage_breakdown, stage_summary
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "run")
+WORKFLOW = "evaluation-only-x7k2p"
+
+
+@pytest.fixture
+def run_dir(tmp_path):
+    path = tmp_path / "run"
+    shutil.copytree(FIXTURE, path)
+    # other JSON files one level down in a run directory
+    for other in ("columnar/manifest.json", "backfill-cache/chunk-0000.json"):
+        os.makedirs(path / os.path.dirname(other), exist_ok=True)
+        with open(path / other, "w") as f:
+            json.dump({"version": "1.0"}, f)
+    return str(path)
+
+
+def test_load_snapshots_reads_only_workflow_snapshots(run_dir):
+    snapshots = load_snapshots(run_dir)
+    assert [s["workflow"]["metadata"]["name"] for s in snapshots] == [WORKFLOW]
+    assert load_snapshots(os.path.join(run_dir, "workflows")) == snapshots
+
+
+def test_load_snapshots_of_a_run_without_status(run_dir):
+    shutil.rmtree(os.path.join(run_dir, "workflows"))
+    assert load_snapshots(run_dir) == []
+
+
+def test_execution_critical_path_skips_step_groups_and_skipped_nodes(run_dir):
+    [snapshot] = load_snapshots(run_dir)
+    nodes = snapshot["workflow"]["status"]["nodes"]
+    path = execution_critical_path(nodes)
+    assert [nodes[n]["displayName"] for n in path] == ["load-data", "privacy-tracking", "data-quality"]
+
+
+def test_stage_breakdown(run_dir):
+    [snapshot] = load_snapshots(run_dir)
+    rows = {row["stage"]: row for row in stage_breakdown(snapshot)}
+
+    assert set(rows) == {"load-data", "privacy-tracking", "data-quality"}
+    load = rows["load-data"]
+    assert (load["offset"], load["pending"], load["runtime"], load["duration"]) == (0.0, 4.0, 16.0, 20.0)
+    assert rows["privacy-tracking"]["host"] == "worker-2"
+    # never seen Running by the tracker
+    assert rows["data-quality"]["pending"] is None and rows["data-quality"]["runtime"] is None
+    assert all(row["critical"] for row in rows.values())
+    assert sum(row["critical_seconds"] for row in rows.values()) == 70.0
+
+
+def test_stage_summary(run_dir):
+    summary = stage_summary(breakdown(load_snapshots(run_dir)))
+    assert summary.index[0] == "privacy-tracking"
+    assert summary.loc["privacy-tracking", "critical_seconds"] == 30.0
+    assert summary.loc["load-data", "pending_mean"] == 4.0
+    assert summary["critical_share"].eq(1.0).all()
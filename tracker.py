@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+from logging import getLogger
+from typing import Optional
+
+from submitter import argo_connection_from_env, auth_headers
+
+log = getLogger("experiment.tracker")
+
+DONE_PHASES = {"Succeeded", "Failed", "Error"}
+NAMESPACES = ["pipeline", "no-reuse-pipeline"]
+
+
+def _iso_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def workflow_record(wf: dict) -> dict:
+    status = wf.get("status") or {}
+    return {
+        "phase": status.get("phase"),
+        "submitted": wf["metadata"].get("creationTimestamp"),
+        "started": status.get("startedAt"),
+        "finished": status.get("finishedAt"),
+        "nodes": [
+            {
+                "name": node.get("displayName"),
+                "template": node.get("templateName"),
+                "type": node.get("type"),
+                "phase": node.get("phase"),
+                "started": node.get("startedAt"),
+                "finished": node.get("finishedAt"),
+            }
+            for node in (status.get("nodes") or {}).values()
+        ],
+    }
+
+
+class WorkflowTracker:
+    """
+    Follows one Argo watch stream (/api/v1/workflow-events/{namespace}) per
+    namespace and returns as soon as every expected workflow has finished.
+    """
+
+    def __init__(
+        self,
+        server: str,
+        token: Optional[str] = None,
+        insecure: bool = False,
+        read_timeout: float = 30.0,
+        reconnect_delay: float = 1.0,
+        snapshot_dir: Optional[str] = None,
+    ):
+        self.server = server.rstrip("/")
+        self.token = token
+        self.ssl_context = ssl._create_unverified_context() if insecure else None
+        self.read_timeout = read_timeout
+        self.reconnect_delay = reconnect_delay
+        self.snapshot_dir = snapshot_dir
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "WorkflowTracker":
+        server, token, insecure = argo_connection_from_env()
+        kwargs.setdefault("token", token)
+        kwargs.setdefault("insecure", insecure)
+        return cls(server, **kwargs)
+
+    def wait(self, expected: dict[str, set[str]], timeout: Optional[float] = None,
+             cancel: Optional[threading.Event] = None) -> dict:
+        return asyncio.run(self.track(expected, timeout, cancel))
+
+    async def track(self, expected: dict[str, set[str]], timeout: Optional[float] = None,
+                    cancel: Optional[threading.Event] = None) -> dict:
+        """Until every expected workflow finished, the timeout passed or cancel was set"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+
+        # the HTTP streams block, so each one is read on a daemon thread that
+        # hands events to the loop; nothing waits on them at shutdown
+        for namespace in expected:
+            threading.Thread(
+                target=self._read_stream, args=(namespace, loop, queue, stop), daemon=True
+            ).start()
+
+        pending = {(ns, name) for ns, names in expected.items() for name in names}
+        wanted = set(pending)
+        records = {}
+        # node id -> first time it was seen Running; the status only carries
+        # pod creation and finish times, so this splits pending from runtime
+        running = {}
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        try:
+            while pending:
+                if cancel is not None and cancel.is_set():
+                    log.info(f"Cancelled with {len(pending)} workflows still running")
+                    break
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                if cancel is not None:
+                    # cancel is a thread event, so look at it at least once a second
+                    remaining = 1.0 if remaining is None else min(remaining, 1.0)
+                try:
+                    namespace, event_type, wf = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    if deadline is None or time.monotonic() < deadline:
+                        continue
+                    log.warning(f"Timed out with {len(pending)} workflows still running")
+                    break
+
+                key = (namespace, wf["metadata"]["name"])
+                if key not in wanted:
+                    continue
+                record = workflow_record(wf)
+                previous = records.get(key, {})
+                record["observed_finish"] = previous.get("observed_finish")
+                observed = running.setdefault(key, {})
+                for node_id, node in ((wf.get("status") or {}).get("nodes") or {}).items():
+                    if node.get("phase") == "Running" and node_id not in observed:
+                        observed[node_id] = _iso_now()
+                if record["phase"] in DONE_PHASES or event_type == "DELETED":
+                    if key in pending and self.snapshot_dir:
+                        self._snapshot(namespace, wf, observed)
+                    record["observed_finish"] = record["observed_finish"] or _iso_now()
+                    pending.discard(key)
+                records[key] = record
+        finally:
+            stop.set()
+
+        return self._summary(records, pending)
+
+    def _snapshot(self, namespace: str, wf: dict, observed_running: dict) -> None:
+        directory = os.path.join(self.snapshot_dir, namespace)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{wf['metadata']['name']}.json"), "w") as f:
+            json.dump({"workflow": wf, "observed_running": observed_running}, f)
+
+    def _read_stream(self, namespace: str, loop, queue: asyncio.Queue, stop: threading.Event) -> None:
+        url = f"{self.server}/api/v1/workflow-events/{urllib.parse.quote(namespace)}"
+        headers = {"Accept": "application/json", **auth_headers(self.token)}
+
+        while not stop.is_set():
+            try:
+                request = urllib.request.Request(url, headers=headers)
+                with urllib.request.urlopen(
+                    request, timeout=self.read_timeout, context=self.ssl_context
+                ) as response:
+                    for line in response:
+                        if stop.is_set():
+                            return
+                        if not line.strip():
+                            continue
+                        result = json.loads(line).get("result")
+                        if result and result.get("object"):
+                            loop.call_soon_threadsafe(
+                                queue.put_nowait, (namespace, result.get("type"), result["object"])
+                            )
+            except (urllib.error.URLError, socket.timeout, OSError, ValueError) as e:
+                # the initial events of a new watch replay the current state,
+                # so reconnecting never loses a completion
+                log.debug(f"Watch on {namespace} interrupted: {e}")
+            except RuntimeError:
+                return  # event loop already closed
+            stop.wait(self.reconnect_delay)
+
+    def _summary(self, records: dict, pending: set) -> dict:
+        started = [r["started"] for r in records.values() if r["started"]]
+        finished = [r["finished"] for r in records.values() if r["finished"]]
+        return {
+            "tracked": len(records),
+            "completed": sum(r["phase"] in DONE_PHASES for r in records.values()),
+            "unfinished": sorted(f"{ns}/{name}" for ns, name in pending),
+            "first_start": min(started, default=None),
+            "last_finish": max(finished, default=None),
+            "workflows": {f"{ns}/{name}": r for (ns, name), r in sorted(records.items())},
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wait for Argo workflows and record their timings")
+    parser.add_argument("names", nargs="+", help="namespace/workflow-name")
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--output", default="workflow-timings.json")
+    parser.add_argument("--snapshot-dir", default=None, help="keep each finished workflow's status here")
+    args = parser.parse_args()
+
+    expected = {}
+    for item in args.names:
+        namespace, name = item.split("/", 1)
+        expected.setdefault(namespace, set()).add(name)
+
+    summary = WorkflowTracker.from_env(snapshot_dir=args.snapshot_dir).wait(expected, args.timeout)
+    with open(args.output, "w") as f:
+        json.dump(summary, f, indent=4)
+    print(f"✅ {summary['completed']}/{summary['tracked']} workflows finished, timings in {args.output}")
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import shutil
+from glob import glob
+from logging import getLogger
+from typing import Optional
+
+import pandas as pd
+
+from submitter import load_workflows
+
+log = getLogger("experiment.workflow_status")
+
+SNAPSHOT_DIR = "workflows"  # inside a run directory
+
+
+def _ts(value: Optional[str]) -> Optional[pd.Timestamp]:
+    return pd.Timestamp(value) if value else None
+
+
+def _seconds(start: Optional[pd.Timestamp], end: Optional[pd.Timestamp]) -> Optional[float]:
+    if start is None or end is None:
+        return None
+    return max((end - start).total_seconds(), 0.0)
+
+
+def load_snapshots(path: str) -> list[dict]:
+    """
+    Snapshots written by WorkflowTracker, from a run directory (its
+    workflows/<namespace>/) or a snapshot directory
+    """
+    if os.path.isdir(os.path.join(path, SNAPSHOT_DIR)):
+        path = os.path.join(path, SNAPSHOT_DIR)
+    elif os.path.isfile(os.path.join(path, "run.json")):
+        return []  # the run recorded no workflow status
+    snapshots = []
+    for file in sorted(glob(os.path.join(path, "*", "*.json"))):
+        with open(file, "r") as f:
+            snapshot = json.load(f)
+        if not isinstance(snapshot, dict) or "workflow" not in snapshot:
+            log.debug(f"Skipping {file}, not a workflow snapshot")
+            continue
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def pod_dependencies(nodes: dict) -> dict[str, list[str]]:
+    """
+    For every pod node, the pod nodes it had to wait for. Argo links nodes
+    through `children`, with step groups and DAG/steps nodes in between, so
+    the walk goes up through those until it reaches a pod.
+    """
+    parents = {}
+    for node_id, node in nodes.items():
+        for child in node.get("children") or []:
+            parents.setdefault(child, []).append(node_id)
+
+    def nearest_pods(node_id, seen):
+        found = []
+        for parent in parents.get(node_id, []):
+            if parent in seen:
+                continue
+            seen.add(parent)
+            if nodes[parent].get("type") == "Pod":
+                found.append(parent)
+            else:
+                found.extend(nearest_pods(parent, seen))
+        return found
+
+    return {
+        node_id: sorted(set(nearest_pods(node_id, set())))
+        for node_id, node in nodes.items() if node.get("type") == "Pod"
+    }
+
+
+def execution_critical_path(nodes: dict) -> list[str]:
+    """
+    Pod nodes on the chain that determined the makespan: from the pod that
+    finished last, repeatedly step to the dependency that finished last.
+    """
+    dependencies = pod_dependencies(nodes)
+    finished = {
+        node_id: _ts(nodes[node_id].get("finishedAt"))
+        for node_id in dependencies if nodes[node_id].get("finishedAt")
+    }
+    if not finished:
+        return []
+
+    path = [max(finished, key=finished.get)]
+    while True:
+        candidates = [d for d in dependencies[path[-1]] if d in finished]
+        if not candidates:
+            break
+        path.append(max(candidates, key=finished.get))
+    return path[::-1]
+
+
+def stage_breakdown(snapshot: dict) -> list[dict]:
+    """
+    One row per pod of a workflow: pending time (pod created until first seen
+    Running), runtime (until finished) and whether it is on the critical path.
+    Pending/runtime are None when the tracker never saw the pod Running.
+    """
+    wf = snapshot["workflow"]
+    nodes = (wf.get("status") or {}).get("nodes") or {}
+    observed = snapshot.get("observed_running") or {}
+    critical = set(execution_critical_path(nodes))
+    workflow_start = _ts((wf.get("status") or {}).get("startedAt"))
+
+    rows = []
+    for node_id, node in nodes.items():
+        if node.get("type") != "Pod":
+            continue
+        started, finished = _ts(node.get("startedAt")), _ts(node.get("finishedAt"))
+        running = _ts(observed.get(node_id))
+        if running is not None and finished is not None:
+            running = min(running, finished)
+        rows.append({
+            "workflow": wf["metadata"]["name"],
+            "namespace": wf["metadata"].get("namespace"),
+            "stage": node.get("displayName"),
+            "template": node.get("templateName"),
+            "phase": node.get("phase"),
+            "host": node.get("hostNodeName"),
+            "offset": _seconds(workflow_start, started),
+            "pending": _seconds(started, running),
+            "runtime": _seconds(running, finished),
+            "duration": _seconds(started, finished),
+            "critical": node_id in critical,
+            "critical_seconds": _seconds(started, finished) if node_id in critical else 0.0,
+        })
+    return rows
+
+
+def breakdown(snapshots: list[dict]) -> pd.DataFrame:
+    return pd.DataFrame([row for snapshot in snapshots for row in stage_breakdown(snapshot)])
+
+
+def stage_summary(table: pd.DataFrame) -> pd.DataFrame:
+    """Per stage: mean pending and runtime, and the share of workflows where it was critical"""
+    if table.empty:
+        return table
+    grouped = table.groupby("stage")
+    return pd.DataFrame({
+        "pods": grouped.size(),
+        "pending_mean": grouped["pending"].mean(),
+        "runtime_mean": grouped["runtime"].mean(),
+        "duration_mean": grouped["duration"].mean(),
+        "critical_share": grouped["critical"].mean(),
+        "critical_seconds": grouped["critical_seconds"].sum(),
+    }).sort_values("critical_seconds", ascending=False)
+
+
+def template_tasks(workflow: dict) -> list[dict]:
+    """
+    The entrypoint of a generated workflow as a task list in topological order.
+    DAG templates keep their dependencies; steps templates become tasks that
+    depend on the whole previous step group, which is what the barrier does.
+    """
+    templates = {t["name"]: t for t in workflow["spec"]["templates"]}
+    entry = templates[workflow["spec"]["entrypoint"]]
+    if "dag" in entry:
+        return [
+            {"name": t["name"], "dependencies": list(t.get("dependencies") or [])}
+            for t in entry["dag"]["tasks"]
+        ]
+
+    tasks, previous = [], []
+    for group in entry.get("steps") or []:
+        current = [step["name"] for step in group]
+        tasks.extend({"name": name, "dependencies": list(previous)} for name in current)
+        previous = current
+    return tasks
+
+
+def weighted_critical_path(tasks: list[dict], durations: dict[str, float], default: float = 0.0) -> tuple[list[str], float]:
+    """Longest chain by summed duration; tasks without a measured duration weigh `default`"""
+    finish, best = {}, {}
+
+    def rank(name):
+        # ties, e.g. stages that were never measured, go to the longer chain
+        return finish[name], len(best[name])
+
+    for task in tasks:
+        before = max(task["dependencies"], key=rank, default=None)
+        start = finish[before] if before else 0.0
+        finish[task["name"]] = start + durations.get(task["name"], default)
+        best[task["name"]] = (best[before] if before else []) + [task["name"]]
+    if not finish:
+        return [], 0.0
+    last = max(finish, key=rank)
+    return best[last], finish[last]
+
+
+def planned_critical_paths(workflow_file: str, durations: dict[str, float]) -> list[dict]:
+    """Critical path of every workflow in a generated YAML file, weighted by measured stage durations"""
+    rows = []
+    for wf in load_workflows(workflow_file):
+        path, length = weighted_critical_path(template_tasks(wf), durations)
+        rows.append({
+            "workflow": (wf["metadata"].get("generateName") or wf["metadata"].get("name", "")).rstrip("-"),
+            "critical_path": " -> ".join(path),
+            "critical_seconds": length,
+        })
+    return rows
+
+
+def attach(run_dir: str) -> Optional[str]:
+    """Move the snapshots a run recorded in run.json into the run directory"""
+    with open(os.path.join(run_dir, "run.json"), "r") as f:
+        user_data = json.load(f).get("user_data") or {}
+    source = user_data.get("workflow_status")
+    target = os.path.join(run_dir, SNAPSHOT_DIR)
+    if not source or not os.path.isdir(source) or os.path.exists(target):
+        return None
+    shutil.move(source, target)
+    return target
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage pending/runtime and critical path breakdown")
+    parser.add_argument("path", help="run directory (or snapshot directory) with recorded workflow status")
+    parser.add_argument("--generated", nargs="*", default=[], help="generated workflow YAML to compute planned critical paths for")
+    parser.add_argument("--output", default=None, help="per-pod breakdown CSV, defaults to <path>/breakdown.csv")
+    args = parser.parse_args()
+
+    if os.path.isfile(os.path.join(args.path, "run.json")):
+        attach(args.path)
+
+    table = breakdown(load_snapshots(args.path))
+    output = args.output or os.path.join(args.path, "breakdown.csv")
+    table.to_csv(output, index=False)
+    summary = stage_summary(table)
+    print(summary.round(2).to_string())
+
+    durations = summary["duration_mean"].to_dict() if not summary.empty else {}
+    for file in args.generated:
+        for row in planned_critical_paths(file, durations):
+            print(f"{file} {row['workflow']}: {row['critical_path']} ({row['critical_seconds']:.1f}s)")
+    print(f"✅ {len(table)} pods, breakdown in {output}")